@@ -55,11 +55,14 @@ Only worked for netlist containing MOSFETs and Capacitors.
 # Global imports
 ##
 import getopt
+import hashlib
+import heapq
 import re
 import sys
 import textwrap
 import warnings
 
+from collections import Counter
 from decimal import Decimal
 from optparse import OptionParser
 
@@ -87,6 +90,9 @@ _ncombine_res = 0
 # -not implemented yet
 _current_scope = ''
 
+#node names that are the global reference node (compared lowercase)
+_ground_nodes = ('0', 'gnd', 'gnd!')
+
 # Debug options: string of debugging elements to print
 # * - comments
 # follow SPICE element names (c-capacitor, l-inductor)
@@ -123,9 +129,45 @@ def options(args=sys.argv):
     parser.add_option('--no-combine-c', dest='combine_c', action='store_false',
                       default=True, help='Do not combine parallel capacitors')
 
+    parser.add_option('--decouple-c', dest='decouple_c',
+                      default='0', metavar='X',
+                      help='Ground coupling capacitors smaller than X fF'
+                           ', (default: %default)')
+
+    parser.add_option('--decouple-ratio', dest='decouple_ratio',
+                      default='0', metavar='R',
+                      help='Ground coupling capacitors smaller than R times'
+                           ' the total capacitance on their nodes'
+                           ', (default: %default)')
+
+    parser.add_option('--miller', dest='miller', default='1.0', metavar='K',
+                      help='Scale decoupled capacitors by Miller factor K'
+                           ', (default: %default)')
+
+    parser.add_option('--merge-r', dest='merge_r', default=None, metavar='X',
+                      help='Merge nodes connected by resistors of at most'
+                           ' X ohms (default: do not merge)')
+
+    parser.add_option('--prune', dest='prune', action='store_true',
+                      default=False,
+                      help='Remove floating islands and dangling elements')
+
+    parser.add_option('--no-unify-models', dest='unify_models',
+                      action='store_false', default=True,
+                      help='Do not merge identical .model cards')
+
+    parser.add_option('--no-merge-subckts', dest='merge_subckts',
+                      action='store_false', default=True,
+                      help='Do not merge identical .subckt definitions')
+
     parser.add_option('--no-combine-m', dest='combine_m', action='store_false',
                       default=True, help='Do not combine parallel MOSFETs')
 
+    parser.add_option('--cost', dest='cost', action='store_true',
+                      default=False,
+                      help='Report the MNA matrix size, fill-in and device'
+                           ' count before and after each reduction')
+
     parser.add_option('-v', '--verbose', dest='v', action='store_true',
                       default=True, help='Show info and debugging messages (default)')
 
@@ -168,9 +210,24 @@ def options(args=sys.argv):
     opt.dropcap = opt.dropcap * 1e-15
     if opt.v:
         info('Dropping caps < ' + str(opt.dropcap) + ' F')
+
+    #coupling capacitor decoupling
+    opt.decouple_c = float(opt.decouple_c) * 1e-15
+    opt.decouple_ratio = float(opt.decouple_ratio)
+    opt.miller = float(opt.miller)
+    if opt.v and (opt.decouple_c or opt.decouple_ratio):
+        info('Decoupling caps < %s F or < %s of node C, Miller factor %s' %
+             (opt.decouple_c, opt.decouple_ratio, opt.miller))
+    if opt.v:
         info("Combining c's: " + str(opt.combine_c))
         info("Combining m's: " + str(opt.combine_m))
 
+    #merge shorted nodes
+    if opt.merge_r is not None:
+        opt.merge_r = float(opt.merge_r)
+        if opt.v:
+            info('Merging nodes through resistors <= %s ohm' % opt.merge_r)
+
     #linewidth
     _wrapper.line_width = opt.linewidth
 
@@ -223,7 +280,7 @@ class Netlist:
         self.lines.append(line)
     def addElement(self, element):
         self.deck.append(element)
-        self.elements[element.type].append(element)
+        self.elements.setdefault(element.type, []).append(element)
     def addLine(self, line):
         """Add the given non-empty line to netlist after massaging"""
         if line:
@@ -235,7 +292,7 @@ class Netlist:
                 self._addMassagedLine(line)
     def classify(self, line, num=None):
         """Takes a line and creates an appropriate SpiceElement"""
-        return _elementHandler.handler[line[0][0].lower()](line, num=num)
+        return _elementHandler.lookup(line)(line, num=num)
     #finds a "name = value" pair for shrinking
     RE_PARAM = re.compile(r"(\S*)\s*=\s*(\S*)")
 
@@ -309,19 +366,149 @@ class Netlist:
             self._addMassagedLine(mLine)
             self.addElement(self.classify(mLine, num=n))
             currentCard = line
+    def insertElement(self, element, after):
+        """Add element to the netlist, placing it in the deck directly after
+        the existing element 'after'."""
+        self.deck.insert(self.deck.index(after) + 1, element)
+        self.elements.setdefault(element.type, []).append(element)
+    def globalNodes(self):
+        """Returns the set of ground and .global nodes, with every spelling
+        of their names used in the deck (SPICE names are not case sensitive)"""
+        names = set(_ground_nodes)
+        nodes = set(_ground_nodes)
+        for e in self.elements['.']:
+            if e.keyword == '.global':
+                names.update(a.lower() for a in e.args)
+                nodes.update(e.args)
+        for e in self.deck:
+            nodes.update(n for n in _elementNodes(e) + getattr(e, 'ports', [])
+                         if n.lower() in names)
+        return nodes
+    def subcircuits(self):
+        """Returns a list of (subckt, body, ends) for each top-level .subckt
+        definition in deck order.  body holds the cards between .subckt and
+        .ends, including any nested definitions."""
+        defs = []
+        depth = 0
+        for e in self.deck:
+            if e.type == '.' and e.keyword == '.subckt':
+                depth += 1
+                if depth == 1:
+                    start, body = e, []
+                    continue
+            elif e.type == '.' and e.keyword == '.ends' and depth:
+                depth -= 1
+                if depth == 0:
+                    defs.append((start, body, e))
+                    continue
+            if depth:
+                body.append(e)
+        return defs
+    def scopes(self):
+        """Returns a list of element lists, one for the top level followed by
+        one for each .subckt definition (nested ones too) starting with its
+        .subckt card.  Apart from ground and .global nodes, node names are
+        local to their scope."""
+        scopes = [[]]
+        stack = [scopes[0]]
+        for e in self.deck:
+            if e.type == '.' and e.keyword == '.subckt':
+                stack.append([])
+                scopes.append(stack[-1])
+            elif e.type == '.' and e.keyword == '.ends' and len(stack) > 1:
+                stack.pop()
+                continue
+            stack[-1].append(e)
+        return scopes
+    def protectedNodes(self, elements=None):
+        """Returns the set of nodes of elements (default: the whole deck)
+        that must keep their name: the ground node, .global nodes, subcircuit
+        ports and source terminals.  Elements of unknown type can't be
+        renamed, every word on their line counts."""
+        nodes = self.globalNodes()
+        if elements is None:
+            elements = self.deck
+        for e in elements:
+            if e.type == '.' and e.keyword == '.subckt':
+                nodes.update(e.ports)
+            elif e.type in ('v', 'i'):
+                nodes.update(e.nodes())
+            elif e.type == 'spice':
+                words = e.line if isinstance(e.line, list) else e.line.split()
+                nodes.update(w for w in words[1:] if '=' not in w)
+        return nodes
     def removeElement(self, element):
         self.deck.remove(element)
         self.elements[element.type].remove(element)
+    def removeElements(self, elements):
+        """Remove many elements in one pass over the deck"""
+        drop = set(elements)
+        self.deck = [e for e in self.deck if e not in drop]
+        for t, v in self.elements.iteritems():
+            self.elements[t] = [e for e in v if e not in drop]
+    def renameNodes(self, nodemap):
+        """Rename the nodes of every element through nodemap"""
+        for e in self.deck:
+            e.renameNodes(nodemap)
+class NodeUnion:
+    """Union-find (disjoint set) of node names.
+
+    Nodes in 'protected' are never merged with each other, when a protected
+    node is merged with others it becomes the representative node of the set.
+    """
+    def __init__(self, protected=()):
+        self.parent = dict()
+        self.protected = set(protected)
+    def find(self, node):
+        """Returns the representative node of the set containing node"""
+        parent = self.parent
+        root = node
+        while parent.get(root, root) != root:
+            root = parent[root]
+        #path compression
+        while node != root:
+            parent[node], node = root, parent.get(node, root)
+        return root
+    def union(self, n1, n2):
+        """Merge the sets containing n1 and n2, returns False if they could
+        not be merged (same set or both protected)."""
+        r1, r2 = self.find(n1), self.find(n2)
+        if r1 == r2:
+            return False
+        p1, p2 = r1 in self.protected, r2 in self.protected
+        if p1 and p2:
+            return False
+        elif p2:
+            r1, r2 = r2, r1
+        self.parent[r2] = r1
+        return True
+    def mapping(self):
+        """Returns a dict of every merged node to its representative"""
+        return dict((n, self.find(n)) for n in self.parent.keys()
+                    if self.find(n) != n)
 class ElementHandler:
     def __init__(self):
         self.validTypes = '*.abcdefghijklmnopqrstuvwxyz'
         self.handler = dict()
         for t in self.validTypes:
             self.handler[t] = SpiceElement
+        #control statements, keyed by lowercase keyword (e.g. '.model')
+        self.control = dict()
     def add_handler(self, type, handler):
         """Replaces the existing element object definition with the
         given one"""
         self.handler[type] = handler
+    def add_control_handler(self, keyword, handler):
+        """Use handler for control statements starting with keyword instead
+        of the '.' handler"""
+        self.control[keyword.lower()] = handler
+    def lookup(self, line):
+        """Returns the element object definition for the given line"""
+        t = line[0][0].lower()
+        if t == '.':
+            words = line if isinstance(line, list) else line.split()
+            return self.control.get(words[0].lower(), self.handler[t])
+        return self.handler[t]
 # These classes are used to break down the spectrum of SPICE elements
 # into 'classes' of elements.  I.e. 2 node passives, 2-node sources, 4-node 
 # sources,
@@ -333,7 +520,13 @@ class SpiceElement:
         __init__(self, line, num) -> SpiceElement
         __str__(self) -> string spice line
         drop() -> False
+        nodes() -> list of node names
+        renameNodes(nodemap)
+        terminals() -> list of (role, node)
+        label() -> hashable description or None
     """
+    #names of the attributes holding this element's nodes, in netlist order
+    nodeattrs = ()
     def __init__(self, line, num=None):
         """SpiceElement constructor
         line - netlist expanded line
@@ -352,6 +545,23 @@ class SpiceElement:
         """Template for dropping elements that defaults to NO if
         not overidden in the element class"""
         return False
+    def nodes(self):
+        """Returns the list of nodes this element connects to"""
+        return [getattr(self, a) for a in self.nodeattrs]
+    def renameNodes(self, nodemap):
+        """Replaces each node found as a key of nodemap with its value"""
+        for a in self.nodeattrs:
+            n = getattr(self, a)
+            if n in nodemap:
+                setattr(self, a, nodemap[n])
+    def terminals(self):
+        """Returns (role, node) pairs, interchangeable terminals share the
+        same role"""
+        return [(a, getattr(self, a)) for a in self.nodeattrs]
+    def label(self):
+        """Returns a hashable description of everything but the element's
+        name and nodes, None if the element is not understood"""
+        return None
 
 class Passive2NodeElement(SpiceElement):
     """Base class for 2-node elements.
@@ -362,6 +572,7 @@ class Passive2NodeElement(SpiceElement):
     Redefines:
         drop(self, val, mode) -> bool
     """
+    nodeattrs = ('n1', 'n2')
     def __init__(self, line, num):
         SpiceElement.__init__(self, line, num)
         self.type = 'passive2'
@@ -385,6 +596,11 @@ class Passive2NodeElement(SpiceElement):
             print>>s, k+'='+str(v),
 
         return _wrapper.fill(s.getvalue())
+    def terminals(self):
+        """Both terminals are interchangeable"""
+        return [('n', self.n1), ('n', self.n2)]
+    def label(self):
+        return (self.type, self.value, tuple(sorted(self.param.iteritems())))
     def drop(self, val=0.0, mode='<'):
         """Indicate whether to drop the element from the list.
         Occurs iff (val 'mode' self.value)
@@ -414,6 +630,7 @@ class Active2NodeElement(SpiceElement):
     Redefines:
         None
     """
+    nodeattrs = ('n1', 'n2')
     def __init__(self, line, num):
         SpiceElement.__init__(self, line, num)
         self.type = 'active2'
@@ -437,6 +654,8 @@ class Active2NodeElement(SpiceElement):
             print>>s, k + '=' + str(v),
 
         return _wrapper.fill(s.getvalue())
+    def label(self):
+        return (self.type, self.value, tuple(sorted(self.param.iteritems())))
 
 class Active4NodeElement(SpiceElement):
     """Base class for active 4-node elements (xCyS).
@@ -447,6 +666,7 @@ class Active4NodeElement(SpiceElement):
     Redefines:
         None
     """
+    nodeattrs = ('n1', 'n2', 'n3', 'n4')
     def __init__(self, line, num):
         SpiceElement.__init__(self, line, num)
         self.type = 'active4'
@@ -470,6 +690,8 @@ class Active4NodeElement(SpiceElement):
             #if v == 0: continue
             print>>s, k + '=' + str(v),
         return _wrapper.fill(s.getvalue())
+    def label(self):
+        return (self.type, self.value, tuple(sorted(self.param.iteritems())))
 # This is a(n incomplete) definition of the various SPICE elements.
 # 
 # NOTE: When adding a new element type definition, be sure to add a handler
@@ -498,8 +720,71 @@ class ControlElement(SpiceElement):
         SpiceElement.__init__(self, line, num)
         self.type = '.'
         self.typeName = 'ControlElement'
+        arr = line.split()
+        self.keyword = arr[0].lower()
+        self.args = arr[1:]
+    def label(self):
+        return (self.type, self.line.lower())
 _elementHandler.add_handler('.', ControlElement)
 
+class Model(ControlElement):
+    """Assumes SPICE control line:
+
+    .model name type (p1=val p2=val ...)
+    Parameter names are lowercased, values are converted with unit() where
+    possible and otherwise kept as lowercase strings.  Anything that is not
+    a p=val pair is kept in order in self.flags.
+    Provides:
+        family() -> (name, bin)
+        key() -> hashable canonical form of type and parameters
+    """
+    def __init__(self, line, num):
+        ControlElement.__init__(self, line, num)
+        self.typeName = 'Model'
+        arr = line.replace('(', ' ').replace(')', ' ').split()
+        self.name = arr[1]
+        self.mtype = arr[2].lower()
+        self.param = dict()
+        self.flags = []
+        for p in arr[3:]:
+            if '=' not in p:
+                self.flags.append(p.lower())
+                continue
+            k, v = p.split('=', 1)
+            try:
+                v = unit(v)
+            except BadUnitError:
+                v = v.lower()
+            self.param[k.lower()] = v
+    def family(self):
+        """Returns (name, bin) of a binned model card (name.bin), bin is None
+        for unbinned models.  Instances refer to the family name."""
+        name, dot, suffix = self.name.rpartition('.')
+        if dot and suffix.isdigit():
+            return name, int(suffix)
+        return self.name, None
+    def key(self):
+        """Returns the canonical type and parameters, identical models
+        have identical keys regardless of name, case or parameter order"""
+        return (self.mtype, tuple(sorted(self.param.iteritems())),
+                tuple(self.flags))
+_elementHandler.add_control_handler('.model', Model)
+
+class Subckt(ControlElement):
+    """Assumes SPICE control line:
+
+    .subckt name port1 port2 ... p1=val p2=val ...
+    The definition's body is found with Netlist.subcircuits().
+    """
+    def __init__(self, line, num):
+        ControlElement.__init__(self, line, num)
+        self.typeName = 'Subckt'
+        self.name = self.args[0]
+        self.ports = [a for a in self.args[1:]
+                      if '=' not in a and a.lower() != 'params:']
+        self.param = [a.lower() for a in self.args[1:] if '=' in a]
+_elementHandler.add_control_handler('.subckt', Subckt)
+
 class Capacitor(Passive2NodeElement):
     """Assumes SPICE element line:
 
@@ -580,6 +865,7 @@ class Mosfet(SpiceElement):
     """Mosfet constructor takes an array derived from the
     netlist line
     """
+    nodeattrs = ('d', 'g', 's', 'b')
     def __init__(self, line, num):
         if isinstance(line, str):
             line = line.split()
@@ -607,6 +893,12 @@ class Mosfet(SpiceElement):
             if v == 0: continue
             print>>s, k + '=' + str(v),
         return _wrapper.fill(s.getvalue())
+    def terminals(self):
+        """Source and drain are interchangeable"""
+        return [('ds', self.d), ('g', self.g), ('ds', self.s), ('b', self.b)]
+    def label(self):
+        return (self.type, self.model.lower(),
+                tuple(sorted(self.param.iteritems())))
     def isparallel(self, other):
         """Returns True if transistors are parallel
         """
@@ -686,6 +978,42 @@ class Isource(Active2NodeElement):
         self.type = 'i'
         self.typeName = 'Isource'
 _elementHandler.add_handler('i', Isource)
+
+class SubcktInstance(SpiceElement):
+    """Assumes SPICE element line:
+
+    xXXX n1 n2 ... subname [PARAMS:] p1=val p2=val ...
+    The card is written back as read, apart from renamed nodes and subname.
+    """
+    def __init__(self, line, num):
+        SpiceElement.__init__(self, line, num)
+        self.type = 'x'
+        self.typeName = 'SubcktInstance'
+        arr = line.split()
+        self.name = arr[0]
+        self.words = arr
+        #positions of the nodes and subname in words
+        self.wordpos = [i for i, w in enumerate(arr) if i and '=' not in w
+                        and w.lower() != 'params:']
+        words = [arr[i] for i in self.wordpos]
+        self.nodelist = [_current_scope + n for n in words[:-1]]
+        self.subckt = words[-1]
+        self.param = [w for w in arr[1:] if '=' in w]
+    def __str__(self):
+        words = list(self.words)
+        for i, w in zip(self.wordpos, self.nodelist + [self.subckt]):
+            words[i] = w
+        return _wrapper.fill(' '.join(words))
+    def nodes(self):
+        return list(self.nodelist)
+    def renameNodes(self, nodemap):
+        self.nodelist = [nodemap.get(n, n) for n in self.nodelist]
+    def terminals(self):
+        return list(enumerate(self.nodelist))
+    def label(self):
+        return (self.type, self.subckt.lower(),
+                tuple(p.lower() for p in self.param))
+_elementHandler.add_handler('x', SubcktInstance)
 def combineCapacitorsInplace(nlist):
     '''Finds all parallel capacitors and replaces each with a single element
     of equivalent value.  The capacitor is named by the first-occuring name.
@@ -722,6 +1050,519 @@ def combineMosfetsInplace(nlist):
                 nlist.removeElement(x)
 
     return n
+def decoupleCapacitorsInplace(nlist, value=0.0, ratio=0.0, miller=1.0,
+                              ground='0'):
+    '''Replaces small node-to-node coupling capacitors with a grounded
+    capacitor of miller*C on each of their nodes.  A coupling capacitor is
+    small if it is less than value (F) or less than ratio times the total
+    capacitance on either of its nodes.
+
+    Afterwards every node has at most one grounded capacitor: the grounded
+    caps on a node, to any of the ground node names, are merged with
+    Capacitor.combine into the first-occuring one.  Each subcircuit body and
+    the top level are handled separately, since their node names are local.
+    New caps are named <cap>_<node>, made unique among the existing names.
+    Without value or ratio nothing is changed.  Returns the number of
+    decoupled capacitors.'''
+
+    if not value and not ratio:
+        return 0
+
+    names = set(getattr(e, 'name', '').lower() for e in nlist.deck)
+
+    def lump(lumped, node, c):
+        """Merges grounded cap c into the one on node, True if it did"""
+        first = lumped.setdefault(node, c)
+        if first is c:
+            return False
+        #ground aliases (0, gnd) must match for combine()
+        g = first.n2 if first.n1 == node else first.n1
+        if isground(c.n1):
+            c.n1 = g
+        else:
+            c.n2 = g
+        return first.combine(c)
+
+    n = 0
+    for elements in nlist.scopes():
+        caps = [c for c in elements if c.type == 'c']
+
+        #total capacitance on each node, before anything is changed
+        total = dict()
+        for c in caps:
+            total[c.n1] = total.get(c.n1, 0.0) + c.value
+            total[c.n2] = total.get(c.n2, 0.0) + c.value
+
+        #first grounded cap on each node absorbs all the others
+        lumped = dict()
+        coupling = []
+        for c in caps:
+            if isground(c.n1) and isground(c.n2):
+                continue
+            elif isground(c.n1) or isground(c.n2):
+                if lump(lumped, c.n2 if isground(c.n1) else c.n1, c):
+                    nlist.removeElement(c)
+            elif c.n1 != c.n2:
+                coupling.append(c)
+
+        for c in coupling:
+            small = c.value < value or \
+                    c.value < ratio * min(total[c.n1], total[c.n2])
+            if not small:
+                continue
+
+            prev = c
+            for node in (c.n1, c.n2):
+                g = Capacitor('%s_%s %s %s %r' % (c.name, node, node, ground,
+                                                  miller * c.value), c.num)
+                if lump(lumped, node, g):
+                    continue
+                name, k = g.name, 1
+                while name.lower() in names:
+                    name = '%s_%i' % (g.name, k)
+                    k += 1
+                g.name = name
+                names.add(name.lower())
+                nlist.insertElement(g, prev)
+                prev = g
+            nlist.removeElement(c)
+            n += 1
+
+    return n
+def mergeShortsInplace(nlist, value=0.0):
+    '''Collapses nodes connected through resistors of at most value ohms
+    into a single node and removes those resistors.  Ground, .global nodes,
+    subcircuit ports, source terminals and the nodes of elements of unknown
+    type are never merged with each other.
+
+    Each subcircuit body and the top level are merged separately, since
+    their node names are local.  Every element of a scope is renamed to the
+    representative nodes in one pass, R's and C's left shorted by the merge
+    are removed also.  Run this before combining, merged nets expose new
+    parallel elements.
+    Returns the number of removed elements.'''
+
+    drop = set()
+    for elements in nlist.scopes():
+        nodes = NodeUnion(nlist.protectedNodes(elements))
+        drop.update(r for r in elements if r.type == 'r'
+                    and r.value <= value and nodes.union(r.n1, r.n2))
+        nodemap = nodes.mapping()
+        for e in elements:
+            e.renameNodes(nodemap)
+
+    drop.update(e for e in nlist.elements['r'] + nlist.elements['c']
+                if e.n1 == e.n2)
+    nlist.removeElements(drop)
+
+    return len(drop)
+def pruneFloatingInplace(nlist, remove=True):
+    '''Finds elements that cannot affect the simulation:
+        -islands: connected components (not counting connections through
+         ground) that contain no source terminal, subcircuit port or
+         .global node
+        -dangling: R's, C's and L's with a terminal on a node nothing else
+         connects to, repeated until none are left
+
+    Elements of unknown type are assumed to connect to every word on their
+    line and subcircuit instances anchor their nodes, so nothing around them
+    is pruned.  If remove is True the found
+    elements are removed from nlist.
+    Returns the lists (islands, dangling) of found elements.'''
+
+    anchors = nlist.protectedNodes()
+
+    #node index: node -> elements with a terminal on it
+    index = dict()
+    devices = []
+    for e in nlist.deck:
+        if e.type == 'spice':
+            words = e.line if isinstance(e.line, list) else e.line.split()
+            anchors.update(w for w in words[1:] if '=' not in w)
+        elif e.type == 'x':
+            #may hold sources of its own
+            anchors.update(e.nodes())
+        nodes = e.nodes()
+        if not nodes:
+            continue
+        devices.append(e)
+        for n in nodes:
+            index.setdefault(n, []).append(e)
+
+    #BFS over the node index, ground does not connect components
+    seen = set()
+    islands = []
+    for start in index:
+        if start in seen or isground(start):
+            continue
+        seen.add(start)
+        queue = [start]
+        members = []
+        anchored = False
+        for node in queue:
+            anchored = anchored or node in anchors
+            for e in index[node]:
+                members.append(e)
+                for n in e.nodes():
+                    if n not in seen and not isground(n):
+                        seen.add(n)
+                        queue.append(n)
+        if not anchored:
+            islands.extend(members)
+    gone = set(islands)
+    islands = [e for e in devices if e in gone]
+
+    #worklist of dangling nodes, each removal may expose the next one
+    degree = dict()
+    for e in devices:
+        if e not in gone:
+            for n in e.nodes():
+                degree[n] = degree.get(n, 0) + 1
+    dangling = []
+    queue = [n for n, d in degree.iteritems() if d == 1]
+    for node in queue:
+        if degree[node] != 1 or node in anchors or isground(node):
+            continue
+        for e in index[node]:
+            if e not in gone:
+                break
+        if e.type not in ('r', 'c', 'l'):
+            continue
+        gone.add(e)
+        dangling.append(e)
+        for n in e.nodes():
+            degree[n] -= 1
+            if degree[n] == 1:
+                queue.append(n)
+
+    if remove:
+        nlist.removeElements(gone)
+
+    return islands, dangling
+def unifyModelsInplace(nlist):
+    '''Finds .model cards (or families of binned cards) that differ only in
+    name, keeps the first-occuring one and points the MOSFETs using the others
+    to it.  The duplicate cards are removed.  Models named on lines of
+    unknown element type are left alone since those can't be rewritten.
+    Returns the number of model names that were unified.'''
+
+    #words of unparsed elements, which may refer to a model
+    referenced = set()
+    for e in nlist.elements.get('spice', []):
+        words = e.line if isinstance(e.line, list) else e.line.split()
+        referenced.update(w.lower() for w in words[1:])
+
+    families = dict()
+    order = []
+    for e in nlist.elements['.']:
+        if isinstance(e, Model):
+            name, bin = e.family()
+            if name.lower() not in families:
+                order.append(name)
+            families.setdefault(name.lower(), []).append((bin, e))
+
+    kept = dict() #family key -> name
+    rename = dict()
+    drop = []
+    for name in order:
+        cards = families[name.lower()]
+        k = tuple(sorted((bin, e.key()) for bin, e in cards))
+        if k not in kept:
+            kept[k] = name
+        elif name.lower() not in referenced:
+            rename[name.lower()] = kept[k]
+            drop.extend(e for bin, e in cards)
+
+    for m in nlist.elements['m']:
+        m.model = rename.get(m.model.lower(), m.model)
+    nlist.removeElements(drop)
+
+    return len(rename)
+def _digest(obj):
+    return hashlib.sha1(repr(obj)).hexdigest()
+
+def subcktStructure(subckt, body, fixed=()):
+    '''Returns (key, color, items) describing the structure of a subcircuit
+    definition, or None if the body has elements that are not understood or
+    nested definitions.
+
+    key is identical for definitions that are the same apart from their name,
+    internal node names and element order.  Ports are distinguished by
+    position and nodes in 'fixed' (ground, .global) by name, internal nodes
+    are colored by repeatedly hashing their neighborhood until the coloring
+    stops splitting.  items is the list of (label, terminals) of the body.'''
+    items = []
+    for e in body:
+        if e.type == '*':
+            continue
+        label = e.label()
+        if label is None or isinstance(e, Subckt):
+            return None
+        items.append((label, e.terminals()))
+
+    color = dict()
+    for label, terms in items:
+        for role, n in terms:
+            if isground(n):
+                color[n] = ('global', '0')
+            elif n in fixed:
+                color[n] = ('global', n.lower())
+            else:
+                color[n] = ('internal',)
+    for i, p in enumerate(subckt.ports):
+        color[p] = ('port', tuple(j for j, q in enumerate(subckt.ports)
+                                  if q == p))
+
+    color = _refine(color, items)
+
+    key = _digest((len(subckt.ports), sorted(subckt.param),
+                   sorted((label, tuple(sorted((r, color[n]) for r, n in terms)))
+                          for label, terms in items)))
+    return key, color, items
+
+def _refine(color, items):
+    """Returns the colors of the nodes of items after repeatedly hashing
+    each node's color with its neighborhood, until the coloring stops
+    splitting."""
+    ncolors = len(set(color.itervalues()))
+    while True:
+        around = dict((n, []) for n in color)
+        for label, terms in items:
+            for i, (role, n) in enumerate(terms):
+                others = sorted((r, color[m]) for j, (r, m) in enumerate(terms)
+                                if j != i)
+                around[n].append((label, role, tuple(others)))
+        color = dict((n, _digest((color[n], sorted(a))))
+                     for n, a in around.iteritems())
+        count = len(set(color.itervalues()))
+        if count == ncolors:
+            return color
+        ncolors = count
+
+def _isomorphic(a, b, limit=1000):
+    """Returns True if the structures a and b (from subcktStructure) are the
+    same under some mapping of nodes that respects their colors.
+
+    Nodes that share a color are told apart by giving one node of a and a
+    candidate in b a new color and refining again, backtracking if that
+    leads nowhere.  Symmetric nodes then cost one refinement each instead
+    of trying their permutations.  Gives up (returns False) after limit
+    refinements."""
+    key, colora, itemsa = a
+    key, colorb, itemsb = b
+    target = Counter((label, tuple(sorted(terms))) for label, terms in itemsb)
+    tries = [limit]
+
+    def search(ca, cb):
+        classes = dict()
+        for n, c in ca.iteritems():
+            classes.setdefault(c, ([], []))[0].append(n)
+        for n, c in cb.iteritems():
+            if c not in classes:
+                return False
+            classes[c][1].append(n)
+        if [c for c in classes.itervalues() if len(c[0]) != len(c[1])]:
+            return False
+
+        ambiguous = [c for c in classes.itervalues() if len(c[0]) > 1]
+        if not ambiguous:
+            nodemap = dict((na[0], nb[0]) for na, nb in classes.itervalues())
+            mapped = Counter((label, tuple(sorted((r, nodemap[n])
+                                                  for r, n in terms)))
+                             for label, terms in itemsa)
+            return mapped == target
+
+        na, nb = min(ambiguous, key=lambda c: len(c[0]))
+        for m in sorted(nb):
+            if tries[0] <= 0:
+                return False
+            tries[0] -= 1
+            pick = ('picked', ca[na[0]])
+            ca2, cb2 = dict(ca), dict(cb)
+            ca2[na[0]] = cb2[m] = pick
+            if search(_refine(ca2, itemsa), _refine(cb2, itemsb)):
+                return True
+        return False
+
+    return search(colora, colorb)
+
+def mergeSubcktsInplace(nlist):
+    '''Finds .subckt definitions that are structurally identical apart from
+    their name, internal node names and element order.  The first-occuring
+    definition is kept, the others are removed and the X instances using them
+    are pointed to it.  Repeats until no more merge, since merged children
+    make their parents identical.
+    Returns the number of removed definitions.'''
+
+    fixed = nlist.globalNodes()
+    merged = 0
+    while True:
+        kept = dict() #key -> list of (name, structure)
+        rename = dict()
+        drop = []
+        for subckt, body, ends in nlist.subcircuits():
+            structure = subcktStructure(subckt, body, fixed)
+            if structure is None:
+                continue
+            same = kept.setdefault(structure[0], [])
+            for name, other in same:
+                if _isomorphic(structure, other):
+                    rename[subckt.name.lower()] = name
+                    drop.extend([subckt, ends] + body)
+                    break
+            else:
+                same.append((subckt.name, structure))
+
+        if not rename:
+            return merged
+
+        for x in nlist.elements.get('x', []):
+            x.subckt = rename.get(x.subckt.lower(), x.subckt)
+        nlist.removeElements(drop)
+        merged += len(rename)
+
+#nodes of element types that are not parsed, by first letter
+_unparsedNodes = {'d': 2, 'q': 3, 'j': 3, 'z': 3, 'b': 2,
+                  'e': 4, 'g': 4, 'f': 2, 'h': 2, 'k': 0}
+#element types that add a branch current to the MNA unknowns
+_branchTypes = ('v', 'l', 'e', 'h')
+#nonlinear devices needing a model evaluation
+_deviceTypes = ('m', 'd', 'q', 'j', 'z', 'b')
+
+def _elementNodes(e):
+    """Returns the nodes of element e, guessing for unparsed elements"""
+    if e.type != 'spice':
+        return e.nodes()
+    words = e.line if isinstance(e.line, list) else e.line.split()
+    n = _unparsedNodes.get(words[0][0].lower())
+    if n is None:
+        #unknown: connects to every word, as in pruneFloatingInplace
+        return [w for w in words[1:] if '=' not in w]
+    return words[1:1+n]
+
+def flatDevices(nlist):
+    '''Returns (element, nodes) for every element of nlist with subcircuit
+    instances expanded.  Nodes are renamed to instance paths (x1.x2.n),
+    ground and .global nodes keep their names.  Instances of unknown
+    subcircuits are kept as one element connecting their nodes.'''
+    fixed = nlist.globalNodes()
+    defs = dict()
+    inside = set()
+    for subckt, body, ends in nlist.subcircuits():
+        defs[subckt.name.lower()] = (subckt, body)
+        inside.update([subckt, ends] + body)
+
+    flat = []
+    def expand(elements, nodemap, prefix, seen):
+        depth = 0
+        for e in elements:
+            if e.type == '.':
+                #skip nested definitions
+                if e.keyword == '.subckt':
+                    depth += 1
+                elif e.keyword == '.ends':
+                    depth -= 1
+                continue
+            if depth or e.type == '*':
+                continue
+            nodes = []
+            for n in _elementNodes(e):
+                if isground(n):
+                    n = '0'
+                elif n in nodemap:
+                    n = nodemap[n]
+                elif n not in fixed:
+                    n = prefix + n
+                nodes.append(n)
+            d = defs.get(e.subckt.lower()) if e.type == 'x' else None
+            if d and d[0].name.lower() not in seen:
+                subckt, body = d
+                expand(body, dict(zip(subckt.ports, nodes)),
+                       prefix + e.name + '.', seen | set([subckt.name.lower()]))
+            else:
+                flat.append((e, nodes))
+    expand([e for e in nlist.deck if e not in inside], dict(), '', set())
+    return flat
+
+def mnaCost(nlist):
+    '''Estimates the cost of simulating nlist from the structure of its
+    modified nodal analysis (MNA) matrix, with subcircuits expanded.
+    Each element couples all of its nodes and branch currents, which is
+    the pattern of its stamp give or take a few entries.  Returns a dict of:
+        nodes    - non-ground nodes
+        branches - branch currents (V, L, E and H elements)
+        nonzeros - entries of the matrix
+        fill     - entries added by LU factoring in minimum-degree order
+        ops      - multiply-adds of that factorization
+        fets     - MOSFET instances, each one model evaluation
+        fetm     - MOSFETs weighted by their m parameter
+        devices  - all nonlinear device instances (M, D, Q, J, Z, B)
+    '''
+    index = dict()
+    adj = []
+    def unknown(name):
+        if name not in index:
+            index[name] = len(adj)
+            adj.append(set())
+        return index[name]
+
+    cost = dict(nodes=0, branches=0, fets=0, fetm=0, devices=0)
+    for e, nodes in flatDevices(nlist):
+        t = e.type
+        if t == 'spice':
+            words = e.line if isinstance(e.line, list) else e.line.split()
+            t = words[0][0].lower()
+        if t == 'm':
+            cost['fets'] += 1
+            cost['fetm'] += e.param.get('m', 1)
+        if t in _deviceTypes:
+            cost['devices'] += 1
+        if t == 'i':
+            #only on the right hand side
+            continue
+        group = set(unknown(n) for n in nodes if n != '0')
+        if t in _branchTypes:
+            group.add(unknown(('branch', id(e))))
+            cost['branches'] += 1
+        for i in group:
+            adj[i].update(group)
+    cost['nodes'] = len(adj) - cost['branches']
+    cost['nonzeros'] = sum(len(a) for a in adj)
+
+    #minimum-degree elimination on the (symmetric) pattern
+    for i, a in enumerate(adj):
+        a.discard(i)
+    heap = [(len(a), i) for i, a in enumerate(adj)]
+    heapq.heapify(heap)
+    done = set()
+    fill = ops = 0
+    while heap:
+        degree, i = heapq.heappop(heap)
+        if i in done or degree != len(adj[i]):
+            continue
+        done.add(i)
+        around = adj[i]
+        ops += degree * (degree + 1)
+        for j in around:
+            a = adj[j]
+            a.discard(i)
+            n = len(a)
+            a.update(around)
+            a.discard(j)
+            fill += len(a) - n
+            heapq.heappush(heap, (len(a), j))
+        adj[i] = set()
+    cost['fill'] = fill
+    cost['ops'] = ops
+    return cost
+
+def costLine(stage, cost):
+    """Returns mnaCost() results as one line of text"""
+    return ('%-16s %i nodes, %i branches, %i nonzeros, %i fill, %i ops, '
+            '%i fets (m=%g), %i devices' %
+            (stage + ':', cost['nodes'], cost['branches'], cost['nonzeros'],
+             cost['fill'], cost['ops'], cost['fets'], float(cost['fetm']),
+             cost['devices']))
 RE_UNIT = re.compile(r'^([0-9e\+\-\.]+)(t|g|meg|x|k|mil|m|u|n|p|f|a)?')
 def unit(s):
     """Takes a string and returns the equivalent float.
@@ -750,6 +1591,10 @@ def unit(s):
 
     return float(x)
 
+def isground(node):
+    """Returns True if node is the global reference node."""
+    return node.lower() in _ground_nodes
+
 def debug(message):
     """Print debugging info to stderr."""
     for m in message.split('\n'):
@@ -790,6 +1635,51 @@ def main():
                 print>>s, '%s: %i' % (t, len(v))
         info(s.getvalue())
 
+    # Estimated simulation cost as the passes go
+    def cost(stage):
+        if opt.cost:
+            info(costLine(stage, mnaCost(netlist)))
+    cost('input')
+
+    # Collapse shorted nets first, exposes more parallel elements
+    if opt.merge_r is not None:
+        n = mergeShortsInplace(netlist, opt.merge_r)
+        if opt.v:
+            info('Removed %i shorting elements' % n)
+        cost('merge-r')
+
+    # Remove elements that cannot affect the simulation
+    if opt.prune:
+        islands, dangling = pruneFloatingInplace(netlist)
+        if opt.v:
+            info('Pruned %i floating and %i dangling elements' %
+                 (len(islands), len(dangling)))
+            for e in islands + dangling:
+                info('  pruned ' + e.name)
+        cost('prune')
+
+    # Ground small coupling capacitors if requested
+    if opt.decouple_c or opt.decouple_ratio:
+        n = decoupleCapacitorsInplace(netlist, opt.decouple_c,
+                                      opt.decouple_ratio, opt.miller)
+        if opt.v:
+            info('Decoupled %i capacitors' % n)
+        cost('decouple-c')
+
+    # Identical models with different names prevent combining FETs
+    if opt.unify_models:
+        n = unifyModelsInplace(netlist)
+        if opt.v:
+            info('Unified %i duplicate models' % n)
+        cost('unify-models')
+
+    # Identical subcircuits only need to be elaborated once, after model
+    # unification so subcircuits differing only in model names match
+    if opt.merge_subckts:
+        n = mergeSubcktsInplace(netlist)
+        if opt.v:
+            info('Merged %i duplicate subcircuits' % n)
+        cost('merge-subckts')
 
     # Combine elements if requested
     nCombined = dict()
@@ -797,11 +1687,13 @@ def main():
         nCombined['c'] = combineCapacitorsInplace(netlist)
         if opt.v:
             info('Combined %i capacitors' % nCombined['c'])
+        cost('combine-c')
 
     if opt.combine_m:
         nCombined['m'] = combineMosfetsInplace(netlist)
         if opt.v:
             info('Combined %i mosfets' % nCombined['m'])
+        cost('combine-m')
 
     # Show output statistics
     if opt.v:
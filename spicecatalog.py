@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+"""
+spicecatalog.py
+
+Index of simulation result files in an SQLite database: path, format,
+signals with their min/max, sweep variables and values, and row counts.
+Searches across thousands of runs are then queries instead of file opens,
+and the data of the matching runs is only loaded when it is used.
+
+ Usage:
+  spicecatalog.py [-d catalog.db] [-s signal] [-w var=value] [files...]
+
+Licensed by the GPL, see http://www.whiteaudio.com/soft/COPYING or the current
+GNU GPL license for details.
+"""
+
+import os
+import sqlite3
+
+import spicereader
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE,
+    mtime REAL,
+    size INTEGER,
+    format TEXT,
+    nrows INTEGER,
+    sweepvars TEXT
+);
+CREATE TABLE IF NOT EXISTS signals (
+    run INTEGER REFERENCES runs(id) ON DELETE CASCADE,
+    name TEXT,
+    col TEXT,
+    min REAL,
+    max REAL
+);
+CREATE INDEX IF NOT EXISTS signals_name ON signals (name);
+CREATE INDEX IF NOT EXISTS signals_run ON signals (run);
+CREATE TABLE IF NOT EXISTS sweeps (
+    run INTEGER REFERENCES runs(id) ON DELETE CASCADE,
+    sweep INTEGER,
+    var TEXT,
+    value REAL,
+    start INTEGER,
+    stop INTEGER
+);
+CREATE INDEX IF NOT EXISTS sweeps_var ON sweeps (var, value);
+CREATE INDEX IF NOT EXISTS sweeps_run ON sweeps (run);
+"""
+
+
+class Run:
+    """A cataloged result file.  The data is loaded on first use of .data
+    (through the waveform cache)."""
+    def __init__(self, catalog, id, path, format, nrows, sweepvars):
+        self.catalog = catalog
+        self.id = id
+        self.path = path
+        self.format = format
+        self.nrows = nrows
+        self.sweepvars = sweepvars.split() if sweepvars else []
+        self._data = None
+
+    def __repr__(self):
+        return '<Run %s: %i rows, %s>' % (self.path, self.nrows,
+                                          self.format)
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = spicereader.loadSimData(self.path,
+                                                 self.catalog.cache)
+        return self._data
+
+    def signals(self):
+        """Return [(name, min, max), ...] of the run's signals."""
+        return self.catalog.db.execute(
+                'SELECT name, min, max FROM signals WHERE run = ? '
+                'ORDER BY rowid', (self.id,)).fetchall()
+
+    def sweeps(self, var=None):
+        """Return the values of sweep variable var (default the outer one)
+        in sweep order."""
+        var = var or (self.sweepvars[0] if self.sweepvars else None)
+        return [v for v, in self.catalog.db.execute(
+                'SELECT value FROM sweeps WHERE run = ? AND var = ? '
+                'ORDER BY sweep', (self.id, var))]
+
+
+class Catalog:
+    """SQLite catalog of simulation result files, see add() and find()."""
+    def __init__(self, dbfile='spicecatalog.db', cache=None):
+        self.dbfile = dbfile
+        self.cache = cache
+        self.db = sqlite3.connect(dbfile)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, path, force=False):
+        """Index the result file path, unless it is cataloged already and
+        unchanged.  Returns True if it was (re)indexed."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self.db.execute('SELECT mtime, size FROM runs WHERE path = ?',
+                              (path,)).fetchone()
+        if row and tuple(row) == (st.st_mtime, st.st_size) and not force:
+            return False
+
+        d = spicereader.loadSimData(path, self.cache)
+        stats = d.stats(d.siglist)
+        with self.db:
+            self.db.execute('DELETE FROM runs WHERE path = ?', (path,))
+            cur = self.db.execute(
+                    'INSERT INTO runs (path, mtime, size, format, nrows, '
+                    'sweepvars) VALUES (?, ?, ?, ?, ?, ?)',
+                    (path, st.st_mtime, st.st_size, d.meta.get('format'),
+                     len(d.data), ' '.join(d.sweepvars)))
+            run = cur.lastrowid
+            signals = []
+            for i, col in d.colset:
+                name = d.signame(col)
+                signals.append((run, name, col, _real(stats[name]['min']),
+                                _real(stats[name]['max'])))
+            self.db.executemany('INSERT INTO signals VALUES (?, ?, ?, ?, ?)',
+                                signals)
+            rows = []
+            for k, (first, last) in enumerate(d.sweeprows):
+                val = d.sweepvals[k]
+                val = val if isinstance(val, tuple) else (val,)
+                rows.extend((run, k, var, float(v), first, last)
+                            for var, v in zip(d.sweepvars, val))
+            self.db.executemany('INSERT INTO sweeps VALUES (?, ?, ?, ?, ?, ?)',
+                                rows)
+        return True
+
+    def update(self, paths):
+        """Index paths, returns the number of files (re)indexed."""
+        return len([p for p in paths if self.add(p)])
+
+    def prune(self):
+        """Drop runs whose file no longer exists, returns their paths."""
+        gone = [p for p, in self.db.execute('SELECT path FROM runs')
+                if not os.path.exists(p)]
+        with self.db:
+            self.db.executemany('DELETE FROM runs WHERE path = ?',
+                                [(p,) for p in gone])
+        return gone
+
+    def find(self, signal=None, above=None, below=None, sweep=None,
+             format=None, path=None):
+        """Return the Runs matching all of the given conditions:
+            signal - has the signal (attribute name, a complex signal
+                     matches its real part)
+            above  - signal's max is above this
+            below  - signal's min is below this
+            sweep  - (var, value) of a sweep, or just var
+            format - 'gnucap', 'hspice', ...
+            path   - SQL LIKE pattern of the path
+        """
+        sql = ['SELECT DISTINCT runs.id, path, format, nrows, sweepvars '
+               'FROM runs']
+        where, args = [], []
+        if signal:
+            sql.append('JOIN signals ON signals.run = runs.id')
+            where.append('(signals.name = ? OR signals.name = ?)')
+            args.extend([signal, signal + '_0'])
+            if above is not None:
+                where.append('signals.max > ?')
+                args.append(above)
+            if below is not None:
+                where.append('signals.min < ?')
+                args.append(below)
+        if sweep:
+            var, value = sweep if isinstance(sweep, tuple) else (sweep, None)
+            sql.append('JOIN sweeps ON sweeps.run = runs.id')
+            where.append('sweeps.var = ?')
+            args.append(var)
+            if value is not None:
+                # sweep values are floats
+                where.append('abs(sweeps.value - ?) <= ?')
+                args.extend([value, 1e-9 * abs(value)])
+        if format:
+            where.append('format = ?')
+            args.append(format)
+        if path:
+            where.append('path LIKE ?')
+            args.append(path)
+        if where:
+            sql.append('WHERE ' + ' AND '.join(where))
+        sql.append('ORDER BY path')
+        return [Run(self, *row)
+                for row in self.db.execute(' '.join(sql), args)]
+
+
+def _real(x):
+    """NaN is stored as NULL."""
+    x = float(x)
+    return None if x != x else x
+
+
+if __name__ == "__main__":
+    import optparse
+
+    usage = 'usage: %prog [options] [simdata files...]'
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('-d', '--db', dest='db', default='spicecatalog.db',
+                      help='Catalog database file (default %default)')
+    parser.add_option('-s', '--signal', dest='signal',
+                      help='List runs containing SIGNAL')
+    parser.add_option('-w', '--sweep', dest='sweep',
+                      help='List runs with sweep VAR or VAR=VALUE')
+    parser.add_option('--prune', dest='prune', action='store_true',
+                      default=False, help='Drop runs whose files are gone')
+
+    opts, args = parser.parse_args()
+
+    catalog = Catalog(opts.db)
+    if args:
+        print 'Indexed %i of %i files' % (catalog.update(args), len(args))
+    if opts.prune:
+        for p in catalog.prune():
+            print 'Dropped', p
+    if opts.signal or opts.sweep:
+        sweep = opts.sweep
+        if sweep and '=' in sweep:
+            var, value = sweep.split('=', 1)
+            sweep = (var, float(value))
+        for run in catalog.find(signal=opts.signal, sweep=sweep):
+            print run.path
+    catalog.close()
@@ -1,65 +1,1173 @@
 #!/usr/bin/env python
 
+import bz2
+import hashlib
+import json
+import multiprocessing
 import os
+import re
 import numpy as np
-import subprocess as sp
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import socket
 import struct
+import zlib
 import pylab as pyl
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 
 
 NaN = float('NaN')
 
+# HSPICE ends each sweep's data with this value
+HSPICE_END = 1e30
+
+# bytes of ASCII simulation output parsed at a time
+CHUNKSIZE = 1 << 24
+
 def zc(x):
     """Return the flat index array of zero-crossings of x.  Index
     is floor(true-zc-idx)."""
+    s = np.sign(x)
     # entries identical to zero
-    ez = list(np.flatnonzero(x == 0))
-
+    ez = np.flatnonzero(s == 0)
     # sign change, pass thru zero
-    s = np.sign(x)
-    cz = list(np.flatnonzero(s[1:] != s[:-1]))
-
-    # there is an entry in both lists for any ez elements, remove from cz
-    for e in ez:
-        if e-1 in cz:
-            cz.remove(e-1)
-            cz.remove(e)
+    cz = np.flatnonzero((s[1:] != s[:-1]) & (s[1:] != 0) & (s[:-1] != 0))
     y = np.concatenate((ez, cz))
     y.sort()
     return y
 
 
+def crossIndex(y, level=0.0, edge='both', hyst=0.0, starts=None):
+    """Find where y crosses level.  Returns (i, frac, rising): the crossing
+    is between samples i and i+1 at fraction frac of the way, rising is
+    True for rising crossings.
+
+    edge is 'rise', 'fall' or 'both'.  With hyst > 0, y must go beyond
+    level +/- hyst to count as a crossing, the crossing reported is the last
+    pass through level before that.
+
+    starts are the indices where independent segments of y (sweeps) begin,
+    there are no crossings between segments and the hysteresis state starts
+    over in each.
+    """
+    d = y - level
+    n = np.arange(d.size)
+    first = np.zeros(d.size, int)
+    if starts is not None and d.size:
+        first[np.asarray(starts, int)] = starts
+        np.maximum.accumulate(first, out=first)
+    if hyst > 0:
+        # Schmitt trigger: state is held between the thresholds
+        state = np.zeros(d.size, np.int8)
+        state[d > hyst] = 1
+        state[d < -hyst] = -1
+        held = np.where(state != 0, n, -1)
+        np.maximum.accumulate(held, out=held)
+        # not armed until the segment goes beyond a threshold
+        state = np.where(held >= first, state[held], 0)
+        j = np.flatnonzero((state[1:] != state[:-1]) & (state[:-1] != 0)) + 1
+        j = j[first[j] != j]
+        up = state[j] > 0
+        # last sample on the old side of level before the switch
+        lastlow = np.maximum.accumulate(np.where(d <= 0, n, -1))
+        lasthigh = np.maximum.accumulate(np.where(d >= 0, n, -1))
+        i = np.where(up, lastlow[j], lasthigh[j])
+    else:
+        i = np.flatnonzero(((d[:-1] < 0) & (d[1:] >= 0)) |
+                           ((d[:-1] > 0) & (d[1:] <= 0)))
+        i = i[first[i+1] <= i]
+        up = d[i] < 0
+
+    if edge == 'rise':
+        i = i[up]
+    elif edge == 'fall':
+        i = i[~up]
+    elif edge != 'both':
+        raise ValueError("edge must be 'rise', 'fall' or 'both'")
+    d0, d1 = d[i], d[i+1]
+    return i, d0 / (d0 - d1), d0 < d1
+
+
+def crossings(x, y, level=0.0, edge='both', hyst=0.0):
+    """Return the values of x where y crosses level, linearly interpolated
+    between samples.  See crossIndex() for edge and hyst."""
+    i, frac, rising = crossIndex(y, level, edge, hyst)
+    return x[i] + frac * (x[i+1] - x[i])
+
+
+def decimate(x, y, nbuckets):
+    """Reduce (x, y) for plotting to the min and max of y in each of
+    nbuckets runs of samples plus the end points, in x order.  Data that is
+    short already or not a real 1-D trace is returned as is."""
+    n = len(x)
+    if n <= 2*nbuckets + 2 or np.ndim(y) != 1 or len(y) != n or \
+       np.iscomplexobj(y):
+        return x, y
+    k = -(-n // nbuckets)
+    m = n // k
+    blk = y[:m*k].reshape(m, k)
+    base = np.arange(m) * k
+    idx = [base + blk.argmin(1), base + blk.argmax(1), [0, n-1]]
+    if m*k < n:
+        tail = y[m*k:]
+        idx.append([m*k + tail.argmin(), m*k + tail.argmax()])
+    idx = np.unique(np.concatenate(idx))
+    return x[idx], y[idx]
+
+
+class _ArrayInterface:
+    """Holds an __array_interface__ and the array it refers to."""
+    def __init__(self, interface, base):
+        self.__array_interface__ = interface
+        self.base = base
+
+
+def _complexview(re):
+    """Return a complex view of the real parts re, each of which is followed
+    by its imaginary part in memory."""
+    cdtype = np.dtype('c%i' % (2 * re.dtype.itemsize))
+    cdtype = cdtype.newbyteorder(re.dtype.byteorder)
+    interface = dict(re.__array_interface__, typestr=cdtype.str,
+                     descr=[('', cdtype.str)])
+    return np.asarray(_ArrayInterface(interface, re))
+
+
+def _tmpname(fname):
+    """Return a temporary file name next to fname that is unique across
+    hosts sharing the directory."""
+    return '%s.%s.%i.tmp' % (fname, socket.gethostname(), os.getpid())
+
+
+class _NpyWriter:
+    """Write a 2-D .npy file whose number of rows is not known in advance.
+    Rows are appended with write(), close() fixes up the header.  The file is
+    written under a temporary name and renamed into place when closed.
+
+    With fortran=True the rows are rewritten in column-major order on
+    close(), so each column is contiguous in the final file.
+
+    With append=n the file is written in place, keeping its first n values
+    (none for a new file), and sync() makes the rows so far visible to
+    readers of the file.
+    """
+    HEADERLEN = 256
+
+    def __init__(self, fname, dtype, ncols, fortran=False, append=None):
+        self.fname = fname
+        self.dtype = np.dtype(dtype)
+        self.ncols = ncols
+        self.fortran = fortran
+        if append is None:
+            self.tmpname = _tmpname(fname)
+            self.nvals = 0
+            self.fp = open(self.tmpname, 'wb')
+            self._header()
+        else:
+            self.tmpname = fname
+            self.nvals = append
+            self.fp = open(fname, 'r+b' if append else 'w+b')
+            self.fp.truncate(self.HEADERLEN + append * self.dtype.itemsize)
+            self.sync()
+
+    def _header(self):
+        shape = (self.nvals // self.ncols, self.ncols)
+        h = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % \
+                (np.lib.format.dtype_to_descr(self.dtype), shape)
+        h = h.ljust(self.HEADERLEN - 11) + '\n'
+        self.fp.seek(0)
+        self.fp.write(np.lib.format.magic(1, 0))
+        self.fp.write(struct.pack('<H', len(h)) + h)
+
+    def write(self, values):
+        """Append values (rows or a flat run of values) to the array."""
+        values = np.asarray(values, dtype=self.dtype)
+        values.tofile(self.fp)
+        self.nvals += values.size
+
+    def sync(self):
+        """Update the header of a file written in place."""
+        self._header()
+        self.fp.seek(0, os.SEEK_END)
+        self.fp.flush()
+
+    def array(self):
+        """Return the synced rows of a file written in place."""
+        if self.nvals < self.ncols:
+            return np.zeros((0, self.ncols), self.dtype)
+        return np.load(self.fname, 'r')
+
+    def close(self):
+        self._header()
+        self.fp.close()
+        if self.tmpname == self.fname:
+            return
+        if self.fortran and self.nvals:
+            try:
+                self._transpose()
+            except:
+                os.remove(self.tmpname)
+                raise
+        os.rename(self.tmpname, self.fname)
+
+    def _transpose(self):
+        """Rewrite the temporary file in column-major order, a block of rows
+        at a time."""
+        rows = np.load(self.tmpname, 'r')
+        tmp = _tmpname(self.fname + '.f')
+        try:
+            cols = np.lib.format.open_memmap(tmp, 'w+', self.dtype,
+                                             rows.shape, fortran_order=True)
+            step = max(CHUNKSIZE // (self.ncols * self.dtype.itemsize), 256)
+            for i in xrange(0, len(rows), step):
+                cols[i:i+step] = rows[i:i+step]
+            cols.flush()
+            del rows, cols
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        os.rename(tmp, self.tmpname)
+
+    def abort(self):
+        self.fp.close()
+        os.remove(self.tmpname)
+
+
+class _ArrayWriter:
+    """In-memory counterpart of _NpyWriter, grows a 2-D array as rows are
+    appended.  array() returns the filled rows."""
+    def __init__(self, dtype, ncols):
+        self.dtype = np.dtype(dtype)
+        self.ncols = ncols
+        self.nvals = 0
+        self.buf = np.empty(1 << 16, dtype)
+
+    def write(self, values):
+        values = np.ravel(values)
+        end = self.nvals + values.size
+        if end > self.buf.size:
+            buf = np.empty(max(end, self.buf.size + self.buf.size // 2),
+                           self.buf.dtype)
+            buf[:self.nvals] = self.buf[:self.nvals]
+            self.buf = buf
+        self.buf[self.nvals:end] = values
+        self.nvals = end
+
+    def array(self):
+        nrows = self.nvals // self.ncols
+        return self.buf[:nrows*self.ncols].reshape(nrows, self.ncols)
+
+
+class WaveformCache:
+    """Cache of converted simulation data shared by all SimulationData
+    readers.
+
+    Each entry is a .npy data file plus a .json sidecar holding the columns,
+    sweeps and dtype.  The data is stored column-major, so reading one signal
+    of a memory-mapped entry only touches that signal's bytes.  Complex (AC)
+    data is written with fortran=False and stays row-major, which keeps the
+    real and imaginary parts of each signal next to each other.  Entries are
+    named by a key made from the input file's path, size, mtime and a hash of
+    its first and last megabyte.  Files are written under a temporary name
+    and renamed into place, so concurrent jobs never see a partial entry.
+    When the entries grow past budget bytes the least recently used ones are
+    removed.
+
+    The directory and budget default to $SPICEREADER_CACHE (or
+    ~/.spicereader) and $SPICEREADER_CACHE_BUDGET (or 10 GB).
+    """
+    VERSION = 2
+    HASHBYTES = 1 << 20
+    DATAEXT = '.npy'
+
+    def __init__(self, cachedir=None, budget=None):
+        if cachedir is None:
+            cachedir = os.environ.get('SPICEREADER_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.spicereader'))
+        if budget is None:
+            budget = int(os.environ.get('SPICEREADER_CACHE_BUDGET', 10 << 30))
+        self.cachedir = cachedir
+        self.budget = budget
+
+    def key(self, infile):
+        """Return the cache key of infile's current contents."""
+        st = os.stat(infile)
+        h = hashlib.sha1(repr((self.VERSION, os.path.abspath(infile),
+                               st.st_size, st.st_mtime)))
+        fin = open(infile, 'rb')
+        h.update(fin.read(self.HASHBYTES))
+        if st.st_size > self.HASHBYTES:
+            fin.seek(-min(self.HASHBYTES, st.st_size - self.HASHBYTES),
+                     os.SEEK_END)
+            h.update(fin.read())
+        fin.close()
+        return h.hexdigest()
+
+    def path(self, key, ext=None):
+        return os.path.join(self.cachedir, key + (ext or self.DATAEXT))
+
+    def open(self, key, meta):
+        """Return the data of an entry."""
+        return np.load(self.path(key), 'r')
+
+    def load(self, key):
+        """Return (data, meta) of a cached entry or None."""
+        sidecar = self.path(key, '.json')
+        try:
+            meta = json.load(open(sidecar))
+            if meta.get('version') != self.VERSION:
+                return None
+            data = self.open(key, meta)
+            os.utime(sidecar, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return data, meta
+
+    def writer(self, key, dtype, ncols, fortran=True):
+        """Return an _NpyWriter for the data of a new entry, raises IOError
+        or OSError if the cache can't be written."""
+        self.makedir()
+        return _NpyWriter(self.path(key), dtype, ncols, fortran)
+
+    def makedir(self):
+        if not os.path.isdir(self.cachedir):
+            try:
+                os.makedirs(self.cachedir)
+            except OSError:
+                if not os.path.isdir(self.cachedir):
+                    raise
+
+    def _sidecar(self, key, meta):
+        sidecar = self.path(key, '.json')
+        tmp = _tmpname(sidecar)
+        json.dump(dict(meta, version=self.VERSION), open(tmp, 'w'))
+        os.rename(tmp, sidecar)
+
+    def commit(self, key, writer, meta):
+        """Finish an entry started with writer(), the sidecar is written
+        last so an entry is only visible once complete.  Returns the
+        memory-mapped data."""
+        writer.close()
+        self._sidecar(key, meta)
+        self.evict()
+        return self.open(key, meta)
+
+    def followKey(self, infile):
+        """Return the key of the entry following infile as it grows."""
+        return hashlib.sha1(repr(('follow', self.VERSION,
+                                  os.path.abspath(infile)))).hexdigest()
+
+    def _head(self, infile, nbytes):
+        fin = open(infile, 'rb')
+        h = hashlib.sha1(fin.read(min(nbytes, self.HASHBYTES))).hexdigest()
+        fin.close()
+        return h
+
+    def appender(self, key, dtype, ncols):
+        """Return an _NpyWriter appending rows in place to a new followed
+        entry."""
+        self.makedir()
+        return _NpyWriter(self.path(key, '.npy'), dtype, ncols, append=0)
+
+    def checkpoint(self, key, infile, writer, meta):
+        """Record the rows of a followed entry written so far, meta['follow']
+        holds the reader's place in infile at meta['follow']['offset']."""
+        offset = meta['follow']['offset']
+        self._sidecar(key, dict(meta, nvals=writer.nvals,
+                                head=self._head(infile, offset)))
+
+    def resume(self, key, infile):
+        """Return (writer, meta) to continue a followed entry from its last
+        checkpoint(), or None if there is none or infile has changed."""
+        try:
+            meta = json.load(open(self.path(key, '.json')))
+            offset = meta['follow']['offset']
+            if meta.get('version') != self.VERSION or \
+               os.path.getsize(infile) < offset or \
+               self._head(infile, offset) != meta['head']:
+                return None
+            writer = _NpyWriter(self.path(key, '.npy'), meta['dtype'],
+                                len(meta['cols']), append=meta['nvals'])
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return writer, meta
+
+    def evict(self):
+        """Remove least recently used entries until within budget."""
+        entries = []
+        total = 0
+        for f in os.listdir(self.cachedir):
+            if not f.endswith('.json'):
+                continue
+            key = f[:-5]
+            try:
+                size = sum(os.path.getsize(self.path(key, ext))
+                           for ext in (self.DATAEXT, '.json'))
+                used = os.path.getmtime(self.path(key, '.json'))
+            except OSError:
+                continue
+            entries.append((used, size, key))
+            total += size
+        entries.sort()
+        for used, size, key in entries[:-1]:
+            if total <= self.budget:
+                break
+            for ext in ('.json', self.DATAEXT):
+                try:
+                    os.remove(self.path(key, ext))
+                except OSError:
+                    pass
+            total -= size
+
+
+def _shuffle(a):
+    """Byte-shuffle: all first bytes of the values, then all second ..."""
+    return a.view(np.uint8).reshape(-1, a.dtype.itemsize).T.tostring()
+
+
+def _unshuffle(s, dtype):
+    b = np.fromstring(s, np.uint8).reshape(dtype.itemsize, -1)
+    return b.T.copy().view(dtype).ravel()
+
+
+def _delta(a):
+    """Differences of the bit patterns of a, exactly reversible."""
+    u = a.view('u%i' % a.dtype.itemsize)
+    return np.concatenate((u[:1], np.diff(u))).view(a.dtype)
+
+
+def _undelta(a):
+    u = a.view('u%i' % a.dtype.itemsize)
+    return np.cumsum(u, dtype=u.dtype).view(a.dtype)
+
+
+class _ChunkWriter:
+    """Write the columns of rows appended with write() as compressed chunks
+    of chunkrows rows, with an index of [offset, nbytes] of the chunks of
+    each column.  Like _NpyWriter the file is renamed into place when
+    closed."""
+    def __init__(self, fname, dtype, ncols, chunkrows, encode):
+        self.fname = fname
+        self.tmpname = _tmpname(fname)
+        self.dtype = np.dtype(dtype)
+        self.ncols = ncols
+        self.nvals = 0
+        self.chunkrows = chunkrows
+        self.encode = encode
+        self.index = [[] for c in range(ncols)]
+        self.pending = _ArrayWriter(self.dtype, ncols)
+        self.fp = open(self.tmpname, 'wb')
+
+    def write(self, values):
+        values = np.ravel(values)
+        self.pending.write(values)
+        self.nvals += values.size
+        nrows = self.pending.nvals // self.ncols
+        if nrows >= self.chunkrows:
+            n = nrows - nrows % self.chunkrows
+            rows = self.pending.array()
+            for i in xrange(0, n, self.chunkrows):
+                self._chunk(rows[i:i+self.chunkrows])
+            rest = self.pending.buf[n*self.ncols:self.pending.nvals].copy()
+            self.pending.nvals = 0
+            self.pending.write(rest)
+
+    def _chunk(self, rows):
+        for c in range(self.ncols):
+            data = self.encode(np.ascontiguousarray(rows[:,c]))
+            self.index[c].append([self.fp.tell(), len(data)])
+            self.fp.write(data)
+
+    def close(self):
+        rows = self.pending.array()
+        if len(rows):
+            self._chunk(rows)
+        self.fp.close()
+        os.rename(self.tmpname, self.fname)
+
+    def abort(self):
+        self.fp.close()
+        os.remove(self.tmpname)
+
+
+class _ColumnArray:
+    """Base of the read-only 2-D arrays read a column at a time.  Indexing
+    rows and a column, as in data[rows, col], reads only those rows of the
+    column.  Slicing rows, data[start:stop], gives a lazy view and
+    numpy.asarray() reads all of it.  Subclasses provide _column() and
+    _view()."""
+    def __len__(self):
+        return self.shape[0]
+
+    def _column(self, col, first, last):
+        """Return absolute rows first to last-1 of column col."""
+        raise NotImplementedError
+
+    def _view(self, first, last):
+        """Return the absolute rows first to last-1."""
+        raise NotImplementedError
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            if isinstance(key, slice) and key.step in (None, 1):
+                i0, i1, step = key.indices(len(self))
+                return self._view(self.start + i0, self.start + max(i0, i1))
+            return np.asarray(self)[key]
+        rows, col = key
+        if not isinstance(col, (int, long, np.integer)):
+            return np.asarray(self)[key]
+        col = range(self.shape[1])[col]
+        if isinstance(rows, slice):
+            i0, i1, step = rows.indices(len(self))
+            lo, hi = (i0, i1) if step > 0 else (i1 + 1, i0 + 1)
+            a = self._column(col, self.start + lo, self.start + max(lo, hi))
+            return a[i0 - lo::step]
+        rows = np.arange(len(self))[rows]
+        if not np.size(rows):
+            return np.zeros(np.shape(rows), self.dtype)
+        lo = int(np.min(rows))
+        a = self._column(col, self.start + lo, self.start + int(np.max(rows)) + 1)
+        return a[rows - lo]
+
+    def __array__(self, dtype=None):
+        a = np.empty(self.shape, self.dtype, order='F')
+        for c in range(self.shape[1]):
+            a[:,c] = self._column(c, self.start, self.stop)
+        return a if dtype is None else a.astype(dtype)
+
+
+class ChunkedArray(_ColumnArray):
+    """Read-only 2-D array of a ChunkedCache entry, see _ColumnArray.  Only
+    the chunks of a column the rows fall in are decompressed.  The last
+    chunks read are kept, shared by the views."""
+    keepchunks = 64
+
+    def __init__(self, fname, meta, decode, start=0, stop=None, chunks=None):
+        self.fname = fname
+        self.meta = meta
+        self.decode = decode
+        self.dtype = np.dtype(meta['dtype'])
+        self.chunkrows = meta['chunkrows']
+        self.index = meta['chunkindex']
+        nrows, ncols = meta['shape']
+        self.start = start
+        self.stop = nrows if stop is None else stop
+        self.shape = (self.stop - self.start, ncols)
+        self.ndim = 2
+        self._chunks = OrderedDict() if chunks is None else chunks
+
+    def _chunk(self, col, k):
+        if (col, k) in self._chunks:
+            a = self._chunks.pop((col, k))
+        else:
+            off, nbytes = self.index[col][k]
+            fp = open(self.fname, 'rb')
+            fp.seek(off)
+            a = self.decode(fp.read(nbytes), self.dtype)
+            fp.close()
+        self._chunks[col, k] = a
+        if len(self._chunks) > self.keepchunks:
+            self._chunks.popitem(last=False)
+        return a
+
+    def _column(self, col, first, last):
+        if last <= first:
+            return np.zeros(0, self.dtype)
+        k0, k1 = first // self.chunkrows, (last - 1) // self.chunkrows
+        a = np.concatenate([self._chunk(col, k) for k in range(k0, k1+1)])
+        return a[first - k0*self.chunkrows:last - k0*self.chunkrows]
+
+    def _view(self, first, last):
+        return ChunkedArray(self.fname, self.meta, self.decode, first, last,
+                            self._chunks)
+
+
+class MergedArray(_ColumnArray):
+    """Read-only 2-D array of the rows of several arrays (memmaps, arrays
+    or ChunkedArrays with the same columns) one after the other, see
+    _ColumnArray.  Nothing is copied until rows are read, a view of rows
+    within one part is that part's own view."""
+    def __init__(self, parts, start=0, stop=None):
+        self.parts = parts
+        self.bounds = np.cumsum([0] + [len(p) for p in parts])
+        self.dtype = np.result_type(*[p.dtype for p in parts])
+        self.start = start
+        self.stop = self.bounds[-1] if stop is None else stop
+        self.shape = (self.stop - self.start, parts[0].shape[1])
+        self.ndim = 2
+
+    def _pieces(self, first, last):
+        """Generate (part, lo, hi) holding absolute rows first to last-1."""
+        k = np.searchsorted(self.bounds, first, 'right') - 1
+        while first < last:
+            hi = min(last, self.bounds[k+1])
+            yield self.parts[k], first - self.bounds[k], hi - self.bounds[k]
+            first = hi
+            k += 1
+
+    def _column(self, col, first, last):
+        a = [p[lo:hi, col] for p, lo, hi in self._pieces(first, last)]
+        if not a:
+            return np.zeros(0, self.dtype)
+        return np.concatenate(a).astype(self.dtype, copy=False)
+
+    def _view(self, first, last):
+        pieces = list(self._pieces(first, last))
+        if len(pieces) == 1 and pieces[0][0].dtype == self.dtype:
+            p, lo, hi = pieces[0]
+            return p[lo:hi]
+        return MergedArray(self.parts, first, last)
+
+
+_codecs = {'zlib': zlib, 'bz2': bz2}
+try:
+    import lzma
+    _codecs['lzma'] = lzma
+except ImportError:
+    pass
+
+
+class ChunkedCache(WaveformCache):
+    """WaveformCache storing each column in compressed chunks of chunkrows
+    rows, see ChunkedArray.  codec is 'zlib', 'bz2' or 'lzma' (if the lzma
+    module is available).  filter is applied before compressing: 'shuffle'
+    groups the bytes of the values, 'delta' also stores the differences of
+    their bit patterns, which suits smooth signals; both are lossless.
+    float32=True stores single precision values.
+    """
+    DATAEXT = '.wfz'
+
+    def __init__(self, cachedir=None, budget=None, codec='zlib',
+                 filter='delta', float32=False, chunkrows=1 << 16):
+        WaveformCache.__init__(self, cachedir, budget)
+        if codec not in _codecs:
+            raise ValueError('Unknown codec %r, available: %s' %
+                             (codec, ', '.join(sorted(_codecs))))
+        if filter not in (None, 'shuffle', 'delta'):
+            raise ValueError('Unknown filter %r' % filter)
+        self.codec = codec
+        self.filter = filter
+        self.float32 = float32
+        self.chunkrows = chunkrows
+
+    def key(self, infile):
+        options = (self.codec, self.filter, self.float32, self.chunkrows)
+        return hashlib.sha1(WaveformCache.key(self, infile) +
+                            repr(options)).hexdigest()
+
+    def encode(self, a):
+        if self.filter == 'delta':
+            a = _delta(a)
+        data = _shuffle(a) if self.filter else a.tostring()
+        return _codecs[self.codec].compress(data)
+
+    def decoder(self, meta):
+        """Return decode(data, dtype) for the chunks of an entry."""
+        codec, filter = _codecs[meta['codec']], meta['filter']
+        def decode(data, dtype):
+            data = codec.decompress(data)
+            if not filter:
+                return np.fromstring(data, dtype)
+            a = _unshuffle(data, dtype)
+            return _undelta(a) if filter == 'delta' else a
+        return decode
+
+    def open(self, key, meta):
+        if 'chunkindex' not in meta:
+            raise ValueError('Not a chunked cache entry')
+        return ChunkedArray(self.path(key), meta, self.decoder(meta))
+
+    def appender(self, key, dtype, ncols):
+        # follow entries are plain .npy files
+        raise IOError('ChunkedCache does not store followed files')
+
+    def writer(self, key, dtype, ncols, fortran=True):
+        self.makedir()
+        dtype = np.dtype('f4' if self.float32 else 'f8')
+        return _ChunkWriter(self.path(key), dtype, ncols, self.chunkrows,
+                            self.encode)
+
+    def commit(self, key, writer, meta):
+        meta = dict(meta, codec=self.codec, filter=self.filter,
+                    chunkrows=self.chunkrows, chunkindex=writer.index)
+        return WaveformCache.commit(self, key, writer, meta)
+
+
+def _defaultCache():
+    """A ChunkedCache using $SPICEREADER_CACHE_CODEC if it is set."""
+    codec = os.environ.get('SPICEREADER_CACHE_CODEC')
+    if codec:
+        return ChunkedCache(codec=codec)
+    return WaveformCache()
+
+defaultCache = _defaultCache()
+
+
+class _SweepFinder:
+    """Wraps a writer's write() to find where the independent variable
+    restarts, which separates the sweeps of outputs that don't label them.
+
+    A sweep may run up or down.  A new one starts where the independent
+    variable reverses the direction of the current sweep, which also covers
+    returning to its first value, so a descending .dc sweep stays one sweep.
+    """
+    def __init__(self, write, ncols, ivar):
+        self._write = write
+        self.ncols = ncols
+        self.ivar = ivar
+        self.nrows = 0
+        self.last = None
+        self.direction = 0
+        self.starts = [0]
+
+    def write(self, values):
+        t = np.ravel(values)[self.ivar::self.ncols]
+        if t.size:
+            prev = t[:1] if self.last is None else [self.last]
+            step = np.sign(np.diff(np.concatenate((prev, t))))
+            moves = np.flatnonzero(step)
+            ups, downs = np.flatnonzero(step > 0), np.flatnonzero(step < 0)
+            # a few searches per sweep instead of a loop over the rows
+            k = -1
+            while True:
+                if not self.direction:
+                    # the first move of a sweep sets its direction
+                    k = moves[np.searchsorted(moves, k, 'right'):][:1]
+                    if not k.size:
+                        break
+                    k = k[0]
+                    self.direction = step[k]
+                else:
+                    back = downs if self.direction > 0 else ups
+                    k = back[np.searchsorted(back, k, 'right'):][:1]
+                    if not k.size:
+                        break
+                    k = k[0]
+                    self.starts.append(self.nrows + k)
+                    self.direction = 0
+            self.last = t[-1]
+        self.nrows += t.size
+        self._write(values)
+
+    def sweeps(self):
+        """Return [[[sweepnumber], firstrow, lastrow+1], ...], empty if the
+        independent variable never restarted."""
+        if len(self.starts) == 1:
+            return []
+        bounds = [int(i) for i in self.starts] + [self.nrows]
+        return [[[i], bounds[i], bounds[i+1]] for i in range(len(self.starts))]
+
+
+def parseAscii(text, ncols, name='', nrows=0):
+    """Return the values of the complete lines of text as a flat array,
+    skipping lines starting with '#'.  name and nrows, the rows before text,
+    are for the error message when the lines aren't rows of ncols values."""
+    if '#' in text:
+        text = '\n'.join(line for line in text.split('\n')
+                         if not line.lstrip().startswith('#'))
+    values = np.fromstring(text, sep=' ')
+    if values.size % ncols:
+        raise ValueError('%s: expected rows of %i values near row %i' %
+                         (name, ncols, nrows))
+    return values
+
+
+def readAsciiRows(fin, ncols, write, chunksize=CHUNKSIZE, follow=False):
+    """Parse whitespace separated rows of ncols numbers from the open file
+    fin and pass them to write() in fixed-size chunks.  Lines starting with
+    '#' are skipped.  With follow set a last line without newline, still
+    being written, is left unread and fin is put back at its start.
+    Returns the number of rows read."""
+    nrows = 0
+    tail = ''
+    while True:
+        chunk = fin.read(chunksize)
+        if not chunk and follow:
+            fin.seek(-len(tail), os.SEEK_CUR)
+            text, tail = '', ''
+        elif not chunk:
+            text, tail = tail, ''
+        else:
+            # only parse complete lines, keep the rest for the next chunk
+            cut = chunk.rfind('\n') + 1
+            if not cut:
+                tail += chunk
+                continue
+            text, tail = tail + chunk[:cut], chunk[cut:]
+        values = parseAscii(text, ncols, fin.name, nrows)
+        write(values)
+        nrows += values.size // ncols
+        if not chunk:
+            return nrows
+
+
+def _hspiceEndian(fp):
+    """Return the byte order ('<' or '>') of an HSPICE binary file."""
+    fp.seek(0)
+    head = fp.read(16)
+    for endian in '<>':
+        if len(head) == 16:
+            h = struct.unpack(endian + '4i', head)
+            if h[0] == 4 and h[2] == 4:
+                return endian
+    raise ValueError('%s is not an HSPICE binary file' % fp.name)
+
+
+def _hspiceBlocks(fp, endian, pos=0):
+    """Generate (offset, nbytes) of the payload of each block of an HSPICE
+    binary file, starting with the block at byte pos."""
+    fp.seek(0, os.SEEK_END)
+    size = fp.tell()
+    while pos + 16 <= size:
+        fp.seek(pos)
+        h = struct.unpack(endian + '4i', fp.read(16))
+        if h[0] != 4 or h[2] != 4:
+            raise ValueError('Bad HSPICE block header at byte %i' % pos)
+        yield pos + 16, h[3]
+        pos += 16 + h[3] + 4
+
+
+def hspiceHeader(fp):
+    """Parse the header of an HSPICE binary file (post_version=9601/2001).
+
+    Returns a dict of the header fields and the list of (offset, nbytes) of
+    the data blocks, which start at byte info['datapos'].  Complex (AC)
+    vectors are listed as name_0, name_1 for the real and imaginary parts.
+    """
+    endian = _hspiceEndian(fp)
+    blocks = _hspiceBlocks(fp, endian)
+    header = ''
+    for off, nbytes in blocks:
+        fp.seek(off)
+        header += fp.read(nbytes)
+        if '$&%#' in header:
+            datapos = off + nbytes + 4
+            break
+    else:
+        raise ValueError('No HSPICE header end marker in %s' % fp.name)
+    datablocks = list(blocks)
+
+    nvec = int(header[0:4]) + int(header[4:8])
+    nsweep = int(header[8:12])
+    for version in ('9601', '2001', '9007'):
+        if version in (header[16:20], header[20:24]):
+            break
+    else:
+        raise ValueError('Unknown HSPICE post_version %r' % header[16:24])
+
+    words = header[256:header.index('$&%#')].split()
+    types = [int(t) for t in words[:nvec]]
+    names = words[nvec:2*nvec]
+    sweepvars = words[2*nvec:2*nvec+nsweep]
+
+    # frequency as independent variable: other vectors are complex
+    iscomplex = types[0] == 2
+    cols = names[:1]
+    for n in names[1:]:
+        cols.extend([n + '_0', n + '_1'] if iscomplex else [n])
+
+    info = {'version': version,
+            'title': header[24:88].strip(),
+            'date': header[88:112].strip(),
+            'cols': cols,
+            'types': types,
+            'complex': iscomplex,
+            'sweepvars': sweepvars,
+            'dtype': np.dtype(endian + ('f8' if version == '2001' else 'f4')),
+            'datapos': datapos,
+           }
+    return info, datablocks
+
+
+class _HspiceRows:
+    """Feeds the data values of HSPICE blocks to write(), leaving out the
+    sweep values and end-of-sweep markers.  Rows may be split across calls.
+    Keeps its place between calls to feed(), state() returns it as a dict
+    that can be passed back to the constructor."""
+    def __init__(self, dtype, nsweep, ncols, write, state=None):
+        self.dtype = dtype
+        self.nsweep = nsweep
+        self.ncols = ncols
+        self.write = write
+        self.sweeps = []
+        self.head = []
+        self.insweep = False
+        self.written = 0
+        self.first = 0
+        if state:
+            self.__dict__.update(state)
+
+    def state(self):
+        return dict((k, getattr(self, k)) for k in
+                    ('sweeps', 'head', 'insweep', 'written', 'first'))
+
+    def feed(self, fp, blocks):
+        ncols = self.ncols
+        for off, nbytes in blocks:
+            fp.seek(off)
+            v = np.fromfile(fp, self.dtype, nbytes // self.dtype.itemsize)
+            i = 0
+            while i < v.size:
+                if not self.insweep:
+                    k = min(self.nsweep - len(self.head), v.size - i)
+                    self.head.extend(v[i:i+k].tolist())
+                    i += k
+                    if len(self.head) == self.nsweep:
+                        self.insweep = True
+                        self.first = self.written // ncols
+                    continue
+                # the end marker is always at the start of a row
+                rest = v[i:]
+                start = -(self.written % ncols) % ncols
+                ends = np.flatnonzero(rest[start::ncols] >= 0.99*HSPICE_END)
+                n = start + ends[0]*ncols if ends.size else rest.size
+                self.write(rest[:n])
+                self.written += int(n)
+                i += n
+                if ends.size:
+                    self.sweeps.append([self.head, self.first,
+                                        self.written // ncols])
+                    self.head = []
+                    self.insweep = False
+                    i += 1
+
+
+def _hspiceRows(fp, blocks, dtype, nsweep, ncols, write):
+    """Feed the data values of the HSPICE blocks to write(), see
+    _HspiceRows.  Returns [(sweepvalues, firstrow, lastrow+1), ...]."""
+    rows = _HspiceRows(dtype, nsweep, ncols, write)
+    rows.feed(fp, blocks)
+    return rows.sweeps
+
+
+def rawHeader(fp):
+    """Parse the header of the next plot of a SPICE3/ngspice rawfile, from
+    the current position of fp.
+
+    Returns a dict of the header fields (lowercase keys) with 'vars' the
+    list of (name, type), 'complex', 'binary' and the byte 'offset' of the
+    values, or None at the end of the file.
+    """
+    info = {'vars': [], 'complex': False, 'npoints': 0}
+    while True:
+        line = fp.readline()
+        if not line:
+            if len(info) > 3:
+                raise ValueError('%s: rawfile header without values' %
+                                 fp.name)
+            return None
+        key, sep, value = line.partition(':')
+        key = key.strip().lower()
+        value = value.strip()
+        if not sep:
+            if line.strip():
+                raise ValueError('%s: bad rawfile header line %r' %
+                                 (fp.name, line))
+        elif key in ('binary', 'values'):
+            info['binary'] = key == 'binary'
+            info['offset'] = fp.tell()
+            return info
+        elif key == 'variables':
+            # old SPICE3 puts the first variable on the same line
+            lines = [value] if value else []
+            while len(lines) < info['nvars']:
+                lines.append(fp.readline())
+            for words in [l.split() for l in lines]:
+                info['vars'].append((words[1], words[2]))
+        elif key == 'no. variables':
+            info['nvars'] = int(value)
+        elif key == 'no. points':
+            info['npoints'] = int(value)
+        elif key == 'flags':
+            info['flags'] = value
+            info['complex'] = 'complex' in value.lower()
+        else:
+            info[key] = value
+
+
+def _rawValuesEnd(fp):
+    """Return the byte after the ASCII values starting at fp's position,
+    where the next plot's header or the end of the file is."""
+    pos = fp.tell()
+    for line in iter(fp.readline, ''):
+        if line.split(':', 1)[0].strip().lower() in ('title', 'plotname'):
+            return pos
+        pos += len(line)
+    return pos
+
+
+def rawPlots(fp):
+    """Return the header dicts of all plots in a rawfile, see rawHeader().
+    'npoints' is cut down to the rows present in a file cut short by an
+    aborted run, ASCII plots get the byte 'end' of their values."""
+    fp.seek(0, os.SEEK_END)
+    size = fp.tell()
+    fp.seek(0)
+    plots = []
+    while True:
+        info = rawHeader(fp)
+        if info is None:
+            return plots
+        if info['binary']:
+            width = len(info['vars']) * (16 if info['complex'] else 8)
+            written = (size - info['offset']) // width
+            if written < info['npoints']:
+                # the run was aborted, nothing follows
+                info['npoints'] = written
+                plots.append(info)
+                return plots
+            fp.seek(info['offset'] + info['npoints'] * width)
+        else:
+            info['end'] = _rawValuesEnd(fp)
+            fp.seek(info['end'])
+        plots.append(info)
+
+
+def rawValues(infile, info):
+    """Return the values of a rawfile plot as an array of one row per point,
+    a complex value is two columns.  Binary values are memory-mapped."""
+    width = len(info['vars']) * (2 if info['complex'] else 1)
+    if info['binary']:
+        if not info['npoints']:
+            return np.zeros((0, width))
+        # ngspice writes native doubles, assume the usual little-endian
+        return np.memmap(infile, '<f8', 'r', info['offset'],
+                         (info['npoints'], width))
+    fin = open(infile, 'rb')
+    fin.seek(info['offset'])
+    text = fin.read(info['end'] - info['offset'])
+    fin.close()
+    # each point is its number followed by the values, complex as re,im
+    values = np.fromstring(text.replace(',', ' '), sep=' ')
+    if values.size % (width + 1):
+        raise ValueError('%s: expected points of %i values in plot %r' %
+                         (infile, width, info.get('plotname')))
+    return values.reshape(-1, width + 1)[:, 1:]
+
+
+def isRawfile(infile):
+    """True if infile starts like a SPICE3/ngspice rawfile."""
+    try:
+        fin = open(infile, 'rb')
+    except IOError:
+        return False
+    line = fin.readline(256)
+    fin.close()
+    return line.split(':', 1)[0].strip().lower() in ('title', 'plotname')
+
+
 class SimulationData:
     """Base class for holding simulation data.  Data held in a numpy.array.
     Access data via attributes or d.data array.
+
+    Subclasses implement convert(infile, key) to read a file into an array
+    and its metadata, loadData() takes care of the cache.
+
+    Sweeps are contiguous row ranges of self.data, self.sweeprows, found
+    once when loading.  getSweep() keeps the last sweepcache sweeps.
+
+    Nested sweeps have one value per sweep variable in self.sweepvars and
+    self.sweepindex is a structured array with a field per sweep variable
+    plus the 'start' and 'stop' rows of each sweep.  Sweeps that form a full
+    grid are available as one N-D array view with ndview().
+
+    A file that a simulation is still writing can be loaded with
+    follow=True, refresh() then parses only the rows appended since.
+
+    The meas*() methods are .meas-style measurements done for all sweeps at
+    once.  They return an array with one value per sweep in the order of
+    self.sweepvals (NaN where the measurement fails), or a single value if
+    there are no sweeps.  Signals are given by name or as an array of
+    len(self.data), times are on the independent variable, which must be
+    increasing or decreasing within each sweep.
     """
-    def __init__(self, infile=None):
+    sweepcache = 64
+    decimatecache = 32
+    evalcache = 8
+    derivedcache = 32
+    plotbuckets = 1000
+
+    def __init__(self, infile=None, cache=None, follow=False):
         #defaults only, all set by subclasses
         self.infile = infile
+        self.key = None
+        self.cache = cache or defaultCache
         self.cols = None
         self.colset = None
         self.siglist = []
         self._sig2idx = {}
-        self.sweep = {}
+        self.sweep = OrderedDict()
         self.sweepvals = []
         self.sweepvar = None
-
-        if infile:
+        self._tkey = None
+        self.sweepvars = []
+        self.sweepindex = None
+        self.sweeprows = []
+        self._sweepidx = None
+        self._decimated = OrderedDict()
+        self._evalcache = OrderedDict()
+        self._derivedcache = OrderedDict()
+        self._xr = None
+        self._writer = None
+        self._state = None
+
+        if infile and follow:
+            self.follow(infile)
+        elif infile:
             self.loadData(infile)
 
     def __getattr__(self, attr):
         """Returns the named signal, sliced with the current self.xrange."""
-        if attr in self.siglist:
-            idx = self._sig2idx[attr]
-            return self.data[self._slice, idx]
-        elif attr + '_0' in self.siglist:
-            # auto return a complex vector if 'attr' is really attr_0 attr_1
-            idx0 = self._sig2idx[attr+'_0']
-            idx1 = self._sig2idx[attr+'_1']
-            return (self.data[self._slice, idx0] + 
-                    1j*self.data[self._slice, idx1])
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return self._signal(attr, self._slice)
+
+    def _signal(self, name, rows):
+        """Return the rows of the named signal."""
+        if name in self.siglist:
+            idx = self._sig2idx[name]
+            return self.data[rows, idx]
+        elif name + '_0' in self.siglist:
+            # auto return a complex vector if 'name' is really name_0 name_1
+            idx0 = self._sig2idx[name+'_0']
+            idx1 = self._sig2idx[name+'_1']
+            data = self.data
+            if idx1 == idx0 + 1 and isinstance(rows, slice) and \
+               isinstance(data, np.ndarray) and data.strides[1] == data.itemsize:
+                return _complexview(data[rows, idx0])
+            return (data[rows, idx0] + 1j*data[rows, idx1])
+        else:
+            raise AttributeError(name)
+
+    def _derived(self, kind, sig, func):
+        """Return func() of a signal within the current xrange, the last
+        derivedcache results are kept."""
+        key = (kind, sig, self._slice.start, self._slice.stop)
+        if key in self._derivedcache:
+            a = self._derivedcache.pop(key)
         else:
-            raise AttributeError
+            a = func(self._signal(sig, self._slice))
+        self._derivedcache[key] = a
+        if len(self._derivedcache) > self.derivedcache:
+            self._derivedcache.popitem(last=False)
+        return a
+
+    def mag(self, sig):
+        """Magnitude of a (complex) signal."""
+        return self._derived('mag', sig, np.abs)
+
+    def db(self, sig):
+        """Magnitude of a signal in dB."""
+        return self._derived('db', sig, lambda y: 20*np.log10(self.mag(sig)))
+
+    def phase(self, sig, unwrap=False):
+        """Phase of a complex signal in degrees, optionally unwrapped along
+        the data."""
+        if unwrap:
+            return self._derived('uphase', sig, lambda y:
+                                 np.degrees(np.unwrap(np.angle(y))))
+        return self._derived('phase', sig, lambda y: np.angle(y, deg=True))
 
 
     #def __getstate__(self):
@@ -95,299 +1203,1357 @@ class SimulationData:
     #def __getinitargs__(self):
         #return (self.infile, )
 
+    def loadData(self, infile):
+        """Load infile from the cache, converting and caching it first if
+        needed."""
+        name = self.__class__.__name__
+        key = self.cacheKey(infile)
+        self.key = key
+        cached = self.cache.load(key)
+        if cached:
+            print '%s: loading cached %s' % (name, infile)
+            data, meta = cached
+        else:
+            print '%s: reading %s' % (name, infile)
+            data, meta = self.convert(infile, key)
+        self.setup(data, meta)
+        if self.sweepvars:
+            print 'Contained sweeps:', self.sweepvars, map(str, self.sweepvals)
+        return self
+
+    def cacheKey(self, infile):
+        """Return the cache key of infile as this reader converts it."""
+        return self.cache.key(infile)
+
+    def follow(self, infile):
+        """Load infile while a simulation is still writing it, refresh()
+        parses what is appended later.  The rows are appended to an entry
+        in the cache, with a checkpoint of the reader's place after each
+        refresh, so following the same file again resumes from there."""
+        name = self.__class__.__name__
+        self.infile = infile
+        self.key = self.cache.followKey(infile)
+        self._state = {'offset': 0}
+        resumed = self.cache.resume(self.key, infile)
+        if resumed:
+            print '%s: resuming %s' % (name, infile)
+            self._writer, meta = resumed
+            self._state = meta['follow']
+            self.setup(self._writer.array(), meta)
+        else:
+            print '%s: following %s' % (name, infile)
+        self.refresh()
+        return self
+
+    def refresh(self):
+        """Parse the rows appended to a followed file since the last
+        refresh, returns the number of new rows."""
+        return 0
+
+    def followWriter(self, dtype, ncols):
+        """Return a writer appending to the followed entry in the cache, or
+        into memory if the cache can't be written."""
+        try:
+            return self.cache.appender(self.key, dtype, ncols)
+        except (IOError, OSError):
+            print '%s: cannot write cache in %s' % (self.__class__.__name__,
+                                                   self.cache.cachedir)
+            return _ArrayWriter(dtype, ncols)
+
+    def followUpdate(self, meta, nnew):
+        """Show the rows written by refresh() and checkpoint them into the
+        cache.  Keeps the current xrange, returns nnew."""
+        out = self._writer
+        meta = dict(meta, follow=self._state,
+                    dtype=np.lib.format.dtype_to_descr(out.dtype),
+                    shape=[out.nvals // out.ncols, out.ncols])
+        if not isinstance(out, _ArrayWriter):
+            out.sync()
+            self.cache.checkpoint(self.key, self.infile, out, meta)
+        xr = self._xr
+        self.setup(out.array(), meta)
+        if xr:
+            self.xrange(xr)
+        return nnew
+
+    def cacheWriter(self, key, dtype, ncols, fortran=True):
+        """Return a writer into the cache, or into memory if the cache can't
+        be written.  fortran=False keeps the rows in order, see
+        WaveformCache."""
+        try:
+            return self.cache.writer(key, dtype, ncols, fortran)
+        except (IOError, OSError):
+            print '%s: cannot write cache in %s' % (self.__class__.__name__,
+                                                   self.cache.cachedir)
+            return _ArrayWriter(dtype, ncols)
+
+    def commit(self, key, out, meta):
+        """Store the converted data from cacheWriter() and return it."""
+        meta = dict(meta, dtype=np.lib.format.dtype_to_descr(out.dtype),
+                    shape=[out.nvals // out.ncols, out.ncols])
+        if isinstance(out, _ArrayWriter):
+            return out.array(), meta
+        return self.cache.commit(key, out, meta), meta
+
+    def signame(self, col):
+        """Return the attribute name of column label col."""
+        return col.replace('(', '').replace(')', '').replace('.', '_')
+
+    def ivarname(self, col):
+        """Return the attribute name of the independent variable column."""
+        return self.signame(col)
+
+    def setup(self, data, meta):
+        """Set the signal names, independent variable and sweeps from
+        the data and its metadata:
+            cols      - column labels
+            ivar      - index of the independent variable column
+            sweepvars - names of the sweep variables, may be empty
+            sweeps    - [[sweepvalues], firstrow, lastrow+1] for each sweep
+        """
+        self.meta = meta
+        cols = meta['cols']
+        self.cols = cols
+
+        # handle duplicate columns
+        # only use the last-defined name position
+        colset = []
+        for i,c in enumerate(cols):
+            if c not in cols[i+1:]:
+                colset.append([i, c])
+        self.colset = colset
+
+        self.siglist = []
+        self._sig2idx = {}
+        for i,name in colset:
+            n = self.signame(name)
+            self.siglist.append(n)
+            self._sig2idx[n] = i
+
+        # special independent variable column
+        ivar = meta['ivar']
+        self._ivar = data[:,ivar]
+        setattr(self, self.ivarname(cols[ivar]), self._ivar)
+
+        # check for sweep
+        if meta['sweepvars']:
+            sweeps = meta['sweeps']
+            self.setSweeps(meta['sweepvars'],
+                           [v for v, first, last in sweeps],
+                           [(first, last) for v, first, last in sweeps])
+
+        self.data = data
+        self._tkey = None
+        self._decimated.clear()
+        self._evalcache.clear()
+        self._derivedcache.clear()
+
+        #default to full display range, init relevant attributes
+        self.xrange()
+
+    def setSweeps(self, names, values, rows):
+        """Set the sweeps of the data.  names are the sweep variables
+        (outermost first), values has a sequence of one value per variable
+        for each sweep and rows the (firstrow, lastrow+1) of each sweep.
+        Sweeps are named by their value with one variable and by the tuple
+        of values otherwise."""
+        names = [str(n) for n in names]
+        index = np.zeros(len(rows), [(n, 'f8') for n in names] +
+                                    [('start', 'i8'), ('stop', 'i8')])
+        for k,n in enumerate(names):
+            index[n] = [v[k] for v in values]
+        index['start'] = [first for first, last in rows]
+        index['stop'] = [last for first, last in rows]
+
+        self.sweepvars = names
+        self.sweepvar = names[0] if names else None
+        self.sweepindex = index
+        self.sweeprows = [(first, last) for first, last in rows]
+        if len(names) == 1:
+            self.sweepvals = [v[0] for v in values]
+        else:
+            self.sweepvals = [tuple(v) for v in values]
+        self._sweepidx = None
+        self._tkey = None
+        self.sweep.clear()
+        self._evalcache.clear()
+
+    def nestSweeps(self, axes):
+        """Relabel the sweeps as nested sweeps, e.g. the runs of a Monte
+        Carlo analysis at several temperatures.  axes is a list of (name,
+        values) with the outermost sweep first, the sweeps must be in
+        row-major order of those values."""
+        shape = [len(v) for n, v in axes]
+        if np.prod(shape) != len(self.sweeprows):
+            raise ValueError('%i sweeps do not fit a %s grid' %
+                             (len(self.sweeprows), shape))
+        grid = np.indices(shape).reshape(len(shape), -1).T
+        values = [[axes[k][1][i] for k,i in enumerate(g)] for g in grid]
+        self.setSweeps([n for n, v in axes], values, self.sweeprows)
+
+    def _ndshape(self):
+        """Return (shape, axes) of the sweeps as an N-D grid of
+        (sweep1, ..., point), see ndview()."""
+        index = self.sweepindex
+        lengths = index['stop'] - index['start']
+        if (lengths != lengths[0]).any() or index['start'][0] != 0 or \
+           (index['start'][1:] != index['stop'][:-1]).any():
+            raise ValueError('Sweeps do not have equal lengths')
+
+        axes = []
+        for n in self.sweepvars:
+            u, first = np.unique(index[n], return_index=True)
+            axes.append(index[n][np.sort(first)])
+        shape = [len(a) for a in axes]
+        if np.prod(shape) != len(index):
+            raise ValueError('Sweeps are not a full grid of %s' %
+                             ', '.join(self.sweepvars))
+        grid = np.indices(shape).reshape(len(shape), -1)
+        for k,n in enumerate(self.sweepvars):
+            if (axes[k][grid[k]] != index[n]).any():
+                raise ValueError('Sweeps are not in row-major order of %s' %
+                                 ', '.join(self.sweepvars))
+
+        return shape + [lengths[0]], axes
+
+    def ndview(self):
+        """Return (view, axes) where view is self.data shaped as
+        (sweep1, sweep2, ..., point, column) and axes are the values along
+        each sweep dimension.  Raises ValueError unless the sweeps have equal
+        lengths and form a full grid in row-major order."""
+        if not self.sweepvars:
+            return self.data, []
+        shape, axes = self._ndshape()
+        view = np.asarray(self.data[:np.prod(shape)])
+        return view.reshape(shape + [self.data.shape[1]]), axes
+
+    def ndsig(self, name):
+        """Return the named signal as an N-D array of (sweep1, ..., point),
+        see ndview().  Only that signal is read."""
+        if not self.sweepvars:
+            return self._signal(name, slice(None))
+        shape, axes = self._ndshape()
+        return self._signal(name, slice(0, np.prod(shape))).reshape(shape)
+
+    def _sweepBounds(self):
+        """Return arrays of the first and last+1 rows of each sweep, all the
+        data is one sweep if there are none."""
+        if self.sweeprows:
+            rows = np.array(self.sweeprows, dtype=np.intp)
+            return rows[:,0], rows[:,1]
+        return np.array([0]), np.array([len(self._ivar)])
+
+    def _result(self, values):
+        return values if self.sweeprows else values[0]
+
+    def _column(self, sig):
+        if isinstance(sig, basestring):
+            return self.data[:, self._sig2idx[sig]]
+        return np.asarray(sig)
+
+    def _perSweep(self, value, starts, stops):
+        """Expand a scalar or per-sweep value to one value per row."""
+        if np.ndim(value):
+            return np.repeat(value, stops - starts)
+        return value
+
+    def _locate(self, tau, starts, stops):
+        """For each sweep, return the row k of the sample interval
+        [t[k], t[k+1]] holding time tau[sweep], clipped to the sweep.  A
+        sweep of one row returns its row."""
+        t = self._ivar[:stops[-1]]
+        tmin = t.min()
+        span = float(t.max() - tmin) or 1.0
+        # descending sweeps are searched mirrored
+        down = t[stops - 1] < t[starts]
+        if self._tkey is None:
+            # increasing over all sweeps: sweep number + scaled time
+            seg = np.repeat(np.arange(len(starts)), stops - starts)
+            u = (t - tmin) / span
+            self._tkey = seg + 0.5 * np.where(down[seg], 1 - u, u)
+        u = (tau - tmin) / span
+        key = np.arange(len(starts)) + 0.5 * np.where(down, 1 - u, u)
+        k = np.searchsorted(self._tkey, key, 'right') - 1
+        return np.clip(k, starts, np.maximum(stops - 2, starts))
+
+    def _crossings(self, y, level, edge, hyst, starts, stops):
+        """Return (sweep, time, row, frac) of every crossing of y within a
+        sweep."""
+        t = self._ivar
+        y = y[:stops[-1]]
+        level = self._perSweep(level, starts, stops)
+        i, frac, rising = crossIndex(y, level, edge, hyst, starts)
+        seg = np.searchsorted(stops, i, 'right')
+        keep = i + 1 < stops[seg]
+        seg, i, frac = seg[keep], i[keep], frac[keep]
+        return seg, t[i] + frac * (t[i+1] - t[i]), i, frac
+
+    def _nth(self, seg, values, n, nseg):
+        """Return the nth value of each sweep (n < 0 counts from the last),
+        NaN where a sweep has too few."""
+        sweeps = np.arange(nseg)
+        first = np.searchsorted(seg, sweeps, 'left')
+        last = np.searchsorted(seg, sweeps, 'right')
+        k = first + n - 1 if n > 0 else last + n
+        ok = (k >= first) & (k < last)
+        out = np.empty(nseg)
+        out.fill(NaN)
+        out[ok] = values[k[ok]]
+        return out
+
+    def _window(self, frm, to, starts, stops):
+        """Return the per-sweep window [lo, hi] within each sweep."""
+        t = self._ivar
+        tfirst, tlast = t[starts], t[stops - 1]
+        tmin, tmax = np.minimum(tfirst, tlast), np.maximum(tfirst, tlast)
+        lo = tmin if frm is None else np.clip(frm, tmin, tmax)
+        hi = tmax if to is None else np.clip(to, tmin, tmax)
+        return lo, hi
+
+    def _integral(self, y, frm, to):
+        """Return the trapezoidal integral of y over the window of each
+        sweep and the window widths."""
+        starts, stops = self._sweepBounds()
+        t = self._ivar[:stops[-1]]
+        y = y[:stops[-1]]
+        lo, hi = self._window(frm, to, starts, stops)
+
+        # running integral restarted at each sweep
+        area = np.diff(t) * (y[1:] + y[:-1]) * 0.5
+        area[stops[:-1] - 1] = 0
+        F = np.concatenate(([0.0], np.cumsum(area)))
+
+        def at(tau):
+            k = self._locate(tau, starts, stops)
+            # one-row sweeps have no next sample
+            k1 = np.minimum(k + 1, stops - 1)
+            dt = tau - t[k]
+            step = t[k1] - t[k]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                slope = np.where(step != 0, (y[k1] - y[k]) / step, 0.0)
+            return F[k] - F[starts] + dt * (y[k] + 0.5 * slope * dt)
+
+        return at(hi) - at(lo), hi - lo
+
+    def measWhen(self, sig, level, edge='both', n=1, td=None, hyst=0.0):
+        """Time of the nth crossing of level by sig at or after time td.
+        level and td may be per-sweep arrays, n < 0 counts back from the last
+        crossing.  See crossIndex() for edge and hyst."""
+        starts, stops = self._sweepBounds()
+        seg, x, i, frac = self._crossings(self._column(sig), level, edge, hyst,
+                                          starts, stops)
+        if td is not None:
+            keep = x >= (np.asarray(td)[seg] if np.ndim(td) else td)
+            seg, x = seg[keep], x[keep]
+        return self._result(self._nth(seg, x, n, len(starts)))
+
+    def measFind(self, sig, when, level, edge='both', n=1, td=None):
+        """Value of sig, interpolated, at the nth crossing of level by the
+        signal when (FIND sig WHEN when=level)."""
+        starts, stops = self._sweepBounds()
+        y = self._column(sig)
+        seg, x, i, frac = self._crossings(self._column(when), level, edge, 0.0,
+                                          starts, stops)
+        if td is not None:
+            keep = x >= (np.asarray(td)[seg] if np.ndim(td) else td)
+            seg, i, frac = seg[keep], i[keep], frac[keep]
+        values = y[i] + frac * (y[i+1] - y[i])
+        return self._result(self._nth(seg, values, n, len(starts)))
+
+    def measDelay(self, trig, triglevel, targ, targlevel, trigedge='rise',
+                  targedge='rise', trign=1, targn=1, td=None):
+        """TRIG/TARG delay: from the trign-th crossing of triglevel by trig to
+        the targn-th crossing of targlevel by targ after it."""
+        t1 = np.asarray(self.measWhen(trig, triglevel, trigedge, trign, td))
+        t2 = np.asarray(self.measWhen(targ, targlevel, targedge, targn,
+                                      t1 if self.sweeprows else t1[()]))
+        return t2 - t1
+
+    def _levels(self, sig, low, high):
+        """Per-sweep 10% and 90% points of the swing of sig if low or high
+        are not given."""
+        if low is None or high is None:
+            ymin, tmin, ymax, tmax = self.measMinMax(sig)
+            if low is None:
+                low = ymin + 0.1 * (ymax - ymin)
+            if high is None:
+                high = ymin + 0.9 * (ymax - ymin)
+        return low, high
+
+    def measRise(self, sig, low=None, high=None, n=1):
+        """Rise time of the nth rising edge from low to high, which default
+        to 10% and 90% of each sweep's swing."""
+        low, high = self._levels(sig, low, high)
+        return self.measDelay(sig, low, sig, high, 'rise', 'rise', n, 1)
+
+    def measFall(self, sig, low=None, high=None, n=1):
+        """Fall time of the nth falling edge from high to low, which default
+        to 90% and 10% of each sweep's swing."""
+        low, high = self._levels(sig, low, high)
+        return self.measDelay(sig, high, sig, low, 'fall', 'fall', n, 1)
+
+    def measIntegral(self, sig, frm=None, to=None):
+        """Integral of sig from time frm to time to (default whole sweep)."""
+        area, width = self._integral(self._column(sig), frm, to)
+        return self._result(area)
+
+    def measAvg(self, sig, frm=None, to=None):
+        """Time average of sig from time frm to time to."""
+        area, width = self._integral(self._column(sig), frm, to)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._result(area / width)
+
+    def measRms(self, sig, frm=None, to=None):
+        """RMS value of sig from time frm to time to."""
+        y = self._column(sig)
+        area, width = self._integral(y * y, frm, to)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._result(np.sqrt(area / width))
+
+    def measMinMax(self, sig, frm=None, to=None):
+        """Return (min, tmin, max, tmax) of the samples of sig between time
+        frm and time to, with the times of the first min and max."""
+        starts, stops = self._sweepBounds()
+        t = self._ivar[:stops[-1]]
+        y = self._column(sig)[:stops[-1]]
+        lo, hi = self._window(frm, to, starts, stops)
+
+        # rows of each window, in either direction of the sweep
+        n = stops - starts
+        inwin = (t >= np.repeat(lo, n)) & (t <= np.repeat(hi, n))
+
+        out = []
+        for reduce, fill in ((np.minimum, np.inf), (np.maximum, -np.inf)):
+            ywin = np.where(inwin, y, fill)
+            ext = reduce.reduceat(ywin, starts)
+            first = np.flatnonzero(inwin & (ywin == np.repeat(ext, stops - starts)))
+            seg = np.searchsorted(stops, first, 'right')
+            ext = np.where(np.isinf(ext), NaN, ext)
+            out.extend([ext, self._nth(seg, t[first], 1, len(starts))])
+        return tuple(self._result(v) for v in out)
+
+    def stats(self, sigs, bins=None, range=None, thresholds=(),
+              blockrows=None, jobs=None):
+        """Return {name: stats} for the signals named in sigs within the
+        current xrange, in one pass over blocks of blockrows rows so memory
+        stays bounded for data larger than RAM.  stats is a dict of
+            min, max   - extreme sample values
+            tmin, tmax - where they first occur
+            mean, rms  - over the samples, see measAvg() and measRms() for
+                         time averages
+            count      - number of samples
+            hist       - (counts, edges) if bins (a number or the edges) is
+                         given, over range or a second pass from min to max
+            above      - counts of samples above each of thresholds
+        Complex signals are reduced by magnitude.  With jobs > 1 the blocks
+        are spread over a thread pool, numpy releases the GIL while it
+        works on them."""
+        if isinstance(sigs, basestring):
+            sigs = [sigs]
+        start, stop, step = self._slice.indices(len(self._ivar))
+        if blockrows is None:
+            blockrows = max(CHUNKSIZE // (8 * len(sigs)), 1024)
+        blocks = [(b, min(b + blockrows, stop))
+                  for b in xrange(start, stop, blockrows)]
+
+        def run(reduce):
+            if jobs > 1 and len(blocks) > 1:
+                pool = ThreadPool(jobs)
+                try:
+                    return pool.map(reduce, blocks)
+                finally:
+                    pool.close()
+                    pool.join()
+            return map(reduce, blocks)
+
+        def column(name, first, last):
+            y = self._signal(name, slice(first, last))
+            return np.abs(y) if np.iscomplexobj(y) else y
+
+        def moments(block):
+            first, last = block
+            parts = []
+            for name in sigs:
+                y = column(name, first, last)
+                imin, imax = y.argmin(), y.argmax()
+                y = y.astype(np.float64)
+                parts.append((y[imin], first + imin, y[imax], first + imax,
+                              y.sum(), np.dot(y, y),
+                              [np.count_nonzero(y > t) for t in thresholds]))
+            return parts
+
+        stats = OrderedDict()
+        for k, name in enumerate(sigs):
+            stats[name] = {'min': NaN, 'max': NaN, 'tmin': NaN, 'tmax': NaN,
+                           'mean': NaN, 'rms': NaN, 'count': stop - start,
+                           'above': [0] * len(thresholds)}
+        for k, parts in enumerate(zip(*run(moments))):
+            st = stats[sigs[k]]
+            lo = min(parts, key=lambda p: p[0])
+            hi = max(parts, key=lambda p: p[2])
+            total = sum(p[4] for p in parts)
+            squares = sum(p[5] for p in parts)
+            st.update(min=lo[0], tmin=self._ivar[lo[1]],
+                      max=hi[2], tmax=self._ivar[hi[3]],
+                      mean=total / st['count'],
+                      rms=np.sqrt(squares / st['count']),
+                      above=[sum(c) for c in zip(*[p[6] for p in parts])])
+
+        if bins is not None:
+            edges = {}
+            for name in sigs:
+                lo, hi = range or (stats[name]['min'], stats[name]['max'])
+                if np.isnan(lo):
+                    lo, hi = 0.0, 1.0
+                edges[name] = np.histogram([], bins, (lo, hi))[1]
+
+            def histograms(block):
+                return [np.histogram(column(name, *block), edges[name])[0]
+                        for name in sigs]
+
+            counts = [np.zeros(len(edges[name]) - 1, np.intp)
+                      for name in sigs]
+            for parts in run(histograms):
+                for k, c in enumerate(parts):
+                    counts[k] += c
+            for k, name in enumerate(sigs):
+                stats[name]['hist'] = (counts[k], edges[name])
+        return stats
+
+    def compare(self, other, sigs=None, abstol=1e-6, reltol=1e-3,
+                timetol=None, groupsize=None):
+        """Compare the signals of this run, the reference, with the same
+        signals of other, e.g. a reduced netlist, within the current xranges.
+        Both are resampled linearly onto the union of their time points
+        where they overlap.  Returns {name: result} with result a dict of
+            maxerr  - largest absolute difference
+            rmserr  - time-weighted RMS difference
+            shift   - largest time difference between matching crossings of
+                      the reference's mid-swing level, inf if the number of
+                      crossings differs (real signals only)
+            ncross  - number of crossings in each run
+            passed  - maxerr <= abstol + reltol*max|reference| and, with
+                      timetol, shift <= timetol
+        sigs defaults to all signals both runs have.  They are handled
+        groupsize at a time as 2-D arrays.  Compare single sweeps, see
+        getSweep()."""
+        if len(self.sweeprows) > 1 or len(other.sweeprows) > 1:
+            raise ValueError('Compare single sweeps, see getSweep()')
+        if sigs is None:
+            ivar = self.meta['ivar']
+            sigs = [self.signame(c) for i,c in self.colset if i != ivar]
+            sigs = [n for n in sigs if n in other.siglist]
+        elif isinstance(sigs, basestring):
+            sigs = [sigs]
+
+        ta, tb = self.x, other.x
+        t = np.union1d(ta, tb)
+        t = t[(t >= max(ta[0], tb[0])) & (t <= min(ta[-1], tb[-1]))]
+        n = len(t)
+        if groupsize is None:
+            groupsize = max(CHUNKSIZE // (8 * max(n, 1)), 1)
+
+        # time weights of the samples for the RMS
+        w = np.zeros(n)
+        dt = np.diff(t)
+        w[:-1] += 0.5 * dt
+        w[1:] += 0.5 * dt
+        if not w.sum():
+            w[:] = 1.0
+
+        def resample(d, tsrc, names):
+            k = np.clip(np.searchsorted(tsrc, t, 'right') - 1, 0,
+                        max(len(tsrc) - 2, 0))
+            step = tsrc[np.minimum(k + 1, len(tsrc) - 1)] - tsrc[k]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                f = np.where(step > 0, (t - tsrc[k]) / step, 0.0)[:,None]
+            cols = np.column_stack([d._signal(name, d._slice)
+                                    for name in names])
+            lo, hi = cols[k], cols[np.minimum(k + 1, len(tsrc) - 1)]
+            return lo + f * (hi - lo)
+
+        def crossings(D):
+            """(column, time) of the sign changes of each column of D"""
+            c, r = np.nonzero(((D[1:] >= 0) != (D[:-1] >= 0)).T)
+            frac = D[r,c] / (D[r,c] - D[r+1,c])
+            return c, t[r] + frac * (t[r+1] - t[r])
+
+        results = OrderedDict()
+        for g in xrange(0, len(sigs), groupsize):
+            names = sigs[g:g+groupsize]
+            A = resample(self, ta, names)
+            B = resample(other, tb, names)
+            E = np.abs(A - B)
+            maxerr = E.max(axis=0) if n else np.zeros(len(names))
+            rmserr = np.sqrt(np.dot(w, E * E) / w.sum())
+            scale = np.abs(A).max(axis=0) if n else np.zeros(len(names))
+
+            shift = np.zeros(len(names))
+            na = nb = np.zeros(len(names), np.intp)
+            if n > 1 and not np.iscomplexobj(A):
+                lo, hi = A.min(axis=0), A.max(axis=0)
+                level = 0.5 * (lo + hi)
+                swings = (hi - lo) > abstol
+                ca, xa = crossings((A - level) * swings)
+                cb, xb = crossings((B - level) * swings)
+                na = np.bincount(ca, minlength=len(names))
+                nb = np.bincount(cb, minlength=len(names))
+                same = na == nb
+                ka, kb = same[ca], same[cb]
+                np.maximum.at(shift, ca[ka], np.abs(xb[kb] - xa[ka]))
+                shift[~same] = np.inf
+
+            passed = maxerr <= abstol + reltol * scale
+            if timetol is not None:
+                passed &= shift <= timetol
+            for k, name in enumerate(names):
+                results[name] = {'maxerr': maxerr[k], 'rmserr': rmserr[k],
+                                 'shift': shift[k],
+                                 'ncross': (int(na[k]), int(nb[k])),
+                                 'passed': bool(passed[k])}
+        return results
+
+    def sweepIndex(self, name):
+        """Return the index of a sweep given by index, value or str(value)."""
+        if isinstance(name, (int, long)) and 0 <= name < len(self.sweepvals):
+            return name
+        if self._sweepidx is None:
+            self._sweepidx = {}
+            for i,v in reversed(list(enumerate(self.sweepvals))):
+                self._sweepidx[v] = i
+                self._sweepidx[str(v)] = i
+        try:
+            return self._sweepidx[name]
+        except (KeyError, TypeError):
+            raise ValueError('OOPS: %s is not a valid sweep name.' % repr(name))
+
     def getSweep(self, name):
         """Return another SimulationData object with a custom view of the
         rows of self.data and corresponding self._ivar.  Does not
         copy data, just references a slice of self.data."""
-        # return cached value
-        #sweep index
-        if name in self.sweep:
-            return self.sweep[name]
-        #str(sweep_value)
-        elif str(name) in self.sweep:
-            return self.sweep[str(name)]
-
-        # cache and return new sweep instance
-        if isinstance(name, int) and name >= 0 and name < len(self.sweepvals):
-            idx = name
-        elif str(name) in map(str, self.sweepvals):
-            idx = self.sweepvals.index(name)
-            name = str(name)
-        else:
-            raise ValueError('OOPS: %s is not a valid sweep name.' % repr(name))
+        idx = self.sweepIndex(name)
+
+        # return cached value, most recently used last
+        if idx in self.sweep:
+            c = self.sweep.pop(idx)
+            self.sweep[idx] = c
+            return c
 
         c = SimulationData()
+        c.meta = self.meta
         c.cols = self.cols
         c.colset = self.colset
         c.siglist = self.siglist
         c._sig2idx = self._sig2idx
         c.sweepvar = self.sweepvar
+        c.sweepvars = self.sweepvars
         c.sweepval = self.sweepvals[idx]
-        rowidx = (self.data[:,0] == c.sweepval)
-        c.data = self.data[rowidx,:]
-        c._ivar = self._ivar[rowidx]
+        start, stop = self.sweeprows[idx]
+        c.data = self.data[start:stop]
+        c._ivar = self._ivar[start:stop]
         #reset to new range
         c.xrange()
         #c.x = c._ivar
-        self.sweep[name] = c
+        self.sweep[idx] = c
+        if len(self.sweep) > self.sweepcache:
+            self.sweep.popitem(last=False)
         return c
 
     def xrange(self, xr=None):
         """Set the current independent axis range as tuple (xmin, xmax).  If
-        xr=None, reset the data slice to the full range."""
+        xr=None, reset the data slice to the full range.  The slice includes
+        the samples at or just outside xmin and xmax.
+
+        The independent variable must be increasing or decreasing, with
+        sweeps the range is found in the first sweep."""
+        self._xr = xr
         if not xr:
             self._xlims = [0, len(self._ivar)+1]
             self._slice = slice(self._xlims[0], self._xlims[1])
         else:
-            xmin, xmax = xr
-            self._xlims = [xmin, xmax]
-            zmin =  zc(self._ivar - xmin)
-            zmax = zc(self._ivar - xmax)
-            imin = zmin[0] if zmin.size else 0
-            imax = zmax[0] if zmax.size else len(self._ivar+1)
-            self._slice = slice(imin, imax)
+            self._xlims = list(xr)
+            self._slice = self._xslice(xr)
         self.x = self._ivar[self._slice]
 
+    def _xslice(self, xr):
+        """Return the slice of rows covering xr = (xmin, xmax)."""
+        xmin, xmax = xr
+        ivar = self._ivar
+        if len(self.sweeprows) > 1:
+            ivar = ivar[:self.sweeprows[0][1]]
+        if len(ivar) > 1 and ivar[-1] < ivar[0]:
+            # descending: search the negated values
+            ivar, xmin, xmax = -ivar, -xmax, -xmin
+        imin = max(np.searchsorted(ivar, xmin, 'right') - 1, 0)
+        imax = min(np.searchsorted(ivar, xmax, 'left') + 1, len(ivar))
+        return slice(imin, imax)
+
+    def decimated(self, sig, nbuckets=None, xr=None):
+        """Return (x, y) of the named signal reduced to a min/max envelope
+        of nbuckets buckets, see decimate(), within xr or the current
+        xrange.  The last decimatecache results are kept."""
+        nbuckets = nbuckets or self.plotbuckets
+        rows = self._slice if xr is None else self._xslice(xr)
+        key = (sig, rows.start, rows.stop, nbuckets)
+        if key in self._decimated:
+            xy = self._decimated.pop(key)
+        else:
+            xy = decimate(self._ivar[rows], self._signal(sig, rows), nbuckets)
+        self._decimated[key] = xy
+        if len(self._decimated) > self.decimatecache:
+            self._decimated.popitem(last=False)
+        return xy
+
+
+
 
+_controlchars = set(chr(i) for i in range(32) + [127]) - set('\t\r\n\f\v')
+
+def _isText(line):
+    """True if line has no control characters other than whitespace."""
+    return not _controlchars.intersection(line)
 
 
 class GnucapData(SimulationData):
     """Collect and present a Gnucap simulation output file as a numpy.array with
     access to column labels.
 
-    This is for the ASCII default format, the SBSO v0.1 format is easy
-    but unimplemented.
+    This is for the ASCII default format only.  Gnucap's binary SBSO
+    output is not read yet, see the Roadmap, and raises ValueError.  Binary
+    rawfiles of ngspice are read by NgspiceData.
     """
-    def loadData(self, infile):
+    def convert(self, infile, key):
         fin = open(infile, 'rb')
 
         header = fin.readline()
+        if not _isText(header):
+            fin.close()
+            raise ValueError('%s: binary Gnucap output (SBSO) is not read, '
+                             'use the ASCII format' % infile)
         cols = header.split()
-        self.cols = cols
-
-        #load cache if exists
-        npy = '.' + infile + '.npy'
-        mtime = os.path.getmtime
-        if os.path.exists(npy) and mtime(npy) >= mtime(infile):
-            print 'GnucapData: loading cached', npy
-            data = np.load(npy, 'r')
-        else:
-            print 'GnucapData: reading', infile, ' caching to', npy
-            data = np.genfromtxt(fin)
-            np.save(npy, data)
-        
-        # handle duplicate columns
-        # only use the last-defined name position
-        colset = []
-        for i,c in enumerate(cols):
-            if c not in cols[i+1:]:
-                colset.append([i, c])
-
-        self.colset = colset
-
-        #make signal vectors numpy arrays
-        self.siglist = []
-        self._sig2idx = {}
-        for i,name in colset:
-            # TODO: np.float only, handle complex also
-            #data[name] = np.array(data[name], dtype=np.float)
-
-            #set as an attributs also
-            n = name.replace('(', '')
-            n = n.replace(')', '')
-            n = n.replace('.', '_')
-            self.siglist.append(n)
-            self._sig2idx[n] = i
-
-            # special independent variable column
-            if name.startswith('#'):
-                n = '#Sweep' if name == '#' else n
-                setattr(self, n[1:], data[:,i])
-                setattr(self, '_ivar', data[:,i])
-            else:
-                pass
-                #setattr(self, n, data[:,i])
-
-        self.data = data
-
-        #default to full display range, init relevant attributes
-        self.xrange()
-
-        return self
-
-
 
+        ivar = [i for i,c in enumerate(cols) if c.startswith('#')]
+        ivar = ivar[0] if ivar else 0
+
+        out = self.cacheWriter(key, np.float64, len(cols))
+        sweeps = _SweepFinder(out.write, len(cols), ivar)
+        try:
+            readAsciiRows(fin, len(cols), sweeps.write)
+        except:
+            if not isinstance(out, _ArrayWriter):
+                out.abort()
+            raise
+        fin.close()
+
+        # sweeps are not labeled, number them as they restart
+        meta = {'format': 'gnucap',
+                'cols': cols,
+                'ivar': ivar,
+                'sweepvars': ['sweep'] if sweeps.sweeps() else [],
+                'sweeps': sweeps.sweeps(),
+               }
+        return self.commit(key, out, meta)
+
+    def refresh(self):
+        st = self._state
+        fin = open(self.infile, 'rb')
+        fin.seek(st['offset'])
+        if 'cols' not in st:
+            header = fin.readline()
+            if not header.endswith('\n'):
+                fin.close()
+                return 0
+            if not _isText(header):
+                fin.close()
+                raise ValueError('%s: binary Gnucap output (SBSO) is not '
+                                 'read, use the ASCII format' % self.infile)
+            cols = header.split()
+            ivar = [i for i,c in enumerate(cols) if c.startswith('#')]
+            st.update(offset=fin.tell(), cols=cols, ivar=ivar[0] if ivar else 0,
+                      starts=[0], nrows=0, last=None, direction=0)
+            self._writer = self.followWriter(np.float64, len(cols))
+
+        cols = st['cols']
+        sweeps = _SweepFinder(self._writer.write, len(cols), st['ivar'])
+        sweeps.starts, sweeps.nrows, sweeps.last, sweeps.direction = \
+                st['starts'], st['nrows'], st['last'], st.get('direction', 0)
+        # a partly written line is left for the next refresh
+        try:
+            readAsciiRows(fin, len(cols), sweeps.write, follow=True)
+            offset = fin.tell()
+        finally:
+            fin.close()
+        nnew = sweeps.nrows - st['nrows']
+        st.update(offset=offset, nrows=sweeps.nrows,
+                  starts=[int(i) for i in sweeps.starts],
+                  last=None if sweeps.last is None else float(sweeps.last),
+                  direction=int(sweeps.direction))
+        if not nnew and hasattr(self, 'data'):
+            return 0
+
+        meta = {'format': 'gnucap',
+                'cols': cols,
+                'ivar': st['ivar'],
+                'sweepvars': ['sweep'] if sweeps.sweeps() else [],
+                'sweeps': sweeps.sweeps(),
+               }
+        return self.followUpdate(meta, nnew)
+
+    def ivarname(self, col):
+        n = self.signame(col)
+        n = '#Sweep' if col == '#' else n
+        return n[1:]
 
 
 class HspiceData(SimulationData):
-    """Convert HSPICE sim data of .option post_version=9601 via sp2sp and
-    import into numpy.array with column labels.
+    """Read HSPICE binary sim data (.option post_version=9601 or 2001) into a
+    numpy.array with column labels.
+
+    The rows of all sweeps are copied once into the column-major cache and
+    memory-mapped from there, AC data is kept row-major so complex signals
+    are views of their real and imaginary columns.  If the cache can't be
+    written, data in a single block without sweeps is memory-mapped straight
+    from the file.  Sweep values and their row ranges are kept in
+    self.sweepvals and self.sweeprows.
     """
-    def loadData(self, infile):
-        mtime = os.path.getmtime
-        exists = os.path.exists
-
-        #intialize vars
-        colset = []
-        self.siglist = []
-        self._sig2idx = {}
-        self.sweepvar = None
-
-        # use gwave's converter to help out
-        # make cache file with custom sp2sp from gwave-svn
-        npy = infile + '.npy'
-        if not exists(npy) or mtime(infile) > mtime(npy):
-            print 'HspiceData: caching data to', npy
-            sp2sp = sp.call(['sp2sp', '-c', 'numpy', '-o', npy, infile])
-
-        #load cache file footer
-        print 'HspiceData: loading cached', npy
-        fnpy = open(npy, 'rb')
-        fnpy.seek(-2, os.SEEK_END)
-        dictlen = struct.unpack('<H', fnpy.read(2))[0]
-        fnpy.seek(-dictlen, os.SEEK_END)
-        s = fnpy.readline().lstrip()
-        npyinfo = np.lib.utils.safe_eval(s)
-        self.npy = npyinfo
-        fnpy.close()
-
-        cols = npyinfo['cols']
-        self.cols = cols
-
-        # load data as a numpy memmap
-        data = np.load(npy, 'r')
-
-        # check for sweep
-        #TODO: only handles one sweep var, no nested
-        nsweepvars = len(npyinfo['sweepvars'])
-        if npyinfo['sweepvars']:
-            #TODO: sweeprows has lots of (0,0)'s for a MC sweep
-            self.sweepvar = npyinfo['sweepvars'][0]
-            self.sweepvals = [data[first,0] for first,last in npyinfo['sweeprows'] if last != 0]
-        #NOTE: the following is unreachable??, if sweep: 'sweepvars' exists from cache
-        elif '.' in cols[0]:
-            #parameter sweep
-            self.sweepvar = 'param'
-            self.sweepvals = sorted(set(data[:,0]))
-        elif cols[0].lower() == cols[0]:
-            self.sweepvar = cols[0]
-            self.sweepvals = sorted(set(data[:,0]))
-        elif 'MONTE_CARLO' == cols[0]:
-            self.sweepvar = 'MC'
-            self.sweepvals = sorted(set(data[:,0]))
-
-        if self.sweepvar:
-            print 'Contained sweeps:', self.sweepvar, map(str, self.sweepvals)
-
-        # handle duplicate columns
-        # only use the last-defined name position
-        # XXX: does this happen with HSPICE data?
-        for i,c in enumerate(cols):
-            if c not in cols[i+1:]:
-                #account for prepended sweep values
-                colset.append([i+nsweepvars, c])
-
-        self.colset = colset
-
-        #make signal vectors numpy arrays
-        for i,name in colset:
-            # TODO: np.float only, handle complex also
-            #data[name] = np.array(data[name], dtype=np.float)
-
-            #set as an attribute also
-            n = name.replace('(', '')
-            #n = n.replace(')', '')
-            n = n.replace('.', '_')
-            self.siglist.append(n)
-            self._sig2idx[n] = i
-
-            if (self.sweepvar and i == 1) or (not self.sweepvar and i == 0):
-                setattr(self, n, data[:,i])
-                setattr(self, '_ivar', data[:,i])
+    def convert(self, infile, key):
+        fin = open(infile, 'rb')
+        info, blocks = hspiceHeader(fin)
+        cols = info['cols']
+        ncols = len(cols)
+        dtype = info['dtype']
+        nsweepvars = len(info['sweepvars'])
+
+        meta = dict(info, format='hspice', ivar=0,
+                    dtype=np.lib.format.dtype_to_descr(dtype))
+
+        out = self.cacheWriter(key, dtype, ncols, not info['complex'])
+        if isinstance(out, _ArrayWriter) and not nsweepvars and \
+           len(blocks) == 1:
+            # one contiguous block, use the file as-is
+            off, nbytes = blocks[0]
+            raw = np.memmap(infile, dtype, 'r', off, (nbytes // dtype.itemsize,))
+            ends = np.flatnonzero(raw[::ncols] >= 0.99*HSPICE_END)
+            nrows = ends[0] if ends.size else raw.size // ncols
+            fin.close()
+            meta['sweeps'] = [[[], 0, int(nrows)]]
+            return raw[:nrows*ncols].reshape(nrows, ncols), meta
+
+        try:
+            meta['sweeps'] = _hspiceRows(fin, blocks, dtype, nsweepvars,
+                                         ncols, out.write)
+        except:
+            if not isinstance(out, _ArrayWriter):
+                out.abort()
+            raise
+        fin.close()
+        return self.commit(key, out, meta)
+
+    def refresh(self):
+        st = self._state
+        fin = open(self.infile, 'rb')
+        if 'meta' not in st:
+            try:
+                info, blocks = hspiceHeader(fin)
+            except (ValueError, struct.error):
+                # header not written yet
+                fin.close()
+                return 0
+            dtype = info['dtype']
+            st.update(offset=info['datapos'], endian=_hspiceEndian(fin),
+                      rows=None,
+                      meta=dict(info, format='hspice', ivar=0,
+                                dtype=np.lib.format.dtype_to_descr(dtype)))
+            self._writer = self.followWriter(dtype, len(info['cols']))
+        meta = st['meta']
+        ncols = len(meta['cols'])
+
+        # only blocks that are completely written
+        fin.seek(0, os.SEEK_END)
+        size = fin.tell()
+        blocks = []
+        for off, nbytes in _hspiceBlocks(fin, st['endian'], st['offset']):
+            if off + nbytes + 4 > size:
+                break
+            blocks.append((off, nbytes))
+        rows = _HspiceRows(np.dtype(meta['dtype']), len(meta['sweepvars']),
+                           ncols, self._writer.write, st['rows'])
+        before = rows.written // ncols
+        rows.feed(fin, blocks)
+        fin.close()
+        if blocks:
+            st['offset'] = blocks[-1][0] + blocks[-1][1] + 4
+        st['rows'] = rows.state()
+        nnew = rows.written // ncols - before
+        if not nnew and hasattr(self, 'data'):
+            return 0
+
+        # the sweep being written so far
+        sweeps = list(rows.sweeps)
+        if rows.insweep:
+            sweeps.append([rows.head, rows.first, rows.written // ncols])
+        return self.followUpdate(dict(meta, sweeps=sweeps), nnew)
+
+    def signame(self, col):
+        # HSPICE names have no closing paren: v(out
+        return col.replace('(', '').replace('.', '_')
+
+
+class NgspiceData(SimulationData):
+    """Read a SPICE3/ngspice rawfile, binary or ASCII, into a numpy.array
+    with column labels.
+
+    A rawfile holds one or more plots.  The last plot is read along with
+    the earlier plots that have the same variables (.step, alter, repeated
+    runs), which become the sweeps of 'plot', numbered by their place in the
+    file.  plot selects plots by number or Plotname instead.
+
+    Binary values are memory-mapped and copied once into the cache, a
+    single plot of real data is used straight from the file if the cache
+    can't be written.  Complex (AC) vectors are listed as name_0, name_1
+    and kept row-major like in HspiceData.
+
+    Unlike the other readers there is no follow mode: ngspice writes the
+    rawfile when the run ends, follow=True raises ValueError.
+    """
+    def __init__(self, infile=None, cache=None, follow=False, plot=None):
+        if follow:
+            raise ValueError('NgspiceData: rawfiles can not be followed')
+        self.plot = plot
+        SimulationData.__init__(self, infile, cache)
+
+    def cacheKey(self, infile):
+        key = SimulationData.cacheKey(self, infile)
+        if self.plot is None:
+            return key
+        return hashlib.sha1(repr((key, self.plot))).hexdigest()
+
+    def choose(self, plots):
+        """Return the indexes of the plots to read, see the class doc."""
+        if self.plot is None:
+            which = range(len(plots))
+        elif isinstance(self.plot, int):
+            which = [range(len(plots))[self.plot]]
+        else:
+            which = [k for k, p in enumerate(plots)
+                     if p.get('plotname') == self.plot]
+        if not which:
+            raise ValueError('%s: no plot %r' % (self.infile, self.plot))
+        last = plots[which[-1]]
+        return [k for k in which if plots[k]['vars'] == last['vars'] and
+                plots[k]['complex'] == last['complex']]
+
+    def convert(self, infile, key):
+        fin = open(infile, 'rb')
+        plots = rawPlots(fin)
+        fin.close()
+        if not plots:
+            raise ValueError('%s: no plots in rawfile' % infile)
+        chosen = self.choose(plots)
+        info = plots[chosen[-1]]
+        iscomplex = info['complex']
+        names = [n for n, t in info['vars']]
+        cols = names[:1]
+        for n in names[1:]:
+            cols.extend([n + '_0', n + '_1'] if iscomplex else [n])
+
+        meta = {'format': 'ngspice',
+                'title': info.get('title', ''),
+                'date': info.get('date', ''),
+                'plotname': info.get('plotname', ''),
+                'plots': [p.get('plotname', '') for p in plots],
+                'types': [t for n, t in info['vars']],
+                'complex': iscomplex,
+                'cols': cols,
+                'ivar': 0,
+                'sweepvars': ['plot'] if len(chosen) > 1 else [],
+               }
+
+        out = self.cacheWriter(key, np.float64, len(cols), not iscomplex)
+        if isinstance(out, _ArrayWriter) and len(chosen) == 1 and \
+           info['binary'] and not iscomplex:
+            meta['sweeps'] = [[[], 0, info['npoints']]]
+            return rawValues(infile, info), meta
+
+        sweeps = []
+        nrows = 0
+        try:
+            for k in chosen:
+                values = rawValues(infile, plots[k])
+                step = max(CHUNKSIZE // (values.shape[1] * 8), 1)
+                for i in xrange(0, len(values), step):
+                    block = values[i:i+step]
+                    if iscomplex:
+                        # the frequency is written as complex too
+                        block = np.delete(block, 1, 1)
+                    out.write(block)
+                sweeps.append([[k], nrows, nrows + len(values)])
+                nrows += len(values)
+        except:
+            if not isinstance(out, _ArrayWriter):
+                out.abort()
+            raise
+        meta['sweeps'] = sweeps if len(chosen) > 1 else []
+        return self.commit(key, out, meta)
+
+    def signame(self, col):
+        # ngspice names: v(out), i(vdd), vdd#branch, @m1[id]
+        name = SimulationData.signame(self, col)
+        return re.sub(r'\W+', '_', name).strip('_')
+
+
+class MergedData(SimulationData):
+    """Several simulation results with the same signals as one data set,
+    e.g. the PVT corners of a regression.  The outer sweep 'file' numbers
+    the files in self.files, the sweeps of each file are nested inside it.
+
+    self.data is a MergedArray over the parts' own (cached, memory-mapped)
+    data, so merging copies nothing.  A sweep is a view into its file's
+    data, reading a signal concatenates its rows from each file.
+    """
+    def __init__(self, parts, files=None, cache=None):
+        SimulationData.__init__(self, cache=cache)
+        self.files = list(files or [p.infile for p in parts])
+        self._namer = parts[0]
+        self.key = hashlib.sha1(repr(('merge', [p.key for p in parts]))
+                                ).hexdigest()
+        self.setup(*self.merge(parts))
+
+    def merge(self, parts):
+        """Return (data, meta) of the parts as one data set."""
+        cols = parts[0].cols
+        innervars = parts[0].sweepvars
+        for f, p in zip(self.files, parts):
+            if p.cols != cols:
+                raise ValueError('%s: signals differ from %s' %
+                                 (f, self.files[0]))
+            if p.sweepvars != innervars:
+                raise ValueError('%s: sweeps %s differ from %s' %
+                                 (f, p.sweepvars, innervars))
+
+        sweeps = []
+        nrows = 0
+        for k, p in enumerate(parts):
+            if p.sweeprows:
+                for (first, last), v in zip(p.sweeprows, p.sweepvals):
+                    v = list(v) if isinstance(v, tuple) else [v]
+                    sweeps.append([[k] + v, nrows + first, nrows + last])
+            else:
+                sweeps.append([[k], nrows, nrows + len(p.data)])
+            nrows += len(p.data)
+
+        meta = {'format': 'merged',
+                'files': self.files,
+                'complex': bool(parts[0].meta.get('complex')),
+                'cols': cols,
+                'ivar': parts[0].meta['ivar'],
+                'sweepvars': ['file'] + innervars,
+                'sweeps': sweeps,
+               }
+        return MergedArray([p.data for p in parts]), meta
+
+    def signame(self, col):
+        return self._namer.signame(col)
+
+    def ivarname(self, col):
+        return self._namer.ivarname(col)
+
+
+def loadSimData(dfile, cache=None, follow=False):
+    """Load dfile with the reader for its format: rawfiles are known by
+    their header, .dat files are Gnucap output, others HSPICE."""
+    if isRawfile(dfile):
+        return NgspiceData(dfile, cache, follow)
+    elif dfile.endswith('.dat'):
+        return GnucapData(dfile, cache, follow)
+    else:
+        return HspiceData(dfile, cache, follow)
+
+
+def _convertJob(args):
+    """Pool worker: make sure a file is converted into the cache, a copy of
+    the parent's (with its class and options, so the keys match)."""
+    path, cache = args
+    if cache.load(cache.key(path)) is None:
+        loadSimData(path, cache)
+
+
+def loadSimDataBatch(paths, jobs=None, cache=None):
+    """Load many simulation files with the same signals as one MergedData,
+    whose outer sweep is the file.  Files not yet in the cache are converted
+    by a pool of jobs processes (default one per CPU); the parent only maps
+    the cached results.  With an unwritable cache the parent converts each
+    file again."""
+    cache = cache or defaultCache
+    if jobs != 1 and len(paths) > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            pool.map(_convertJob, [(p, cache) for p in paths], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    parts = [loadSimData(p, cache) for p in paths]
+    return MergedData(parts, paths, cache)
+
+
+class _Redecimator:
+    """Redraws the decimated lines of one axes from their source(xrange)
+    when its x limits change.  It is kept on the axes, so it and the full
+    resolution data of its sources go away with the figure."""
+    def __init__(self, ax):
+        self.lines = []
+        ax.callbacks.connect('xlim_changed', self.update)
+
+    def update(self, ax):
+        # forget lines removed from their axes
+        self.lines = [(l, s) for l, s in self.lines if l.axes is ax]
+        xr = ax.get_xlim()
+        for line, source in self.lines:
+            if isinstance(line, LineCollection):
+                line.set_segments(source(xr))
+            else:
+                line.set_data(*source(xr))
+        ax.figure.canvas.draw_idle()
 
-        self.data = data
 
-        #default to full display range, init relevant attributes
-        self.xrange()
-        #self.x = self._ivar
+def _redecimate(lines, source):
+    """Redraw the lines from source(xrange) when their axes are zoomed."""
+    for line in lines:
+        if not isinstance(line, (Line2D, LineCollection)):
+            continue
+        ax = line.axes
+        if not hasattr(ax, '_redecimator'):
+            ax._redecimator = _Redecimator(ax)
+        ax._redecimator.lines.append((line, source))
 
-        # separate out sweeps into self.sweep[0] and self.sweep['0,0']
-        if 0: #use getSweep() instead
-            if self.sweepvar:
-                for i,val in enumerate(self.sweepvals):
-                    d = self.getSweep(i)
-                    self.sweep[i] = d
-                    self.sweep[str(self.sweepvals[i])] = self.sweep[i]
 
-        return self
+def _plotbuckets(ax=None):
+    """One decimation bucket per pixel of the axes width."""
+    ax = ax or pyl.gca()
+    return max(int(ax.bbox.width), 100)
 
 
-def loadSimData(dfile):
-    if dfile.endswith('.dat'):
-        return GnucapData(dfile)
-    else:
-        return HspiceData(dfile)
+def _zoomsource(x, y, nbuckets):
+    """Return a source(xrange) decimating the visible part of (x, y)."""
+    def source(xr):
+        imin = max(np.searchsorted(x, xr[0], 'right') - 1, 0)
+        imax = np.searchsorted(x, xr[1], 'left') + 1
+        return decimate(x[imin:imax], y[imin:imax], nbuckets)
+    return source
 
 
 class SignalPlotter():
     def __init__(self, gcdata=None):
         self.gcdata = gcdata
+        self.lines = []
+        self.timer = None
 
     def __call__(self, ys, x=None, *args, **kwargs):
         """Plot the signal named by string ys, label the curve by the true
         signal name UOS.  Additional args are passed to plot().
+
+        Long signals are plotted as a min/max envelope with a bucket per
+        pixel, which is redone for the new range when the plot is zoomed.
         """
+        d = self.gcdata
         if 'label' not in kwargs:
-            idx = self.gcdata._sig2idx[ys]
-            kwargs['label'] = self.gcdata.cols[idx]
-        y = getattr(self.gcdata, ys)
-
-        if 'plotter' in kwargs:
-            kwargs['plotter'](self.gcdata.x, y, *args, **kwargs)
-        else:
-            pyl.plot(self.gcdata.x, y, *args, **kwargs)
+            idx = d._sig2idx[ys]
+            kwargs['label'] = d.cols[idx]
+        plotter = kwargs.pop('plotter', pyl.plot)
+        nbuckets = _plotbuckets()
+        x, y = d.decimated(ys, nbuckets)
+
+        lines = plotter(x, y, *args, **kwargs)
+        self.lines.extend((l, ys, nbuckets) for l in lines or []
+                          if isinstance(l, Line2D))
+        if len(d.sweeprows) <= 1:
+            _redecimate(lines or [], lambda xr: d.decimated(ys, nbuckets, xr))
         pyl.legend(loc='best')
 
+    def refresh(self):
+        """Load the rows appended to followed data and redraw the plotted
+        signals, returns the number of new rows."""
+        d = self.gcdata
+        nnew = d.refresh()
+        if not nnew:
+            return 0
+        axes = []
+        for line, ys, nbuckets in self.lines:
+            ax = line.axes
+            if ax is None:
+                continue
+            xr = None if ax.get_autoscalex_on() else ax.get_xlim()
+            line.set_data(*d.decimated(ys, nbuckets, xr))
+            if ax not in axes:
+                axes.append(ax)
+        for ax in axes:
+            ax.relim()
+            ax.autoscale_view()
+            ax.figure.canvas.draw_idle()
+        return nnew
+
+    def follow(self, interval=2000):
+        """Call refresh() every interval ms while the figure is shown,
+        returns the timer."""
+        if self.timer is None:
+            self.timer = pyl.gcf().canvas.new_timer(interval=interval)
+            self.timer.add_callback(self.refresh)
+        self.timer.interval = interval
+        self.timer.start()
+        return self.timer
+
+
+class _SweepStack:
+    """Stands in for a sweep in plotsweep() expressions, for a set of sweeps
+    of equal length at once: signals and x are 2-D arrays of (sweep, point)
+    and sweepval is a column of the sweep values."""
+    def __init__(self, d, idx):
+        self._d = d
+        rows = np.array([d.sweeprows[i] for i in idx])
+        self._starts = rows[:,0]
+        self._len = rows[0,1] - rows[0,0]
+        self.sweepvar = d.sweepvar
+        self.sweepvars = d.sweepvars
+        vals = np.array([d.sweepvals[i] for i in idx])
+        self.sweepval = vals.reshape(len(idx), -1)
+
+    def _rows(self, col):
+        n, k = len(self._starts), self._len
+        first = self._starts[0]
+        if (self._starts == first + k*np.arange(n)).all():
+            return col[first:first + n*k].reshape(n, k)
+        return col[self._starts[:,None] + np.arange(k)]
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        if attr == 'x':
+            return self._rows(self._d._ivar)
+        return self._rows(self._d._signal(attr, slice(None)))
+
+
+def _sweepeval(d, exp, s, globals):
+    """Evaluate a compiled expression or call a function of sweep s."""
+    if callable(exp):
+        return exp(s)
+    return eval(exp, globals, {'s': s, 'd': d, 'v': s.sweepval})
+
+
+def sweepcurves(d, exp, idx, ivar=None, globals=None, vectorize=False):
+    """Return [(x, y), ...] of expression exp for the sweeps numbered idx.
+
+    exp and ivar are strings of Python code using the sweep as s, or
+    functions of the sweep.  Strings are compiled once and evaluated for
+    each sweep.  With vectorize set and sweeps of equal length they are
+    evaluated once for all sweeps stacked as 2-D arrays instead, which is
+    only right for expressions that work element by element (not
+    s.vout[0], s.vout.max() or np.cumsum(s.vout)).
+    """
+    globals = globals or _moduleglobals
+    exp, ivar = [compile(e, '<plotsweep>', 'eval') if isinstance(e, str)
+                 else e for e in (exp, ivar)]
+    lengths = set(d.sweeprows[i][1] - d.sweeprows[i][0] for i in idx)
+    if vectorize and len(lengths) == 1:
+        s = _SweepStack(d, idx)
+        try:
+            y = _sweepeval(d, exp, s, globals)
+            x = _sweepeval(d, ivar, s, globals) if ivar else s.x
+            x, y = np.broadcast_arrays(x, y)
+            if x.shape == (len(idx), lengths.pop()):
+                return zip(x, y)
+        except ValueError:
+            pass
+
+    curves = []
+    for i in idx:
+        s = d.getSweep(i)
+        y = _sweepeval(d, exp, s, globals)
+        x = _sweepeval(d, ivar, s, globals) if ivar else s.x
+        curves.append(np.broadcast_arrays(x, y))
+    return curves
+
+
 def plotsweep(d, exp, vals=None, ivar=None, globals=None, labelprefix='',
-              plotter=None):
+              plotter=None, vectorize=False):
+    """Plot expression exp against the independent variable, or expression
+    ivar, for the sweeps vals (default all), see sweepcurves().
+
+    The curves are drawn as one LineCollection decimated to the axes width
+    and redone when zoomed, and a legend is shown for up to 20 sweeps.  With
+    plotter, e.g. pylab.semilogy, each sweep is plotted by a call to it.
+
+    The curves of string expressions using the module globals are cached
+    by expression and sweeps until the data or its sweeps change, so
+    replotting them is cheap.  Pass vectorize=True to evaluate element by
+    element expressions for all sweeps at once.  It stays off by default
+    since a stacked expression like s.vout - s.vout[0] runs without error
+    and gives wrong curves.
+    """
     interact = pyl.isinteractive()
     if interact:
         pyl.interactive(False)
 
     if not vals:
         vals = d.sweepvals
+    idx = [d.sweepIndex(v) for v in vals]
 
-    for v in vals:
-        s = d.getSweep(v)
-        
-        if isinstance(exp, str):
-            if globals:
-                y = eval(exp, globals, locals())
-            else:
-                y = eval(exp)
-        else:
-            y = exp(s)
-
-        if plotter:
-            p = plotter
+    # other globals or functions may change between calls
+    if globals is None and not [e for e in (exp, ivar) if callable(e)]:
+        key = (exp, ivar, tuple(idx), vectorize)
+    else:
+        key = None
+    if key in d._evalcache:
+        curves = d._evalcache.pop(key)
+    else:
+        curves = sweepcurves(d, exp, idx, ivar, globals, vectorize)
+    if key is not None:
+        d._evalcache[key] = curves
+        if len(d._evalcache) > d.evalcache:
+            d._evalcache.popitem(last=False)
+
+    labels = []
+    for i in idx:
+        val = d.sweepvals[i]
+        if isinstance(val, tuple):
+            label = ', '.join('%s=%g' % nv for nv in zip(d.sweepvars, val))
         else:
-            p = pyl.plot
+            label = '%s=%g' % (d.sweepvar, val)
+        labels.append(labelprefix + label)
+
+    ax = pyl.gca()
+    nbuckets = _plotbuckets(ax)
+    if plotter:
+        for (x, y), label in zip(curves, labels):
+            lines = plotter(*decimate(x, y, nbuckets), label=label)
+            if not ivar:
+                _redecimate(lines or [], _zoomsource(x, y, nbuckets))
+        artist = None
+        pyl.legend(loc='best')
+    else:
+        def segments(xr=None):
+            if xr is None:
+                return [np.column_stack(decimate(x, y, nbuckets))
+                        for x, y in curves]
+            return [np.column_stack(_zoomsource(x, y, nbuckets)(xr))
+                    for x, y in curves]
+
+        colors = pyl.rcParams['axes.prop_cycle'].by_key()['color']
+        colors = [colors[k % len(colors)] for k in range(len(curves))]
+        artist = LineCollection(segments(), colors=colors,
+                                label=labelprefix + ', '.join(d.sweepvars))
+        ax.add_collection(artist)
+        ax.autoscale_view()
+        if not ivar:
+            _redecimate([artist], segments)
+        if len(curves) <= 20:
+            ax.legend([Line2D([], [], color=c) for c in colors], labels,
+                      loc='best')
 
-        if ivar:
-            if isinstance(ivar, str):
-                if globals:
-                    x = eval(exp, globals, locals())
-                else:
-                    x = eval(exp)
-            else:
-                x = exp(s)
-        else:
-            x = s.x
+    pyl.interactive(interact)
+    return artist
 
-        p(x, y, label='%s%s=%g' % (labelprefix, s.sweepvar, s.sweepval))
 
-    pyl.interactive(interact)
-    pyl.legend(loc='best')
+_moduleglobals = globals()
 
 
 if __name__ == "__main__":
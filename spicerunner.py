@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""
+spicerunner.py
+
+Runs netlists through a simulator and loads the results with spicereader.
+Simulations run a bounded number at a time.  Each result is kept in a
+directory named by a hash of the netlist text and the simulator command, so a
+netlist that was already simulated comes straight back through
+spicereader.loadSimData (and its waveform cache) without running again.
+
+ Usage:
+  spicerunner.py [-j jobs] [-s simulator] [-d rundir] netlists...
+
+The simulator is 'ngspice', 'gnucap' or a command template where {netlist}
+and {output} are replaced by the file names, e.g.
+  'ngspice -b -r {output} {netlist}'
+Without {output} the simulator's standard output is the result file.
+
+Licensed by the GPL, see http://www.whiteaudio.com/soft/COPYING or the current
+GNU GPL license for details.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+
+import spicereader
+
+
+# command template and result file extension of the known simulators
+SIMULATORS = {
+    'ngspice': ('ngspice -b -r {output} {netlist}', '.raw'),
+    'gnucap': ('gnucap -b {netlist}', '.dat'),
+}
+
+NETLIST = 'netlist.sp'
+STATUS = 'status.json'
+LOG = 'log'
+
+
+def netlistText(netlist):
+    """Return the text of a pyspice Netlist (or a string) as it is given to
+    the simulator, ending with .end."""
+    if isinstance(netlist, basestring):
+        return netlist
+    s = StringIO()
+    print>>s, (netlist.title or '*').rstrip('\r\n')
+    for card in netlist.deck:
+        print>>s, card
+    # Netlist.readfile leaves off the last card
+    last = netlist.deck[-1] if netlist.deck else None
+    if not (last and last.type == '.' and last.keyword == '.end'):
+        print>>s, '.end'
+    return s.getvalue()
+
+
+class Result:
+    """One simulation: the job's key and directory, the simulator's exit
+    status and wall time in seconds, and whether it came from an earlier
+    run.  The SimulationData is loaded on first use of .data, it is None if
+    the simulation failed."""
+    def __init__(self, runner, key, path, status, walltime, cached):
+        self.runner = runner
+        self.key = key
+        self.path = path
+        self.status = status
+        self.walltime = walltime
+        self.cached = cached
+        self._data = None
+
+    def __repr__(self):
+        return '<Result %s: status %i, %.3gs%s>' % (
+                self.key[:12], self.status, self.walltime,
+                ' cached' if self.cached else '')
+
+    @property
+    def output(self):
+        return os.path.join(self.path, 'output' + self.runner.ext)
+
+    @property
+    def log(self):
+        return os.path.join(self.path, LOG)
+
+    @property
+    def data(self):
+        if self._data is None and self.status == 0:
+            self._data = spicereader.loadSimData(self.output,
+                                                 self.runner.cache)
+        return self._data
+
+
+class Runner:
+    """Runs netlists with a simulator command, see the module doc.  At most
+    jobs (default one per CPU) simulators run at once, results are kept
+    under rundir."""
+    def __init__(self, simulator='ngspice', rundir='spicerunner', jobs=None,
+                 ext=None, cache=None):
+        self.command, self.ext = SIMULATORS.get(simulator, (simulator, '.raw'))
+        self.ext = ext or self.ext
+        self.rundir = rundir
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.cache = cache
+
+    def key(self, text):
+        """Return the result key of netlist text with this simulator."""
+        return hashlib.sha1(repr((text, self.command, self.ext))).hexdigest()
+
+    def lookup(self, key):
+        """Return the Result of a successful earlier run of key, or None."""
+        path = os.path.join(self.rundir, key)
+        try:
+            with open(os.path.join(path, STATUS)) as fp:
+                status = json.load(fp)
+        except (IOError, ValueError):
+            return None
+        if status['status']:
+            return None
+        return Result(self, key, path, 0, status['walltime'], True)
+
+    def run(self, netlists):
+        """Simulate the netlists (pyspice Netlists or text), returns their
+        Results in the same order.  Netlists simulated before are not run
+        again, nor are duplicates."""
+        texts = [netlistText(n) for n in netlists]
+        keys = [self.key(t) for t in texts]
+        results = {}
+        todo = []
+        for key, text in zip(keys, texts):
+            if key in results:
+                continue
+            results[key] = self.lookup(key)
+            if results[key] is None:
+                todo.append((key, text))
+
+        if todo:
+            if not os.path.isdir(self.rundir):
+                os.makedirs(self.rundir)
+            pool = ThreadPool(min(self.jobs, len(todo)))
+            try:
+                for r in pool.map(self.simulate, todo):
+                    results[r.key] = r
+            finally:
+                pool.close()
+                pool.join()
+        return [results[k] for k in keys]
+
+    def simulate(self, job):
+        """Run one (key, text) job in a fresh directory, moved into place
+        when done so a half-written result is never looked up."""
+        key, text = job
+        work = tempfile.mkdtemp(prefix='.' + key[:12], dir=self.rundir)
+        with open(os.path.join(work, NETLIST), 'w') as fp:
+            fp.write(text)
+        output = 'output' + self.ext
+        command = self.command.format(netlist=NETLIST, output=output)
+
+        log = open(os.path.join(work, LOG), 'wb')
+        stdout = log if '{output}' in self.command else \
+                 open(os.path.join(work, output), 'wb')
+        start = time.time()
+        try:
+            status = subprocess.call(command, shell=True, cwd=work,
+                                     stdout=stdout, stderr=log)
+        finally:
+            walltime = time.time() - start
+            stdout.close()
+            log.close()
+        # closed before the rename so lookup never sees a partial status
+        with open(os.path.join(work, STATUS), 'w') as fp:
+            json.dump({'status': status, 'walltime': walltime,
+                       'command': command}, fp)
+
+        path = os.path.join(self.rundir, key)
+        if os.path.isdir(path):
+            # a failed earlier run, or the same netlist finished meanwhile
+            if self.lookup(key) and not status:
+                shutil.rmtree(work)
+                return Result(self, key, path, status, walltime, False)
+            shutil.rmtree(path, ignore_errors=True)
+        os.rename(work, path)
+        return Result(self, key, path, status, walltime, False)
+
+
+if __name__ == "__main__":
+    import optparse
+
+    usage = 'usage: %prog [options] netlists...'
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('-s', '--simulator', dest='simulator',
+                      default='ngspice',
+                      help='ngspice, gnucap or a command template '
+                           '(default %default)')
+    parser.add_option('-d', '--rundir', dest='rundir', default='spicerunner',
+                      help='Directory of the results (default %default)')
+    parser.add_option('-j', '--jobs', dest='jobs', type='int',
+                      help='Simulations at a time (default one per CPU)')
+    parser.add_option('-e', '--ext', dest='ext',
+                      help='Result file extension of a command template')
+
+    opts, args = parser.parse_args()
+
+    runner = Runner(opts.simulator, opts.rundir, opts.jobs, opts.ext)
+    texts = [open(f, 'rU').read() for f in args]
+    for f, r in zip(args, runner.run(texts)):
+        print '%s: status %i, %.2fs%s -> %s' % (
+                f, r.status, r.walltime, ' (cached)' if r.cached else '',
+                r.output if r.status == 0 else r.log)
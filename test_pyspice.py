@@ -13,9 +13,17 @@ __copyright__ = "Copyright (c) 2007 Dan White"
 __license__ = "GPL"
 
 import pyspice
+import time
 import unittest
 from decimal import Decimal as D
 
+def makeNetlist(cards):
+    """Build a Netlist from a list of already-massaged element lines."""
+    nlist = pyspice.Netlist(title='test')
+    for num, card in enumerate(cards):
+        nlist.addElement(nlist.classify(card, num=num+2))
+    return nlist
+
 #@+others
 #@+node:unit conversions
 
@@ -51,8 +59,375 @@ class unitConversion(unittest.TestCase):
 class netlistParsing(unittest.TestCase):
     """Tests the netlist parser"""
     pass
-#@nonl
 #@-node:netlist parsing
+#@+node:capacitor decoupling
+
+class capacitorDecoupling(unittest.TestCase):
+    """Tests grounding of small coupling capacitors"""
+    cards = ['c1 a 0 10e-15',
+             'c2 a gnd 5e-15',
+             'c3 a b 1e-15',
+             'c4 b c 100e-15',
+             'c5 b 0 20e-15',
+             'c6 c d 1e-15']
+
+    def test_decouple_value(self):
+        """coupling caps below the threshold are lumped onto each node"""
+        nlist = makeNetlist(self.cards)
+        n = pyspice.decoupleCapacitorsInplace(nlist, value=2e-15)
+        self.assertEqual(n, 2)
+        caps = dict((c.name, c) for c in nlist.elements['c'])
+        # c2 to gnd is lumped with c1 to 0
+        self.assertEqual(sorted(caps), ['c1', 'c4', 'c5', 'c6_c', 'c6_d'])
+        self.assertAlmostEqual(caps['c1'].value, 16e-15)
+        self.assertAlmostEqual(caps['c5'].value, 21e-15)
+        self.assertEqual(caps['c4'].value, 100e-15)
+        self.assertEqual((caps['c6_d'].n1, caps['c6_d'].n2), ('d', '0'))
+        self.assertEqual(nlist.deck[-2:], [caps['c6_c'], caps['c6_d']])
+
+    def test_decouple_ratio_miller(self):
+        """ratio threshold and Miller factor, new ground cap if none exists"""
+        nlist = makeNetlist(self.cards)
+        n = pyspice.decoupleCapacitorsInplace(nlist, ratio=0.5, miller=2.0)
+        self.assertEqual(n, 1)
+        caps = dict((c.name, c) for c in nlist.elements['c'])
+        self.assertTrue('c3' not in caps)
+        self.assertAlmostEqual(caps['c1'].value, 17e-15)
+        self.assertAlmostEqual(caps['c5'].value, 22e-15)
+        self.assertEqual(sorted(caps), ['c1', 'c4', 'c5', 'c6'])
+
+    def test_decouple_nothing(self):
+        """no thresholds, no changes"""
+        nlist = makeNetlist(self.cards)
+        self.assertEqual(pyspice.decoupleCapacitorsInplace(nlist), 0)
+        self.assertEqual(len(nlist.elements['c']), 6)
+
+    def test_decouple_names(self):
+        """new caps don't reuse existing names, gnd on either side lumps"""
+        nlist = makeNetlist(['c1 a b 1e-16', 'c1_a x 0 1e-15',
+                             'c2 gnd b 1e-15'])
+        self.assertEqual(pyspice.decoupleCapacitorsInplace(nlist, 1e-15), 1)
+        caps = dict((c.name, c) for c in nlist.elements['c'])
+        self.assertEqual(sorted(caps), ['c1_a', 'c1_a_1', 'c2'])
+        self.assertEqual((caps['c1_a_1'].n1, caps['c1_a_1'].n2), ('a', '0'))
+        self.assertAlmostEqual(caps['c2'].value, 1.1e-15)
+
+    def test_decouple_per_subckt(self):
+        """caps are lumped within their own subcircuit body"""
+        nlist = makeNetlist(['.subckt a in out', 'c1 out 0 5e-15',
+                             'c2 in out 1e-16', '.ends',
+                             '.subckt b in out', 'c1 out 0 7e-15', '.ends'])
+        self.assertEqual(pyspice.decoupleCapacitorsInplace(nlist, 1e-15), 1)
+        self.assertEqual([(c.name, c.value) for c in nlist.elements['c']],
+                         [('c1', 5.1e-15), ('c1', 7e-15), ('c2_in', 1e-16)])
+        self.assertEqual([str(e).split()[0] for e in nlist.deck],
+                         ['.subckt', 'c1', 'c2_in', '.ends',
+                          '.subckt', 'c1', '.ends'])
+#@-node:capacitor decoupling
+#@+node:short merging
+
+class shortMerging(unittest.TestCase):
+    """Tests union-find merging of nodes through small resistors"""
+    cards = ['.global vdd',
+             'v1 in 0 1',
+             'r1 a b 0',
+             'r2 b c 1e-3',
+             'r3 in a 0.0',
+             'r4 vdd 0 0',
+             'r5 c d 1k',
+             'c1 a 0 1e-15',
+             'c2 c 0 2e-15',
+             'c3 b c 1e-15',
+             'm1 d g c 0 nch w=1u l=1u',
+             'm2 d g a 0 nch w=1u l=1u']
+
+    def test_nodeunion_protected(self):
+        """protected nodes become representatives and are never merged"""
+        u = pyspice.NodeUnion(['p', 'q'])
+        self.assertTrue(u.union('a', 'p'))
+        self.assertTrue(u.union('b', 'a'))
+        self.assertFalse(u.union('b', 'q'))
+        self.assertFalse(u.union('a', 'b'))
+        self.assertEqual(u.mapping(), {'a': 'p', 'b': 'p'})
+
+    def test_merge_shorts(self):
+        """shorted nets collapse, exposing parallel elements"""
+        nlist = makeNetlist(self.cards)
+        n = pyspice.mergeShortsInplace(nlist, 1e-3)
+        # r1, r2, r3 merged; c3 shorted; r4 joins two protected nodes
+        self.assertEqual(n, 4)
+        self.assertEqual(sorted(r.name for r in nlist.elements['r']),
+                         ['r4', 'r5'])
+        self.assertEqual([c.n1 for c in nlist.elements['c']], ['in', 'in'])
+        self.assertEqual(nlist.elements['m'][0].s, 'in')
+        self.assertEqual(nlist.elements['r'][1].n1, 'in')
+        self.assertEqual(pyspice.combineCapacitorsInplace(nlist), 1)
+        self.assertEqual(pyspice.combineMosfetsInplace(nlist), 1)
+
+    def test_merge_keeps_unparsed_nodes(self):
+        """elements of unknown type keep their nodes connected"""
+        nlist = makeNetlist(['r1 a b 0', 'd1 b 0 dmod', 'c1 a 0 1e-15',
+                             'r2 x y 0', 'e1 x 0 y 0 2', 'r3 p q 0',
+                             'c2 q 0 1e-15'])
+        self.assertEqual(pyspice.mergeShortsInplace(nlist), 2)
+        self.assertEqual(nlist.elements['c'][0].n1, 'b')
+        self.assertEqual(str(nlist.elements['spice'][0]), 'd1 b 0 dmod')
+        self.assertEqual(sorted(r.name for r in nlist.elements['r']), ['r2'])
+
+    def test_merge_ground_case(self):
+        """ground and .global names are protected in any case"""
+        nlist = makeNetlist(['.global VDD', 'v1 in 0 1', 'r1 in a 1k',
+                             'r2 a GND 0', 'c1 b GND 1e-15', 'r3 b vdd 0'])
+        self.assertEqual(pyspice.mergeShortsInplace(nlist, 1e-3), 2)
+        c1 = nlist.elements['c'][0]
+        self.assertEqual((c1.n1, c1.n2), ('vdd', 'GND'))
+        self.assertEqual(nlist.elements['r'][0].n2, 'GND')
+
+    def test_merge_per_subckt(self):
+        """node names are local to each subcircuit body"""
+        nlist = makeNetlist(['.subckt a p', 'r1 n1 p 0', 'c1 n1 0 1e-15',
+                             '.ends',
+                             '.subckt b p q', 'r1 n1 q 1k', 'c1 n1 p 1e-15',
+                             '.ends',
+                             'x1 n1 a', 'c1 n1 0 1e-15'])
+        self.assertEqual(pyspice.mergeShortsInplace(nlist), 1)
+        self.assertEqual([(c.n1, c.n2) for c in nlist.elements['c']],
+                         [('p', '0'), ('n1', 'p'), ('n1', '0')])
+        self.assertEqual(nlist.elements['r'][0].n1, 'n1')
+#@-node:short merging
+#@+node:floating pruning
+
+class floatingPruning(unittest.TestCase):
+    """Tests removal of unconnected islands and dangling elements"""
+    cards = ['.subckt buf in out',
+             'r1 in x 1k',
+             'm1 out x 0 0 nch w=1u l=1u',
+             'r2 x y 1k',
+             'c1 y z 1e-15',
+             'r3 p q 1k',
+             'c3 q 0 1e-15',
+             'c4 p 0 1e-15',
+             'xu1 out w inv',
+             'r4 w s 1k',
+             '.ends']
+
+    def test_prune(self):
+        """islands and chains of dangling elements are found and removed"""
+        nlist = makeNetlist(self.cards)
+        islands, dangling = pyspice.pruneFloatingInplace(nlist)
+        self.assertEqual([e.name for e in islands], ['r3', 'c3', 'c4'])
+        self.assertEqual(sorted(e.name for e in dangling),
+                         ['c1', 'r2', 'r4'])
+        self.assertEqual([e.name for e in nlist.deck if e.type != '.'],
+                         ['r1', 'm1', 'xu1'])
+
+    def test_prune_ground_case(self):
+        """a cap to GND is not dangling"""
+        nlist = makeNetlist(['v1 in 0 1', 'r1 in a 1k', 'c1 a GND 1e-15'])
+        self.assertEqual(pyspice.pruneFloatingInplace(nlist), ([], []))
+        self.assertEqual(len(nlist.deck), 3)
+
+    def test_prune_report_only(self):
+        """remove=False leaves the netlist untouched"""
+        nlist = makeNetlist(self.cards)
+        islands, dangling = pyspice.pruneFloatingInplace(nlist, remove=False)
+        self.assertEqual(len(islands) + len(dangling), 6)
+        self.assertEqual(len(nlist.deck), len(self.cards))
+#@-node:floating pruning
+#@+node:model unification
+
+class modelUnification(unittest.TestCase):
+    """Tests parsing and deduplication of .model cards"""
+    cards = ['.model nch_1 nmos (level=54 vth0=0.4 tox=2n)',
+             '.model NCH_2 NMOS level=54 TOX=2e-9 vth0=0.4',
+             '.model nch_3 nmos (level=54 vth0=0.41 tox=2n)',
+             '.model pch_1.1 pmos (level=54 lmin=0 lmax=1u)',
+             '.model pch_1.2 pmos (level=54 lmin=1u lmax=1)',
+             '.model pch_2.1 pmos (level=54 lmin=0 lmax=1u)',
+             '.model pch_2.2 pmos (level=54 lmin=1u lmax=1)',
+             '.model dmod d (is=1e-14)',
+             '.model dmod2 d (is=1e-14)',
+             'm1 d g s b nch_1 w=1u l=1u',
+             'm2 d g s b nch_2 w=1u l=1u',
+             'm3 d g s b nch_3 w=1u l=1u',
+             'm4 d g s b pch_2 w=1u l=1u',
+             'd1 a b dmod2']
+
+    def test_model_parse(self):
+        """.model lines are parsed into a canonical key"""
+        nlist = makeNetlist(self.cards)
+        models = nlist.elements['.']
+        self.assertTrue(isinstance(models[0], pyspice.Model))
+        self.assertEqual(models[0].key(), models[1].key())
+        self.assertNotEqual(models[0].key(), models[2].key())
+        self.assertEqual(models[4].family(), ('pch_1', 2))
+
+    def test_unify_models(self):
+        """duplicates are removed and FETs are rewritten to combine"""
+        nlist = makeNetlist(self.cards)
+        self.assertEqual(pyspice.unifyModelsInplace(nlist), 2)
+        self.assertEqual([m.name for m in nlist.elements['.']],
+                         ['nch_1', 'nch_3', 'pch_1.1', 'pch_1.2',
+                          'dmod', 'dmod2'])
+        self.assertEqual([m.model for m in nlist.elements['m']],
+                         ['nch_1', 'nch_1', 'nch_3', 'pch_1'])
+        self.assertEqual(pyspice.combineMosfetsInplace(nlist), 1)
+#@-node:model unification
+#@+node:subcircuit merging
+
+class subcktMerging(unittest.TestCase):
+    """Tests structural hashing and merging of subcircuit definitions"""
+    cards = ['.subckt inv_a in out vdd',
+             'm1 out in vdd vdd pch w=2u l=1u',
+             'm2 out in 0 0 nch w=1u l=1u',
+             'c1 out 0 1e-15',
+             '.ends',
+             '.subckt inv_b i o vdd',
+             'c7 0 o 1e-15',
+             'mn o i 0 0 nch w=1u l=1u',
+             'mp vdd i o vdd pch w=2u l=1u',
+             '.ends',
+             '.subckt inv_c in out vdd',
+             'm1 out in vdd vdd pch w=2u l=1u',
+             'm2 out in 0 0 nch w=1u l=1u',
+             'c1 in 0 1e-15',
+             '.ends',
+             '.subckt buf_a in out vdd',
+             'x1 in mid vdd inv_a',
+             'x2 mid out vdd inv_a',
+             '.ends',
+             '.subckt buf_b a y vdd',
+             'xb y2 y vdd inv_b',
+             'xa a y2 vdd inv_b',
+             '.ends',
+             'x1 a b vdd buf_b',
+             'x2 b c vdd inv_b',
+             'x3 c d vdd inv_c']
+
+    def test_structure_key(self):
+        """keys ignore names and order, but not connectivity"""
+        nlist = makeNetlist(self.cards)
+        defs = nlist.subcircuits()
+        self.assertEqual(len(defs), 5)
+        keys = [pyspice.subcktStructure(s, b)[0] for s, b, e in defs]
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
+
+    def test_merge_subckts(self):
+        """duplicates are removed and instances point to the kept one"""
+        nlist = makeNetlist(self.cards)
+        self.assertEqual(pyspice.mergeSubcktsInplace(nlist), 2)
+        self.assertEqual([s.name for s, b, e in nlist.subcircuits()],
+                         ['inv_a', 'inv_c', 'buf_a'])
+        self.assertEqual([x.subckt for x in nlist.elements['x']],
+                         ['inv_a', 'inv_a', 'buf_a', 'inv_a', 'inv_c'])
+        self.assertEqual(str(nlist.elements['x'][2]), 'x1 a b vdd buf_a')
+
+    def test_instance_card(self):
+        """X cards are written back with their PARAMS: keyword"""
+        x = makeNetlist(['x1 a b inv PARAMS: w=1u']).elements['x'][0]
+        self.assertEqual(str(x), 'x1 a b inv PARAMS: w=1u')
+        x.renameNodes({'a': 'c'})
+        x.subckt = 'inv_a'
+        self.assertEqual(str(x), 'x1 c b inv_a PARAMS: w=1u')
+
+    def test_isomorphic_symmetric(self):
+        """symmetric internal nodes need an explicit node mapping"""
+        a = makeNetlist(['.subckt ring a',
+                         'r1 a p 1', 'r2 p q 1', 'r3 q a 1',
+                         'r4 a s 1', 'r5 s t 1', 'c1 t 0 1e-15', '.ends'])
+        b = makeNetlist(['.subckt ring a',
+                         'r1 a p 1', 'r2 p q 1', 'r3 q a 1',
+                         'r4 a s 1', 'r5 s t 1', 'c1 s 0 1e-15', '.ends'])
+        sa = pyspice.subcktStructure(*a.subcircuits()[0][:2])
+        sb = pyspice.subcktStructure(*b.subcircuits()[0][:2])
+        self.assertTrue(pyspice._isomorphic(sa, sa))
+        self.assertFalse(sa[0] == sb[0] and pyspice._isomorphic(sa, sb))
+
+    def test_isomorphic_large_class(self):
+        """many identical legs do not try their permutations"""
+        legs = 40
+        cards = ['.subckt legs_a a']
+        for i in range(legs):
+            cards += ['r%i a n%i 1' % (i, i), 'c%i n%i 0 1e-15' % (i, i)]
+        cards += ['.ends', '.subckt legs_b p']
+        for i in reversed(range(legs)):
+            cards += ['cx%i 0 k%i 1e-15' % (i, i), 'rx%i k%i p 1' % (i, i)]
+        cards += ['.ends']
+        nlist = makeNetlist(cards)
+        start = time.time()
+        self.assertEqual(pyspice.mergeSubcktsInplace(nlist), 1)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_ground_case(self):
+        """GND inside a body is ground, not an internal node"""
+        nlist = makeNetlist(['.subckt c_a a', 'c1 a GND 1e-15', '.ends',
+                             '.subckt c_b a', 'c1 a n 1e-15', '.ends',
+                             '.subckt c_c a', 'c1 a 0 1e-15', '.ends'])
+        self.assertEqual(pyspice.mergeSubcktsInplace(nlist), 1)
+        self.assertEqual([s.name for s, b, e in nlist.subcircuits()],
+                         ['c_a', 'c_b'])
+
+    def test_merge_after_unify(self):
+        """subckts using duplicate models merge once models are unified"""
+        cards = ['.model nch_1 nmos (level=54 vth0=0.4)',
+                 '.model nch_2 nmos (level=54 vth0=0.4)',
+                 '.subckt pd_a in out', 'm1 out in 0 0 nch_1 w=1u l=1u',
+                 '.ends',
+                 '.subckt pd_b in out', 'm1 out in 0 0 nch_2 w=1u l=1u',
+                 '.ends']
+        self.assertEqual(pyspice.mergeSubcktsInplace(makeNetlist(cards)), 0)
+        nlist = makeNetlist(cards)
+        self.assertEqual(pyspice.unifyModelsInplace(nlist), 1)
+        self.assertEqual(pyspice.mergeSubcktsInplace(nlist), 1)
+#@nonl
+#@-node:subcircuit merging
+#@+node:simulation cost
+
+class simulationCost(unittest.TestCase):
+    """Tests the MNA size, fill-in and device count estimate"""
+    def test_ladder(self):
+        """a tree of elements factors without fill"""
+        nlist = makeNetlist(['v1 in 0 1', 'r1 in a 1', 'r2 a b 1',
+                             'c1 b gnd 1e-15', 'i1 b 0 1'])
+        cost = pyspice.mnaCost(nlist)
+        self.assertEqual((cost['nodes'], cost['branches']), (3, 1))
+        self.assertEqual(cost['nonzeros'], 10)
+        self.assertEqual((cost['fill'], cost['ops']), (0, 6))
+
+    def test_fill(self):
+        """eliminating a node of a ring connects its neighbors"""
+        nlist = makeNetlist(['r1 a b 1', 'r2 b c 1', 'r3 c d 1', 'r4 d a 1'])
+        cost = pyspice.mnaCost(nlist)
+        self.assertEqual((cost['nodes'], cost['nonzeros']), (4, 12))
+        self.assertEqual(cost['fill'], 2)
+
+    def test_hierarchy_devices(self):
+        """subcircuits are expanded, FETs counted with and without m"""
+        nlist = makeNetlist(['.subckt inv in out vdd',
+                             'm1 out in vdd vdd pch w=2u l=1u',
+                             'm2 out in mid 0 nch w=1u l=1u m=2',
+                             'r1 mid 0 1',
+                             '.ends',
+                             'x1 a b vdd inv',
+                             'x2 b c vdd inv',
+                             'd1 c 0 dmod',
+                             'm3 c b 0 0 nch w=1u l=1u',
+                             'm4 c b 0 0 nch w=1u l=1u'])
+        flat = [n for e, n in pyspice.flatDevices(nlist)]
+        self.assertEqual(flat[:3], [['b', 'a', 'vdd', 'vdd'],
+                                    ['b', 'a', 'x1.mid', '0'],
+                                    ['x1.mid', '0']])
+        cost = pyspice.mnaCost(nlist)
+        self.assertEqual(cost['nodes'], 6)
+        self.assertEqual((cost['fets'], cost['fetm'], cost['devices']),
+                         (6, 8, 7))
+        pyspice.combineMosfetsInplace(nlist)
+        after = pyspice.mnaCost(nlist)
+        self.assertEqual((after['fets'], after['fetm']), (5, 8))
+        self.assertTrue('6 fets (m=8)' in pyspice.costLine('input', cost))
+#@nonl
+#@-node:simulation cost
 #@-others
 
 if __name__ == "__main__":
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+"""Unit test stuff for spicecatalog.py"""
+
+__author__ = "Dan White (etihwnad@gmail.com)"
+__copyright__ = "Copyright (c) 2007 Dan White"
+__license__ = "GPL"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import matplotlib
+matplotlib.use('Agg')
+
+import spicereader
+import spicecatalog
+
+
+class catalog(unittest.TestCase):
+    """Tests indexing and searching result files"""
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        self.cache = spicereader.WaveformCache(os.path.join(self.tmp, 'cache'))
+        for i in range(3):
+            self.writeRun('run%i.dat' % i, 'v(out)' if i else 'v(in)', i)
+        self.cat = spicecatalog.Catalog('cat.db', self.cache)
+        self.assertEqual(self.cat.update(['run0.dat', 'run1.dat',
+                                          'run2.dat']), 3)
+
+    def tearDown(self):
+        self.cat.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def writeRun(self, fname, sig, scale):
+        fp = open(fname, 'w')
+        print>>fp, '#Time %s' % sig
+        for sweep in range(2):
+            for t in range(4):
+                print>>fp, t, scale * (t + sweep)
+        fp.close()
+
+    def test_find(self):
+        runs = self.cat.find(signal='vout')
+        self.assertEqual([os.path.basename(r.path) for r in runs],
+                         ['run1.dat', 'run2.dat'])
+        self.assertEqual(runs[1].signals(), [('#Time', 0, 3), ('vout', 0, 8)])
+        self.assertEqual(len(self.cat.find(signal='vout', above=5)), 1)
+        self.assertEqual(len(self.cat.find(signal='vout', below=0)), 0)
+        self.assertEqual(len(self.cat.find(sweep=('sweep', 1))), 3)
+        self.assertEqual(len(self.cat.find(sweep=('sweep', 2))), 0)
+        self.assertEqual(len(self.cat.find(path='%run0%')), 1)
+        self.assertEqual(runs[0].sweeps(), [0, 1])
+        self.assertEqual(runs[0].nrows, 8)
+
+    def test_lazy_data(self):
+        run = self.cat.find(signal='vin')[0]
+        self.assertEqual(run._data, None)
+        self.assertEqual(list(run.data.getSweep(1).vin), [0] * 4)
+        self.assertTrue(run.data is run.data)
+
+    def test_update_prune(self):
+        self.assertFalse(self.cat.add('run1.dat'))
+        self.writeRun('run1.dat', 'v(x)', 1)
+        os.utime('run1.dat', (0, 0))
+        self.assertTrue(self.cat.add('run1.dat'))
+        self.assertEqual(len(self.cat.find(signal='vout')), 1)
+        os.remove('run2.dat')
+        self.assertEqual([os.path.basename(p) for p in self.cat.prune()],
+                         ['run2.dat'])
+        self.assertEqual(self.cat.find(signal='vout'), [])
+        count = self.cat.db.execute('SELECT count(*) FROM sweeps').fetchone()
+        self.assertEqual(count[0], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,927 @@
+#!/usr/bin/python
+"""Unit test stuff for spicereader.py"""
+
+__author__ = "Dan White (etihwnad@gmail.com)"
+__copyright__ = "Copyright (c) 2007 Dan White"
+__license__ = "GPL"
+
+import gc
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import weakref
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+from numpy import NaN
+import spicereader
+
+
+def writeHspice(fname, names, sweeps, sweepvars=(), types=None,
+                version='9601', endian='<', blockvals=64):
+    """Write an HSPICE binary file.  sweeps is a list of (sweepvalues, rows)
+    with rows a 2-D array, the data stream is cut into blocks of blockvals
+    values to exercise rows and sweeps spanning blocks."""
+    if types is None:
+        types = [1] * len(names)
+    header = '%04i%04i%04i%04i    %s' % (len(names), 0, len(sweepvars), 0,
+                                         version)
+    header = header.ljust(24) + 'test title'.ljust(64) + 'date'.ljust(24)
+    header = header.ljust(256)
+    header += ' '.join(str(t) for t in types) + ' '
+    header += ' '.join(list(names) + list(sweepvars)) + ' $&%#    '
+
+    dtype = np.dtype(endian + ('f8' if version == '2001' else 'f4'))
+    stream = []
+    for vals, rows in sweeps:
+        stream.extend(vals)
+        stream.extend(np.asarray(rows).ravel())
+        stream.append(spicereader.HSPICE_END)
+    stream = np.array(stream, dtype=dtype)
+
+    fp = open(fname, 'wb')
+    def block(payload, n):
+        fp.write(struct.pack(endian + '4i', 4, n, 4, len(payload)))
+        fp.write(payload)
+        fp.write(struct.pack(endian + 'i', len(payload)))
+    # header split over two blocks
+    block(header[:200], 50)
+    block(header[200:], 50)
+    for i in range(0, stream.size, blockvals):
+        chunk = stream[i:i+blockvals]
+        block(chunk.tostring(), chunk.size)
+    fp.close()
+
+
+class zeroCrossings(unittest.TestCase):
+    """Tests the crossing kernels"""
+    def test_zc(self):
+        """floor indices, exact zeros counted once"""
+        x = np.array([0, 1, -1, -2, 0, 3, 0, 0, 1, 2, -1])
+        self.assertEqual(list(spicereader.zc(x)), [0, 1, 4, 6, 7, 9])
+
+    def test_crossings(self):
+        """interpolated rising and falling crossings"""
+        t = np.arange(8.0)
+        y = np.array([0, 2, 4, 2, 0, -2, 2, 4])
+        self.assertEqual(list(spicereader.crossings(t, y, 1.0)),
+                         [0.5, 3.5, 5.75])
+        self.assertEqual(list(spicereader.crossings(t, y, 1.0, 'rise')),
+                         [0.5, 5.75])
+        i, frac, rising = spicereader.crossIndex(y, 1.0, 'fall')
+        self.assertEqual((list(i), list(frac), list(rising)),
+                         ([3], [0.5], [False]))
+        self.assertRaises(ValueError, spicereader.crossIndex, y, 0, 'up')
+
+    def test_hysteresis(self):
+        """noise within the hysteresis band is ignored"""
+        t = np.arange(10.0)
+        y = np.array([-1, 0.1, -0.1, 0.2, 1, 1, 0.1, -0.1, 0.1, -1])
+        self.assertEqual(len(spicereader.crossings(t, y)), 6)
+        x = spicereader.crossings(t, y, hyst=0.5)
+        self.assertTrue(np.allclose(x, [2 + 1/3.0, 8 + 1/11.0]))
+        self.assertTrue(np.allclose(
+                spicereader.crossings(t, y, edge='fall', hyst=0.5), [8 + 1/11.0]))
+
+
+class tempdirTest(unittest.TestCase):
+    """Runs each test in a fresh temporary directory"""
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        self.defaultCache = spicereader.defaultCache
+        spicereader.defaultCache = spicereader.WaveformCache(
+                                        os.path.join(self.tmp, 'cache'))
+
+    def tearDown(self):
+        spicereader.defaultCache = self.defaultCache
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+
+class hspiceReader(tempdirTest):
+    """Tests the native HSPICE binary reader"""
+    rows = np.arange(30, dtype=float).reshape(10, 3)
+
+    def test_single_block(self):
+        """unswept single-block data is cached column by column"""
+        writeHspice('a.tr0', ['TIME', 'v(out', 'i(vdd'], [((), self.rows)],
+                    blockvals=1000)
+        d = spicereader.HspiceData('a.tr0')
+        self.assertEqual(d.siglist, ['TIME', 'vout', 'ivdd'])
+        self.assertTrue(np.all(d.vout == self.rows[:,1]))
+        self.assertTrue(np.all(d.x == self.rows[:,0]))
+        self.assertTrue(d.data.flags.f_contiguous)
+        self.assertTrue(d.vout.flags.c_contiguous)
+        d.xrange((3.5, 12))
+        self.assertEqual(list(d.x), [3, 6, 9, 12])
+        d.xrange((-1, 100))
+        self.assertEqual(len(d.x), 10)
+
+    def test_single_block_uncached(self):
+        """without a cache, single-block data is mapped from the file"""
+        open('cache', 'w').close()
+        writeHspice('a.tr0', ['TIME', 'v(out', 'i(vdd'], [((), self.rows)],
+                    blockvals=1000)
+        d = spicereader.HspiceData('a.tr0')
+        self.assertTrue(np.all(d.data == self.rows))
+        self.assertTrue(isinstance(d.data.base, np.memmap))
+
+    def test_sweeps_big_endian(self):
+        """sweeps spanning blocks are split into row ranges"""
+        sweeps = [((1.5,), self.rows), ((2.5,), self.rows[:7] + 100)]
+        writeHspice('b.tr0', ['TIME', 'v(out', 'v(in'], sweeps,
+                    sweepvars=['temper'], version='2001', endian='>',
+                    blockvals=7)
+        for i in range(2):
+            # second pass loads the cache
+            d = spicereader.HspiceData('b.tr0')
+            self.assertEqual(d.sweepvar, 'temper')
+            self.assertEqual(d.sweepvals, [1.5, 2.5])
+            self.assertEqual(d.sweeprows, [(0, 10), (10, 17)])
+            s = d.getSweep(1)
+            self.assertTrue(np.all(s.vin == self.rows[:7,2] + 100))
+            self.assertTrue(np.all(d.getSweep('1.5').x == self.rows[:,0]))
+            self.assertTrue(d.getSweep(2.5) is s)
+
+    def test_complex(self):
+        """AC data has real and imaginary columns"""
+        rows = np.arange(15, dtype=float).reshape(3, 5)
+        writeHspice('c.ac0', ['HERTZ', 'v(out', 'v(in'], [((), rows)],
+                    types=[2, 1, 1])
+        d = spicereader.HspiceData('c.ac0')
+        self.assertEqual(d.cols, ['HERTZ', 'v(out_0', 'v(out_1',
+                                  'v(in_0', 'v(in_1'])
+        self.assertTrue(np.all(d.vout == rows[:,1] + 1j*rows[:,2]))
+        self.assertEqual(d.vout.dtype, np.complex64)
+        self.assertTrue(np.may_share_memory(d.vout, d.data))
+        self.assertTrue(np.all(d.data[[2, 0], 3] == [13, 3]))
+
+    def test_complex_derived(self):
+        """mag, dB and phase are cached per signal and range"""
+        rows = np.array([[1, 3, 4, 1, 0], [10, 0, 1, -1, 0]], dtype=float)
+        writeHspice('c.ac0', ['HERTZ', 'v(out', 'v(in'], [((), rows)],
+                    types=[2, 1, 1], version='2001')
+        d = spicereader.HspiceData('c.ac0')
+        self.assertEqual(d.vin.dtype, np.complex128)
+        self.assertTrue(np.allclose(d.mag('vout'), [5, 1]))
+        self.assertTrue(d.mag('vout') is d.mag('vout'))
+        self.assertTrue(np.allclose(d.db('vin'), [0, 0]))
+        self.assertTrue(np.allclose(d.phase('vin'), [0, 180]))
+        self.assertTrue(np.allclose(d.phase('vout'), [53.130102, 90]))
+        d.xrange((5, 10))
+        self.assertTrue(np.allclose(d.mag('vout'), [5, 1]))
+        d.xrange((10, 10))
+        self.assertTrue(np.allclose(d.mag('vout'), [1]))
+
+
+class gnucapReader(tempdirTest):
+    """Tests the chunked Gnucap ASCII reader"""
+    rows = np.arange(40, dtype=float).reshape(10, 4) / 8.0
+
+    def writeGnucap(self, fname):
+        fp = open(fname, 'w')
+        print>>fp, '#Time v(out) v(in) i(r1)'
+        for i, r in enumerate(self.rows):
+            if i == 5:
+                print>>fp, '#Time v(out) v(in) i(r1)'
+            print>>fp, ' '.join('%.6e' % x for x in r)
+        fp.close()
+
+    def test_read_rows_chunked(self):
+        """rows split across chunks and comment lines are handled"""
+        self.writeGnucap('g.dat')
+        fin = open('g.dat')
+        fin.readline()
+        out = spicereader._ArrayWriter(np.float64, 4)
+        n = spicereader.readAsciiRows(fin, 4, out.write, chunksize=7)
+        self.assertEqual(n, 10)
+        self.assertTrue(np.all(out.array() == self.rows))
+
+    def test_read_rows_follow(self):
+        """following, a partly written last line is left for later"""
+        open('f.dat', 'w').write('0 1\n2 3\n4 5\n6')
+        fin = open('f.dat', 'rb')
+        chunks = []
+        n = spicereader.readAsciiRows(fin, 2, chunks.append, chunksize=5,
+                                      follow=True)
+        self.assertEqual(n, 3)
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(fin.tell(), 12)
+        self.assertEqual(fin.read(), '6')
+
+    def test_binary_rejected(self):
+        """binary (SBSO) output is refused, not misread"""
+        open('b.dat', 'wb').write('\x01\x00\x00\x00\x02v(a)\n' + '\0' * 16)
+        self.assertRaises(ValueError, spicereader.GnucapData, 'b.dat')
+        self.assertRaises(ValueError, spicereader.GnucapData, 'b.dat',
+                          follow=True)
+
+    def test_load_and_cache(self):
+        """first load writes the cache, second load maps it"""
+        self.writeGnucap('g.dat')
+        for i in range(2):
+            d = spicereader.GnucapData('g.dat')
+            self.assertTrue(np.all(d.data == self.rows))
+            self.assertTrue(np.all(d.vin == self.rows[:,2]))
+        self.assertTrue(isinstance(d.data, np.memmap))
+        self.assertTrue(d.data.flags.f_contiguous)
+
+
+class ngspiceReader(tempdirTest):
+    """Tests the SPICE3/ngspice rawfile reader"""
+    tran = [('time', 'time'), ('v(out)', 'voltage'), ('vdd#branch', 'current')]
+    ac = [('frequency', 'frequency'), ('v(out)', 'voltage')]
+
+    def writeRaw(self, fname, plots, binary=True, npoints=None):
+        """plots is a list of (plotname, vars, rows), complex rows for an
+        AC plot."""
+        fp = open(fname, 'wb')
+        for name, vars, rows in plots:
+            rows = np.asarray(rows)
+            iscomplex = np.iscomplexobj(rows)
+            fp.write('Title: test\nDate: today\nPlotname: %s\n' % name)
+            fp.write('Flags: %s\n' % ('complex' if iscomplex else 'real'))
+            fp.write('No. Variables: %i\n' % len(vars))
+            fp.write('No. Points: %i\n' % (npoints or len(rows)))
+            fp.write('Variables:\n')
+            for i, (n, t) in enumerate(vars):
+                fp.write('\t%i\t%s\t%s\n' % (i, n, t))
+            if binary:
+                fp.write('Binary:\n')
+                fp.write(rows.astype('<c16' if iscomplex else '<f8').tostring())
+                continue
+            fp.write('Values:\n')
+            for i, r in enumerate(rows):
+                if iscomplex:
+                    r = ['%r,%r' % (x.real, x.imag) for x in r]
+                fp.write(' %i\t%s\n' % (i, '\n\t'.join(map(str, r))))
+            fp.write('\n')
+        fp.close()
+
+    def tranRows(self, scale):
+        t = np.arange(5.0)
+        return np.column_stack((t, scale * t, -t))
+
+    def test_binary_plots(self):
+        """plots with the same variables are sweeps, the op plot is not"""
+        self.writeRaw('t.raw', [('Operating Point', self.tran[1:], [[1, 2]]),
+                                ('Transient Analysis', self.tran,
+                                 self.tranRows(1)),
+                                ('Transient Analysis', self.tran,
+                                 self.tranRows(2))])
+        for i in range(2):
+            d = spicereader.loadSimData('t.raw')
+            self.assertTrue(isinstance(d, spicereader.NgspiceData))
+            self.assertEqual(d.sweepvar, 'plot')
+            self.assertEqual(d.sweepvals, [1, 2])
+            self.assertEqual(list(d.getSweep(2).vout), [0, 2, 4, 6, 8])
+            self.assertEqual(list(d.vdd_branch[:3]), [0, -1, -2])
+            self.assertEqual(list(d.time[:2]), [0, 1])
+        self.assertTrue(isinstance(d.data, np.memmap))
+
+        op = spicereader.NgspiceData('t.raw', plot=0)
+        self.assertEqual(op.sweepvars, [])
+        self.assertEqual(list(op.vout), [1])
+        one = spicereader.NgspiceData('t.raw', plot=-1)
+        self.assertEqual(list(one.vout), [0, 2, 4, 6, 8])
+        self.assertNotEqual(one.key, d.key)
+
+    def test_uncached_memmap(self):
+        """a single real plot is mapped straight from the file"""
+        open('cache', 'w').close()
+        self.writeRaw('t.raw', [('Transient Analysis', self.tran,
+                                 self.tranRows(3))])
+        d = spicereader.NgspiceData('t.raw')
+        self.assertTrue(isinstance(d.data, np.memmap))
+        self.assertEqual(d.data.filename, os.path.abspath('t.raw'))
+        self.assertEqual(list(d.vout), [0, 3, 6, 9, 12])
+
+    def test_complex_ascii(self):
+        """AC plots as complex views, ASCII values give the same data"""
+        f = np.array([1.0, 10, 100])
+        rows = np.column_stack((f, 1 / (1 + 1j * f / 10)))
+        self.writeRaw('b.raw', [('AC Analysis', self.ac, rows)])
+        self.writeRaw('a.raw', [('AC Analysis', self.ac, rows)], False)
+        for fname in ('b.raw', 'a.raw'):
+            d = spicereader.loadSimData(fname)
+            self.assertEqual(d.cols, ['frequency', 'v(out)_0', 'v(out)_1'])
+            self.assertEqual(list(d.frequency), list(f))
+            self.assertTrue(np.allclose(d.vout, rows[:, 1]))
+            self.assertTrue(np.allclose(d.mag('vout')[0], 1 / abs(1 + 0.1j)))
+
+    def test_truncated(self):
+        """a run cut short keeps the points that were written"""
+        self.writeRaw('t.raw', [('Transient Analysis', self.tran,
+                                 self.tranRows(1))], npoints=100)
+        fp = open('t.raw', 'ab')
+        fp.write('\0' * 12)
+        fp.close()
+        d = spicereader.loadSimData('t.raw')
+        self.assertEqual(len(d.data), 5)
+
+
+class sweepIndex(tempdirTest):
+    """Tests the sweep row index and getSweep views"""
+    def setUp(self):
+        tempdirTest.setUp(self)
+        fp = open('s.dat', 'w')
+        print>>fp, '#Time v(a)'
+        for sweep in range(5):
+            for t in range(3 + sweep):
+                print>>fp, t, 10*sweep + t
+        fp.close()
+
+    def test_restarts(self):
+        """unlabeled Gnucap sweeps are found where time restarts"""
+        d = spicereader.GnucapData('s.dat')
+        self.assertEqual(d.sweepvar, 'sweep')
+        self.assertEqual(d.sweepvals, [0, 1, 2, 3, 4])
+        self.assertEqual(d.sweeprows[:2], [(0, 3), (3, 7)])
+        s = d.getSweep(4)
+        self.assertEqual(list(s.va), [40, 41, 42, 43, 44, 45, 46])
+
+    def test_descending(self):
+        """a descending .dc sweep is one sweep, a reversal starts the next"""
+        fp = open('d.dat', 'w')
+        print>>fp, '#V(in) v(out)'
+        for v in range(5, -1, -1):
+            print>>fp, v, 2 * v
+        fp.close()
+        d = spicereader.GnucapData('d.dat')
+        self.assertEqual(d.sweeprows, [])
+        d.xrange((1, 3))
+        self.assertEqual(list(d.x), [3, 2, 1])
+        d.xrange()
+        self.assertAlmostEqual(d.measAvg('vout', 1, 3), 4)
+        self.assertEqual(d.measMinMax('vout', 1, 3), (2, 1, 6, 3))
+
+        out = spicereader._ArrayWriter(np.float64, 1)
+        sweeps = spicereader._SweepFinder(out.write, 1, 0)
+        for chunk in ([5, 4, 3], [2, 5, 4], [4, 3, 0, 1], [1, 2]):
+            sweeps.write(np.array(chunk, dtype=float))
+        self.assertEqual([s[1:] for s in sweeps.sweeps()],
+                         [[0, 4], [4, 9], [9, 12]])
+
+    def test_one_row_sweeps(self):
+        """measurements over sweeps of a single row don't index past them"""
+        fp = open('o.dat', 'w')
+        print>>fp, '#Time v(a)'
+        for t, v in ((0, 1), (1, 2), (2, 3), (1, 4)):
+            print>>fp, t, v
+        fp.close()
+        d = spicereader.GnucapData('o.dat')
+        self.assertEqual(d.sweeprows, [(0, 3), (3, 4)])
+        self.assertTrue(np.allclose(d.measIntegral('va'), [4, 0]))
+        self.assertTrue(np.allclose(d.measAvg('va', 0, 2)[:1], [2]))
+
+    def test_views_lru(self):
+        """sweeps are views of the data, only the last few are kept"""
+        d = spicereader.GnucapData('s.dat')
+        d.sweepcache = 2
+        s0 = d.getSweep(0)
+        self.assertTrue(np.may_share_memory(s0.data, d.data))
+        d.getSweep(1)
+        self.assertTrue(d.getSweep(0) is s0)
+        d.getSweep(2)
+        self.assertEqual(list(d.sweep), [0, 2])
+        self.assertRaises(ValueError, d.getSweep, 7.5)
+
+
+class nestedSweeps(tempdirTest):
+    """Tests nested sweeps and N-D views"""
+    def test_hspice_grid(self):
+        """two HSPICE sweep parameters make a 2-D grid of sweeps"""
+        rows = np.arange(12, dtype=float).reshape(4, 3)
+        sweeps = [((t, c), rows + 100*t + 10*c)
+                  for t in (-40, 125) for c in (0, 1, 2)]
+        writeHspice('n.tr0', ['TIME', 'v(a', 'v(b'], sweeps,
+                    sweepvars=['temper', 'corner'], version='2001')
+        d = spicereader.HspiceData('n.tr0')
+        self.assertEqual(d.sweepvars, ['temper', 'corner'])
+        self.assertEqual(d.sweepvals[4], (125, 1))
+        self.assertEqual(list(d.sweepindex['corner']), [0, 1, 2] * 2)
+        self.assertTrue(np.all(d.getSweep((125, 1)).vb == rows[:,2] + 12510))
+        view, axes = d.ndview()
+        self.assertEqual(view.shape, (2, 3, 4, 3))
+        self.assertEqual([list(a) for a in axes], [[-40, 125], [0, 1, 2]])
+        self.assertTrue(np.may_share_memory(view, d.data))
+        va = d.ndsig('va')
+        self.assertTrue(np.all(va.max(axis=-1) ==
+                               [[-3990, -3980, -3970], [12510, 12520, 12530]]))
+
+    def test_nest_and_ragged(self):
+        """flat sweeps can be relabeled, ragged sweeps have no N-D view"""
+        fp = open('s.dat', 'w')
+        print>>fp, '#Time v(a)'
+        for sweep in range(6):
+            for t in range(3):
+                print>>fp, t, 10*sweep + t
+        fp.close()
+        d = spicereader.GnucapData('s.dat')
+        self.assertEqual(d.ndview()[0].shape, (6, 3, 2))
+        d.nestSweeps([('temp', [0, 50]), ('mc', [1, 2, 3])])
+        self.assertEqual(d.getSweep((50, 1)).va[0], 30)
+        self.assertEqual(d.ndsig('va').shape, (2, 3, 3))
+        self.assertRaises(ValueError, d.nestSweeps, [('mc', range(4))])
+        d.sweeprows[-1] = (15, 17)
+        d.setSweeps(['x'], [[i] for i in range(6)], d.sweeprows)
+        self.assertRaises(ValueError, d.ndview)
+
+
+class measurements(tempdirTest):
+    """Tests .meas-style measurements over all sweeps"""
+    def setUp(self):
+        tempdirTest.setUp(self)
+        # three sweeps of a triangle 0 -> k -> 0 over 0..2 and a step
+        fp = open('m.dat', 'w')
+        print>>fp, '#Time v(a) v(b)'
+        for k in (1, 2, 4):
+            for t in np.linspace(0, 2, 21):
+                print>>fp, t, k * (1 - abs(t - 1)), float(t >= 0.5)
+        fp.close()
+        self.d = spicereader.GnucapData('m.dat')
+
+    def test_when_find(self):
+        d = self.d
+        self.assertTrue(np.allclose(d.measWhen('va', 0.5, 'rise'),
+                                    [0.5, 0.25, 0.125]))
+        self.assertTrue(np.allclose(d.measWhen('va', 0.5, n=-1),
+                                    [1.5, 1.75, 1.875]))
+        self.assertTrue(np.allclose(d.measWhen('va', 0.5, n=2, td=1.0),
+                                    [NaN, NaN, NaN], equal_nan=True))
+        self.assertTrue(np.allclose(d.measWhen('va', [0.5, 1, 2], 'fall'),
+                                    [1.5, 1.5, 1.5]))
+        self.assertTrue(np.allclose(d.measFind('va', 'vb', 0.5, 'rise'),
+                                    [0.45, 0.9, 1.8]))
+
+    def test_hysteresis_per_sweep(self):
+        """the Schmitt trigger starts over in each sweep"""
+        fp = open('h.dat', 'w')
+        print>>fp, '#Time v(h)'
+        for y in ([-1, 1, 1, 1, 1], [0.1, -1, -1, 1, 1]):
+            for t, v in enumerate(y):
+                print>>fp, t, v
+        fp.close()
+        d = spicereader.GnucapData('h.dat')
+        self.assertTrue(np.allclose(d.measWhen('vh', 0, hyst=0.5),
+                                    [0.5, 2.5]))
+        self.assertTrue(np.allclose(d.measWhen('vh', 0, 'fall', hyst=0.5),
+                                    [NaN, NaN], equal_nan=True))
+        i, frac, rising = spicereader.crossIndex(d.data[:, 1], 0, hyst=0.5,
+                                                 starts=[0, 5])
+        self.assertEqual(list(i), [0, 7])
+
+    def test_delay_rise(self):
+        d = self.d
+        self.assertTrue(np.allclose(d.measDelay('vb', 0.5, 'va', 0.5,
+                                                targedge='fall'),
+                                    [1.05, 1.3, 1.425]))
+        self.assertTrue(np.allclose(d.measDelay('vb', 0.5, 'va', 0.5),
+                                    [0.05, NaN, NaN], equal_nan=True))
+        self.assertTrue(np.allclose(d.measRise('va'), [0.8] * 3))
+        self.assertTrue(np.allclose(d.measFall('va', 0.1, 0.9),
+                                    [0.8, 0.4, 0.2]))
+
+    def test_integrals(self):
+        d = self.d
+        self.assertTrue(np.allclose(d.measIntegral('va'), [1, 2, 4]))
+        self.assertTrue(np.allclose(d.measAvg('va', 0, 1), [0.5, 1, 2]))
+        self.assertTrue(np.allclose(d.measIntegral('vb', 0.25, 1.25),
+                                    [0.8] * 3))
+        self.assertTrue(np.allclose(d.measRms('vb', 1, 2), [1] * 3))
+        one = d.getSweep(d.sweepvals[1])
+        self.assertAlmostEqual(one.measIntegral('va'), 2)
+
+    def test_minmax(self):
+        ymin, tmin, ymax, tmax = self.d.measMinMax('va', 0.25, 1.55)
+        self.assertTrue(np.allclose(ymin, [0.3, 0.6, 1.2]))
+        self.assertTrue(np.allclose(tmin, [0.3] * 3))
+        self.assertTrue(np.allclose(ymax, [1, 2, 4]))
+        self.assertTrue(np.allclose(tmax, [1] * 3))
+
+
+class decimation(tempdirTest):
+    """Tests min/max decimation for plotting"""
+    def test_decimate(self):
+        x = np.arange(10007, dtype=float)
+        y = np.sin(x / 100.0)
+        y[5000] = 3
+        xd, yd = spicereader.decimate(x, y, 100)
+        self.assertTrue(len(xd) <= 204)
+        self.assertTrue(np.all(np.diff(xd) > 0))
+        self.assertEqual((xd[0], xd[-1]), (0, 10006))
+        self.assertEqual(yd.max(), 3)
+        self.assertAlmostEqual(yd.min(), y.min())
+        xs, ys = spicereader.decimate(x[:50], y[:50], 100)
+        self.assertEqual(len(xs), 50)
+
+    def test_plot_zoom(self):
+        """plots are decimated, cached and redone when zoomed"""
+        fp = open('p.dat', 'w')
+        print>>fp, '#Time v(a)'
+        for i in range(5000):
+            print>>fp, i, i % 7
+        fp.close()
+        d = spicereader.GnucapData('p.dat')
+        self.assertTrue(d.decimated('va', 50) is d.decimated('va', 50))
+
+        pyl = spicereader.pyl
+        pyl.figure()
+        spicereader.SignalPlotter(d)('va')
+        line = pyl.gca().get_lines()[0]
+        self.assertTrue(len(line.get_xdata()) < 5000)
+        pyl.xlim(100, 120)
+        self.assertEqual(list(line.get_xdata()), range(100, 121))
+        pyl.close('all')
+
+    def test_zoom_released(self):
+        """closed figures don't keep their lines and data alive"""
+        fp = open('p.dat', 'w')
+        print>>fp, '#Time v(a)'
+        for i in range(500):
+            print>>fp, i % 100, i // 100
+        fp.close()
+        d = spicereader.GnucapData('p.dat')
+        pyl = spicereader.pyl
+        refs = []
+        for k in range(5):
+            pyl.figure()
+            spicereader.plotsweep(d, 's.va', plotter=pyl.plot)
+            refs.append(weakref.ref(pyl.gca().get_lines()[0]))
+            refs.append(weakref.ref(spicereader.plotsweep(d, 's.va')))
+            pyl.close('all')
+        gc.collect()
+        self.assertEqual([r() for r in refs], [None] * 10)
+
+
+class sweepPlots(tempdirTest):
+    """Tests stacked expression evaluation in plotsweep"""
+    def setUp(self):
+        tempdirTest.setUp(self)
+        fp = open('s.dat', 'w')
+        print>>fp, '#Time v(a)'
+        for sweep, n in enumerate([4, 4, 4, 3]):
+            for t in range(n):
+                print>>fp, t, 10*sweep + t
+        fp.close()
+        self.d = spicereader.GnucapData('s.dat')
+
+    def test_stacked(self):
+        """equal sweeps are evaluated once, ragged ones one by one"""
+        d = self.d
+        calls = []
+        def exp(s):
+            calls.append(s)
+            return s.va * 2
+        curves = spicereader.sweepcurves(d, exp, [0, 1, 2], vectorize=True)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(np.all(curves[1][1] == [20, 22, 24, 26]))
+        self.assertTrue(np.all(curves[1][0] == range(4)))
+        curves = spicereader.sweepcurves(d, 's.va - v', [1, 3], ivar='s.va',
+                                         vectorize=True)
+        self.assertTrue(np.all(curves[1][0] == [30, 31, 32]))
+        self.assertTrue(np.all(curves[1][1] == [27, 28, 29]))
+
+    def test_per_sweep_default(self):
+        """expressions that aren't element by element are right by default"""
+        curves = spicereader.sweepcurves(self.d, 's.va - s.va[0]', [1, 2])
+        self.assertTrue(np.all(curves[1][1] == range(4)))
+        curves = spicereader.sweepcurves(self.d, 's.va.max() + 0*s.x', [1, 2])
+        self.assertTrue(np.all(curves[0][1] == 13))
+
+    def test_plot(self):
+        """all sweeps are one LineCollection"""
+        d = self.d
+        pyl = spicereader.pyl
+        pyl.figure()
+        lc = spicereader.plotsweep(d, 's.va + 1', vals=[0, 1, 2])
+        segs = lc.get_segments()
+        self.assertEqual(len(segs), 3)
+        self.assertTrue(np.all(segs[2][:,1] == [21, 22, 23, 24]))
+        self.assertEqual(len(pyl.gca().get_legend().get_texts()), 3)
+        g = {'k': 1}
+        lc = spicereader.plotsweep(d, 's.va + k', vals=[0], globals=g)
+        g['k'] = 5
+        lc = spicereader.plotsweep(d, 's.va + k', vals=[0], globals=g)
+        self.assertTrue(np.all(lc.get_segments()[0][:,1] == [5, 6, 7, 8]))
+        pyl.close('all')
+
+    def test_curve_cache(self):
+        """string expressions are evaluated again only when data changes"""
+        d = self.d
+        calls = []
+        sweepcurves = spicereader.sweepcurves
+        def counted(*args):
+            calls.append(args[1])
+            return sweepcurves(*args)
+        spicereader.sweepcurves = counted
+        try:
+            pyl = spicereader.pyl
+            pyl.figure()
+            for k in range(2):
+                spicereader.plotsweep(d, 's.va + v', vals=[0, 1])
+            self.assertEqual(len(calls), 1)
+            d.nestSweeps([('temp', [0, 50, 100, 150])])
+            lc = spicereader.plotsweep(d, 's.va + v', vals=[0, 50])
+            self.assertEqual(len(calls), 2)
+            self.assertTrue(np.all(lc.get_segments()[1][:,1] ==
+                                   [60, 61, 62, 63]))
+            spicereader.plotsweep(d, lambda s: s.va, vals=[0])
+            spicereader.plotsweep(d, lambda s: s.va, vals=[0])
+            self.assertEqual(len(calls), 4)
+            pyl.close('all')
+        finally:
+            spicereader.sweepcurves = sweepcurves
+
+
+class batchLoading(tempdirTest):
+    """Tests parallel loading of several files into one data set"""
+    def writeCorner(self, fname, offset, cols='#Time v(a)'):
+        fp = open(fname, 'w')
+        print>>fp, cols
+        for sweep in range(2):
+            for t in range(3):
+                print>>fp, t, offset + 10*sweep + t
+        fp.close()
+
+    def test_merge(self):
+        files = ['c%i.dat' % i for i in range(3)]
+        for i, f in enumerate(files):
+            self.writeCorner(f, 100*i)
+        for i in range(2):
+            # second pass maps the cached files
+            d = spicereader.loadSimDataBatch(files, jobs=2)
+            self.assertEqual(d.files, files)
+            self.assertEqual(d.sweepvars, ['file', 'sweep'])
+            self.assertEqual(d.sweepvals[3], (1, 1))
+            self.assertTrue(np.all(d.getSweep((2, 1)).va == [210, 211, 212]))
+            self.assertEqual(d.ndsig('va').shape, (3, 2, 3))
+            self.assertTrue(np.all(d.ndsig('va')[1, 0] == [100, 101, 102]))
+            self.assertTrue(isinstance(d.getSweep((1, 0)).data, np.memmap))
+        # only the files are cached, the merge is a view of them
+        self.assertEqual(len(os.listdir('cache')), 6)
+        self.assertTrue(np.all(d.va[4:8] == [11, 12, 100, 101]))
+        self.assertTrue(np.all(d.data[4:8][:, 1] == [11, 12, 100, 101]))
+        self.assertEqual(np.asarray(d.data).shape, (18, 2))
+        self.assertEqual(d.measMinMax('va')[2][-1], 212)
+
+    def test_chunked_cache(self):
+        """workers convert into the parent's kind of cache"""
+        files = ['c%i.dat' % i for i in range(3)]
+        for i, f in enumerate(files):
+            self.writeCorner(f, 100*i)
+        cache = spicereader.ChunkedCache('zcache', codec='bz2')
+        d = spicereader.loadSimDataBatch(files, jobs=2, cache=cache)
+        self.assertTrue(np.all(d.getSweep((1, 0)).va == [100, 101, 102]))
+        exts = set(os.path.splitext(f)[1] for f in os.listdir('zcache'))
+        self.assertFalse('.npy' in exts)
+        self.assertEqual(len([f for f in os.listdir('zcache')
+                              if f.endswith('.wfz')]), 3)
+        self.assertTrue(np.all(d.va[2:4] == [2, 10]))
+
+    def test_mismatch(self):
+        self.writeCorner('a.dat', 0)
+        self.writeCorner('b.dat', 0, '#Time v(b)')
+        self.assertRaises(ValueError, spicereader.loadSimDataBatch,
+                          ['a.dat', 'b.dat'], jobs=1)
+
+
+class chunkedCache(tempdirTest):
+    """Tests the compressed chunk store"""
+    def setUp(self):
+        tempdirTest.setUp(self)
+        fp = open('w.dat', 'w')
+        print>>fp, '#Time v(a) v(b)'
+        for sweep in range(2):
+            for t in range(50):
+                print>>fp, t * 1e-9, np.sin(t / 5.0) + sweep, 0.25 * t
+        fp.close()
+        self.rows = np.loadtxt('w.dat')
+
+    def cache(self, **kwargs):
+        return spicereader.ChunkedCache(os.path.join(self.tmp, 'cache'),
+                                        chunkrows=16, **kwargs)
+
+    def test_roundtrip(self):
+        """every codec and filter gives back the exact values"""
+        for codec in sorted(spicereader._codecs):
+            for filter in (None, 'shuffle', 'delta'):
+                cache = self.cache(codec=codec, filter=filter)
+                for i in range(2):
+                    d = spicereader.GnucapData('w.dat', cache)
+                    self.assertTrue(isinstance(d.data,
+                                               spicereader.ChunkedArray))
+                    self.assertTrue(np.all(np.asarray(d.data) == self.rows))
+                    self.assertTrue(np.all(d.getSweep(1).va ==
+                                           self.rows[50:,1]))
+                    self.assertEqual(d.ndsig('vb').shape, (2, 50))
+
+    def test_random_access(self):
+        """an xrange window only decompresses its chunks"""
+        d = spicereader.GnucapData('w.dat', self.cache())
+        d.data._chunks.clear()
+        d.xrange((20e-9, 30e-9))
+        self.assertTrue(np.all(d.vb == self.rows[20:31,2]))
+        self.assertEqual(sorted(d.data._chunks), [(2, 1)])
+        self.assertTrue(np.all(d.data[[3, 40, 99], 1] ==
+                               self.rows[[3, 40, 99], 1]))
+        self.assertTrue(np.all(d.data[60:40:-3, 0] == self.rows[60:40:-3, 0]))
+
+    def test_float32(self):
+        d = spicereader.GnucapData('w.dat', self.cache(float32=True))
+        self.assertEqual(d.va.dtype, np.float32)
+        self.assertTrue(np.allclose(d.va, self.rows[:,1], atol=1e-6))
+        self.assertRaises(ValueError, self.cache, codec='rar')
+
+
+class followMode(tempdirTest):
+    """Tests incremental loading of files still being written"""
+    def test_gnucap(self):
+        fp = open('f.dat', 'w')
+        fp.write('#Time v(a)\n0 0\n1 1')
+        fp.flush()
+        d = spicereader.GnucapData('f.dat', follow=True)
+        self.assertEqual(list(d.va), [0])
+        self.assertEqual(d.refresh(), 0)
+        fp.write('0\n2 20\n0 5\n')
+        fp.flush()
+        d.xrange((0, 1))
+        self.assertEqual(d.refresh(), 3)
+        self.assertEqual(list(d.va), [0, 10])
+        self.assertEqual(d.sweeprows, [(0, 3), (3, 4)])
+
+        # a new reader resumes from the cache
+        fp.write('1 6\n')
+        fp.close()
+        self.assertNotEqual(spicereader.defaultCache.resume(d.key, 'f.dat'),
+                            None)
+        e = spicereader.GnucapData('f.dat', follow=True)
+        self.assertEqual(e._state['nrows'], 5)
+        self.assertEqual(list(e.getSweep(1).va), [5, 6])
+        self.assertTrue(np.all(d.data[:4] == e.data[:4]))
+
+        # changed contents start over
+        open('f.dat', 'w').write('#Time v(a)\n0 7\n')
+        e = spicereader.GnucapData('f.dat', follow=True)
+        self.assertEqual(list(e.va), [7])
+
+    def test_hspice(self):
+        """data appears a complete block at a time"""
+        rows = np.arange(30, dtype=float).reshape(10, 3)
+        sweeps = [((1.5,), rows), ((2.5,), rows[:7] + 100)]
+        writeHspice('full.tr0', ['TIME', 'v(out', 'v(in'], sweeps,
+                    sweepvars=['temper'], blockvals=7)
+        full = open('full.tr0', 'rb').read()
+        fp = open('f.tr0', 'wb')
+        fp.write(full[:100])
+        fp.flush()
+        d = spicereader.HspiceData('f.tr0', follow=True)
+        self.assertEqual(d.refresh(), 0)
+        for cut in range(150, len(full) + 60, 60):
+            fp.write(full[fp.tell():cut])
+            fp.flush()
+            d.refresh()
+            if d.sweeprows:
+                self.assertTrue(np.all(d.getSweep(0).vin == rows[:len(d.x),2]))
+        fp.close()
+        self.assertEqual(d.sweepvals, [1.5, 2.5])
+        self.assertEqual(d.sweeprows, [(0, 10), (10, 17)])
+        self.assertTrue(np.all(d.getSweep(1).vout == rows[:7,1] + 100))
+
+    def test_plotter(self):
+        fp = open('f.dat', 'w')
+        fp.write('#Time v(a)\n0 0\n1 1\n')
+        fp.flush()
+        d = spicereader.GnucapData('f.dat', follow=True)
+        spicereader.pyl.figure()
+        p = spicereader.SignalPlotter(d)
+        p('va')
+        fp.write('2 4\n')
+        fp.close()
+        self.assertEqual(p.refresh(), 1)
+        self.assertEqual(list(p.lines[0][0].get_ydata()), [0, 1, 4])
+        self.assertTrue(p.follow(100) is p.timer)
+        spicereader.pyl.close('all')
+
+
+class streamingStats(tempdirTest):
+    """Tests blockwise signal statistics"""
+    def test_stats(self):
+        rng = np.random.RandomState(3)
+        rows = np.column_stack([np.arange(1000.0), rng.randn(1000),
+                                rng.rand(1000)])
+        np.savetxt('r.dat', rows, header='Time v(a) v(b)', comments='#')
+        d = spicereader.GnucapData('r.dat')
+        for jobs in (None, 3):
+            st = d.stats(['va', 'vb'], bins=8, thresholds=(0, 0.5),
+                         blockrows=64, jobs=jobs)
+            a = st['va']
+            self.assertEqual(a['count'], 1000)
+            self.assertEqual(a['min'], rows[:,1].min())
+            self.assertEqual(a['tmax'], rows[:,1].argmax())
+            self.assertAlmostEqual(a['mean'], rows[:,1].mean())
+            self.assertAlmostEqual(a['rms'], np.sqrt((rows[:,1]**2).mean()))
+            self.assertEqual(a['above'], [np.sum(rows[:,1] > 0),
+                                          np.sum(rows[:,1] > 0.5)])
+            counts, edges = np.histogram(rows[:,2], 8)
+            self.assertTrue(np.all(st['vb']['hist'][0] == counts))
+            self.assertTrue(np.allclose(st['vb']['hist'][1], edges))
+
+        d.xrange((100, 199))
+        st = d.stats('vb', bins=[0, 0.5, 1], blockrows=30)['vb']
+        self.assertEqual(st['count'], 100)
+        self.assertEqual(st['max'], rows[100:200,2].max())
+        self.assertEqual(st['hist'][0].sum(), 100)
+
+
+class waveformDiff(tempdirTest):
+    """Tests comparing runs on a common time base"""
+    def writeRun(self, fname, t, delay, gain):
+        fp = open(fname, 'w')
+        print>>fp, '#Time v(a) v(b) v(c)'
+        for x in t:
+            print>>fp, x, np.sin(x - delay), gain * np.cos(x), 0.5
+        fp.close()
+        return spicereader.GnucapData(fname)
+
+    def test_compare(self):
+        ref = self.writeRun('ref.dat', np.linspace(0, 10, 2001), 0, 1)
+        red = self.writeRun('red.dat', np.linspace(0, 10, 1501) ** 1.01 /
+                            10 ** 0.01, 0.01, 1.1)
+        res = ref.compare(red, abstol=1e-3, reltol=0.02, timetol=0.02,
+                          groupsize=2)
+        self.assertEqual(res.keys(), ['va', 'vb', 'vc'])
+        a, b, c = res['va'], res['vb'], res['vc']
+        self.assertTrue(a['passed'])
+        self.assertAlmostEqual(a['shift'], 0.01, 3)
+        self.assertEqual(a['ncross'], (4, 4))
+        self.assertTrue(0.009 < a['maxerr'] < 0.011)
+        self.assertFalse(b['passed'])
+        self.assertAlmostEqual(b['maxerr'], 0.1, 3)
+        self.assertAlmostEqual(b['rmserr'], 0.1 / np.sqrt(2), 2)
+        self.assertTrue(c['passed'])
+        self.assertEqual(c['ncross'], (0, 0))
+
+        res = ref.compare(red, sigs='va', timetol=0.001)
+        self.assertFalse(res['va']['passed'])
+        red.xrange((0, 5))
+        self.assertEqual(ref.compare(red, 'va')['va']['ncross'], (2, 2))
+
+
+class waveformCache(tempdirTest):
+    """Tests the shared conversion cache"""
+    def writeData(self, fname, nrows=100):
+        fp = open(fname, 'w')
+        print>>fp, '#Time v(a)'
+        for i in range(nrows):
+            print>>fp, i, 2*i
+        fp.close()
+
+    def test_sidecar(self):
+        """entries are keyed by content and carry their metadata"""
+        self.writeData('a.dat')
+        cache = spicereader.defaultCache
+        key = cache.key('a.dat')
+        spicereader.GnucapData('a.dat')
+        data, meta = cache.load(key)
+        self.assertTrue(np.all(data[:,1] == 2*np.arange(100)))
+        self.assertEqual(meta['cols'], ['#Time', 'v(a)'])
+        self.assertEqual(meta['shape'], [100, 2])
+        self.assertEqual(meta['dtype'], '<f8')
+        self.assertEqual(sorted(os.listdir('cache')),
+                         [key + '.json', key + '.npy'])
+        self.writeData('a.dat', 50)
+        self.assertNotEqual(cache.key('a.dat'), key)
+        self.assertEqual(spicereader.GnucapData('a.dat').data.shape, (50, 2))
+
+    def test_evict(self):
+        """least recently used entries go first"""
+        cache = spicereader.defaultCache
+        for f in 'abc':
+            self.writeData(f + '.dat')
+            spicereader.GnucapData(f + '.dat')
+            os.utime(cache.path(cache.key(f + '.dat'), '.json'),
+                     (0, 'bca'.index(f)))
+        size = os.path.getsize(cache.path(cache.key('a.dat')))
+        cache.budget = 2 * size + 1000
+        cache.evict()
+        self.assertEqual(cache.load(cache.key('b.dat')), None)
+        self.assertNotEqual(cache.load(cache.key('a.dat')), None)
+        self.assertNotEqual(cache.load(cache.key('c.dat')), None)
+
+    def test_unwritable(self):
+        """an unusable cache directory still loads the data"""
+        open('cache', 'w').close()
+        self.writeData('a.dat')
+        d = spicereader.GnucapData('a.dat')
+        self.assertEqual(d.data.shape, (100, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+"""Unit test stuff for spicerunner.py"""
+
+__author__ = "Dan White (etihwnad@gmail.com)"
+__copyright__ = "Copyright (c) 2007 Dan White"
+__license__ = "GPL"
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import matplotlib
+matplotlib.use('Agg')
+
+import spicereader
+import spicerunner
+import pyspice
+
+# stands in for a simulator: the output scales with the number of
+# resistors, each call is counted in 'calls'
+STUB = """
+import sys
+netlist = open(sys.argv[1]).read()
+open(%r, 'a').write('x')
+if 'fail' in netlist:
+    sys.exit(3)
+n = len([l for l in netlist.split('\\n') if l.startswith('r')])
+print '#Time v(out)'
+for t in range(4):
+    print t, n * t
+"""
+
+
+class runner(unittest.TestCase):
+    """Tests running netlists and reusing their results"""
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        self.calls = os.path.join(self.tmp, 'calls')
+        open('stub.py', 'w').write(STUB % self.calls)
+        self.cache = spicereader.WaveformCache(os.path.join(self.tmp, 'cache'))
+        command = '%s %s {netlist}' % (sys.executable,
+                                       os.path.join(self.tmp, 'stub.py'))
+        self.runner = spicerunner.Runner(command, 'runs', jobs=2, ext='.dat',
+                                         cache=self.cache)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def ncalls(self):
+        return len(open(self.calls).read()) if os.path.exists(self.calls) \
+               else 0
+
+    def test_run_and_reuse(self):
+        """results are keyed by netlist text, duplicates run once"""
+        nets = ['t\nr1 a b 1\n.end\n', 't\nr1 a b 1\nr2 b 0 1\n.end\n']
+        results = self.runner.run(nets + nets[:1])
+        self.assertEqual(self.ncalls(), 2)
+        self.assertEqual([r.status for r in results], [0, 0, 0])
+        self.assertEqual([r.cached for r in results], [False] * 3)
+        self.assertTrue(results[0] is results[2])
+        self.assertEqual(list(results[1].data.vout), [0, 2, 4, 6])
+        self.assertTrue(results[0].walltime > 0)
+
+        again = self.runner.run(nets[1:])
+        self.assertEqual(self.ncalls(), 2)
+        self.assertTrue(again[0].cached)
+        self.assertEqual(again[0].walltime, results[1].walltime)
+        self.assertEqual(list(again[0].data.vout), [0, 2, 4, 6])
+
+        other = spicerunner.Runner(self.runner.command + ' -x', 'runs',
+                                   ext='.dat')
+        self.assertNotEqual(other.key(nets[0]), self.runner.key(nets[0]))
+
+    def test_failure(self):
+        """failed runs report their status and are run again"""
+        r, = self.runner.run(['t\n* fail\n.end\n'])
+        self.assertEqual(r.status, 3)
+        self.assertEqual(r.data, None)
+        self.assertTrue(os.path.exists(r.log))
+        r, = self.runner.run(['t\n* fail\n.end\n'])
+        self.assertEqual(self.ncalls(), 2)
+        self.assertFalse(r.cached)
+        self.assertEqual(os.listdir('runs'), [r.key])
+
+    def test_netlist(self):
+        """a pyspice Netlist is written out with .end"""
+        nlist = pyspice.Netlist(title='title\n')
+        for card in ['r1 a b 1', 'r2 b 0 2', 'c1 b 0 1p']:
+            nlist.addElement(nlist.classify(card))
+        text = spicerunner.netlistText(nlist)
+        self.assertEqual(text, 'title\nr1 a b 1.0\nr2 b 0 2.0\nc1 b 0 1e-12\n'
+                               '.end\n')
+        r, = self.runner.run([nlist])
+        self.assertEqual(list(r.data.vout), [0, 2, 4, 6])
+
+
+if __name__ == "__main__":
+    unittest.main()